@@ -28,6 +28,13 @@ import seaborn as sns
 # from pygeos import Geometry
 
 from globals import *       # Imports the filepaths defined in globals.py
+from zonal import zonal_population_sums, read_population, rasterise_districts, rasterise_mask, read_mask_on_grid
+from zonal import signed_distance_to_cropland, buffer_population_curves
+from raster_tools import open_grid_store, grid_cells, grid_points
+from buffer_tools import generate_buffer, run_district_buffer, run_buffers_parallel, partition_by_district, write_partitions
+from sweep import DISTRICT_COLUMNS, run_sweep
+from vector_tools import points_within
+from profiling import span, span_counts
 
 print('Packages imported.\n')
 
@@ -38,18 +45,27 @@ start_time = time.time()
 # 1. LOAD DATA
 
 # Read in the output files from script 01B: 
-#   1. WorldPop points
+#   1. WorldPop grid (memory-mapped, see raster_tools.write_grid_store), converted into points of the populated cells
 #   2. Landcover (cropland)
 #   3. GHSL rural polygons
 
 time_11s = time.time()
 
+# WorldPop points are only built for the vector aggregation or vector buffer method (the raster methods read the grid directly)
+use_points = aggregation_method == 'vector' or buffer_method == 'vector'
+
+with span('03_load_worldpop'):
+        pop_grid, pop_grid_transform, pop_grid_crs = open_grid_store(pop_grid_path)
+        span_counts(pixels=pop_grid.size)
+        if use_points:
+                pop_cells = grid_cells(pop_grid)
+                gdf_pop = grid_points(pop_grid, pop_grid_transform, pop_grid_crs, pop_cells)
+                span_counts(points=len(gdf_pop))
+
 if sfmt == '.shp':
-        gdf_pop = gpd.read_file(pop_points)
         gdf_crops = gpd.read_file(cropland_poly_dissolved)
         gdf_ghsl = gpd.read_file(ghsl_poly_dissolved)
 elif sfmt == '.feather':
-        gdf_pop = gpd.read_feather(pop_points)
         gdf_crops = gpd.read_feather(cropland_poly_dissolved)
         gdf_ghsl = gpd.read_feather(ghsl_poly_dissolved)
     
@@ -68,33 +84,43 @@ timestamp(time_11s)
 
 # ===========
 # 2.1 Join WorldPop to GHSL rural areas
-time_21s = time.time()
+#       Only required for the vector aggregation or vector buffer method
+pop_points_rural = None
+if use_points:
+        time_21s = time.time()
 
-# Join points to GHSL
-pop_points_rural = gdf_pop.sjoin(gdf_ghsl, how = 'inner', predicate='within')
-pop_points_rural = pop_points_rural.drop(columns='index_right')
+        # Join points to GHSL (STRtree point-in-polygon test against the pieces of the dissolved polygon; see vector_tools.py)
+        with span('03_join_rural', points=len(gdf_pop)):
+                rural_within = points_within(gdf_pop.geometry.values, gdf_ghsl.geometry.values)
+                pop_points_rural = gdf_pop[rural_within].reset_index(drop=True)
+                span_counts(rural_points=len(pop_points_rural))
 
-# Export the filtered rural population
-# pop_points_rural.to_feather(pop_points_rural_path)    
-print(f'Rural population points gdf created.\n')
+        # Export the grid cells of the rural population (each worker process rebuilds the points from the shared WorldPop grid
+        #       when the buffer iteration is run in parallel)
+        if buffer_method == 'vector' and buffer_workers > 1 and not partition_districts:
+                np.save(pop_rural_cells_path, pop_cells[rural_within])
+        print(f'Rural population points gdf created.\n')
 
-timestamp(time_21s)
+        timestamp(time_21s)
 
 # pop_points_rural.plot(column='raster_value')
 # plt.show()
 
 # ===========
 # 2.2 Join WorldPop to DynamicWorld cropland areas
-time_22s = time.time()
+#       Only required for the vector aggregation method (raster method uses the cropland mask directly)
+if aggregation_method == 'vector':
+        time_22s = time.time()
 
-# Join points to cropland
-pop_joined_dw = gdf_pop.sjoin(gdf_crops, how='inner', predicate='within')
-# pop_points_cropland = pop_joined_dw.loc[pop_joined_dw['cropland']==1]     # remove here because now filtered in script 01C
-pop_points_cropland = pop_joined_dw.drop(columns='index_right')
-pop_points_cropland.to_feather(pop_points_cropland_path)
-print(f'Cropland population points gdf created and exported to {sfmt}.\n')
+        # Join points to cropland
+        with span('03_join_cropland', points=len(gdf_pop)):
+                pop_points_cropland = gdf_pop[points_within(gdf_pop.geometry.values, gdf_crops.geometry.values)].reset_index(drop=True)
+                span_counts(cropland_points=len(pop_points_cropland))
+        # pop_points_cropland = pop_joined_dw.loc[pop_joined_dw['cropland']==1]     # remove here because now filtered in script 01C
+        pop_points_cropland.to_feather(pop_points_cropland_path)
+        print(f'Cropland population points gdf created and exported to {sfmt}.\n')
 
-timestamp(time_22s)
+        timestamp(time_22s)
 
 # pop_points_cropland.plot(column='raster_value')
 # plt.show()
@@ -124,64 +150,99 @@ print('Census ADP counts joined to district boundaries.\n')
 timestamp(time_31s)
 
 
-# ===========
-# 3.2 Join WorldPop points to district boundaries
-time_32s = time.time()
+if aggregation_method == 'vector':
+        # ===========
+        # 3.2 Join WorldPop points to district boundaries
+        time_32s = time.time()
 
-# This joins the attributes of the points to the polygons they fall within
-pop_jn_districts = gdf_pop.sjoin(districts_shp, how='inner', predicate='within')
+        # This joins the attributes of the points to the polygons they fall within
+        with span('03_sjoin_districts_all', points=len(gdf_pop)):
+                pop_jn_districts = gdf_pop.sjoin(districts_shp, how='inner', predicate='within')
 
-# Dissolve points to calculate aggregated population for district
-dissolve_df = pop_jn_districts[['raster_value', 'geometry', 'pc11_d_id', 'd_name']]
-sum_pop_districts = dissolve_df.dissolve(by = 'pc11_d_id', as_index=False, aggfunc={'raster_value':'sum',
-                                                                                    'd_name':'first'})
-sum_pop_districts['raster_value'] = sum_pop_districts['raster_value'].round()         # remove unnecessary decimals
+        # Dissolve points to calculate aggregated population for district
+        dissolve_df = pop_jn_districts[['raster_value', 'geometry', 'pc11_d_id', 'd_name']]
+        with span('03_dissolve_districts_all', points=len(dissolve_df)):
+                sum_pop_districts = dissolve_df.dissolve(by = 'pc11_d_id', as_index=False, aggfunc={'raster_value':'sum',
+                                                                                                    'd_name':'first'})
+        sum_pop_districts['raster_value'] = sum_pop_districts['raster_value'].round()         # remove unnecessary decimals
 
-# Export the worldpop points by district
-sum_pop_districts.to_feather(sum_pop_districts_path)  
+        # Export the worldpop points by district
+        sum_pop_districts.to_feather(sum_pop_districts_path)  
 
-print(f'Pop points joined to district boundaries and exported to {sfmt}.\n')
-timestamp(time_32s)
+        print(f'Pop points joined to district boundaries and exported to {sfmt}.\n')
+        timestamp(time_32s)
 
 
-# ===========
-# 3.3 Join WorldPop RURAL points to district boundaries
-time_33s = time.time()
+        # ===========
+        # 3.3 Join WorldPop RURAL points to district boundaries
+        time_33s = time.time()
+
+        # This joins the attributes of the points to the polygons they fall within
+        with span('03_sjoin_districts_rural', points=len(pop_points_rural)):
+                rupop_jn_districts = pop_points_rural.sjoin(districts_shp, how='inner', predicate='within')
+
+        # Dissolve points to calculate aggregated population for district
+        dissolve_df = rupop_jn_districts[['raster_value', 'geometry', 'pc11_d_id', 'd_name']]
+        with span('03_dissolve_districts_rural', points=len(dissolve_df)):
+                sum_rupop_districts = dissolve_df.dissolve(by = 'pc11_d_id', as_index=False, aggfunc={'raster_value':'sum',
+                                                                                                      'd_name':'first'})
+        sum_rupop_districts['raster_value'] = sum_rupop_districts['raster_value'].round()
+
+        # Export the rural points by district
+        sum_rupop_districts.to_feather(sum_rupop_districts_path)  
 
-# This joins the attributes of the points to the polygons they fall within
-rupop_jn_districts = pop_points_rural.sjoin(districts_shp, how='inner', predicate='within')
+        print(f'Rural pop points joined to district boundaries and export to {sfmt}.\n')
+        timestamp(time_33s)
 
-# Dissolve points to calculate aggregated population for district
-dissolve_df = rupop_jn_districts[['raster_value', 'geometry', 'pc11_d_id', 'd_name']]
-sum_rupop_districts = dissolve_df.dissolve(by = 'pc11_d_id', as_index=False, aggfunc={'raster_value':'sum',
-                                                                                      'd_name':'first'})
-sum_rupop_districts['raster_value'] = sum_rupop_districts['raster_value'].round()
 
-# Export the rural points by district
-sum_rupop_districts.to_feather(sum_rupop_districts_path)  
+        # ===========
+        # 3.4 Join WorldPop CROPLAND points to district boundaries
+        time_34s = time.time()
 
-print(f'Rural pop points joined to district boundaries and export to {sfmt}.\n')
-timestamp(time_33s)
+        # This joins the attributes of the points to the polygons they fall within
+        with span('03_sjoin_districts_cropland', points=len(pop_points_cropland)):
+                crpop_jn_districts = pop_points_cropland.sjoin(districts_shp, how='inner', predicate='within')
+
+        # Dissolve points to calculate aggregated population for district
+        dissolve_df = crpop_jn_districts[['raster_value', 'geometry', 'pc11_d_id', 'd_name']]
+        with span('03_dissolve_districts_cropland', points=len(dissolve_df)):
+                sum_crpop_districts = dissolve_df.dissolve(by = 'pc11_d_id', as_index=False, aggfunc={'raster_value':'sum',
+                                                                                                      'd_name':'first'})
+        sum_crpop_districts['raster_value'] = sum_crpop_districts['raster_value'].round()
+
+        # Export the cropland points by district
+        sum_crpop_districts.to_feather(sum_crpop_districts_path)  
+
+        print(f'Cropland pop points joined to district boundaries and exported to {sfmt}.\n')
+        timestamp(time_34s)
 
 
 # ===========
-# 3.4 Join WorldPop CROPLAND points to district boundaries
-time_34s = time.time()
+# 3.5 Raster aggregation of WorldPop (all, rural, cropland) to district boundaries
+#       Replaces 3.2 - 3.4: district ids, GHSL rural and DynamicWorld cropland are rasterised onto the WorldPop grid,
+#       and the three sums are calculated with a single np.bincount pass (no point geometries required)
+elif aggregation_method == 'raster':
+        time_35s = time.time()
 
-# This joins the attributes of the points to the polygons they fall within
-crpop_jn_districts = pop_points_cropland.sjoin(districts_shp, how='inner', predicate='within')
+        with span('03_zonal_sums', pixels=pop_grid.size, districts=len(districts_shp)):
+                zonal_df = zonal_population_sums(pop_grid_path, districts_shp, gdf_ghsl, gdf_crops)
+        zonal_gdf = districts_shp[['pc11_d_id', 'd_name', 'geometry']].merge(zonal_df, how='left', on='pc11_d_id')
 
-# Dissolve points to calculate aggregated population for district
-dissolve_df = crpop_jn_districts[['raster_value', 'geometry', 'pc11_d_id', 'd_name']]
-sum_crpop_districts = dissolve_df.dissolve(by = 'pc11_d_id', as_index=False, aggfunc={'raster_value':'sum',
-                                                                                      'd_name':'first'})
-sum_crpop_districts['raster_value'] = sum_crpop_districts['raster_value'].round()
+        # Format outputs to match the dissolved point files from the vector method
+        sum_pop_districts = zonal_gdf[['pc11_d_id', 'geometry', 'worldpop', 'd_name']].rename(columns={'worldpop':'raster_value'})
+        sum_pop_districts = sum_pop_districts.dropna(subset=['raster_value'])
+        sum_rupop_districts = zonal_gdf[['pc11_d_id', 'geometry', 'worldpop_rural', 'd_name']].rename(columns={'worldpop_rural':'raster_value'})
+        sum_rupop_districts = sum_rupop_districts.dropna(subset=['raster_value'])
+        sum_crpop_districts = zonal_gdf[['pc11_d_id', 'geometry', 'worldpop_crop', 'd_name']].rename(columns={'worldpop_crop':'raster_value'})
+        sum_crpop_districts = sum_crpop_districts.dropna(subset=['raster_value'])
 
-# Export the cropland points by district
-sum_crpop_districts.to_feather(sum_crpop_districts_path)  
+        # Export the worldpop sums by district
+        sum_pop_districts.to_feather(sum_pop_districts_path)
+        sum_rupop_districts.to_feather(sum_rupop_districts_path)
+        sum_crpop_districts.to_feather(sum_crpop_districts_path)
 
-print(f'Cropland pop points joined to district boundaries and exported to {sfmt}.\n')
-timestamp(time_34s)
+        print(f'WorldPop raster aggregated to district boundaries and exported to {sfmt}.\n')
+        timestamp(time_35s)
 
 
 # ==================================================================================================================
@@ -220,6 +281,9 @@ masterdf = masterdf.merge(df_rural_area, how='left', on=['pc11_d_id'], suffixes=
 
 masterdf.drop(columns='district_area_y', inplace=True)
 
+# Keep the columns that do not depend on ADPcn or tru_cat, for the sweep (section 7)
+district_df = masterdf[DISTRICT_COLUMNS].copy()
+
 # ==================================================================================================================
 # 5. CALCULATE DIFFERENCE IN POPULATION ESTIMATES
 
@@ -278,18 +342,9 @@ masterdf.drop(columns='geometry', inplace=True)
 masterdf.head()
 
 # Add column to flag districts that need a buffer
-# Use defined function with conditional rules: categorise_buffer
-# Apply conditional rows to each row of masterdf
-if ADPcn == 'ADPc3':
-        masterdf['need_buffer'] = masterdf.apply(lambda row: categorise_buffer(row, 'd_pc3'), axis=1)
-elif ADPcn == 'ADPc5':
-        masterdf['need_buffer'] = masterdf.apply(lambda row: categorise_buffer(row, 'd_pc5'), axis=1)
-elif ADPcn == 'ADPc1':
-        masterdf['need_buffer'] = masterdf.apply(lambda row: categorise_buffer(row, 'd_pc1'), axis=1)
-elif ADPcn == 'ADPc2':
-        masterdf['need_buffer'] = masterdf.apply(lambda row: categorise_buffer(row, 'd_pc2'), axis=1)
-elif ADPcn == 'ADPc4':
-        masterdf['need_buffer'] = masterdf.apply(lambda row: categorise_buffer(row, 'd_pc4'), axis=1)
+# Use defined function with conditional rules: categorise_buffer (vectorised over all ADP definitions at once)
+need_buffers = categorise_buffers(masterdf)
+masterdf['need_buffer'] = need_buffers[f'need_buffer_{ADPcn}']
 
 
 # Identify districts where the ADPc5 > worldpop_rural (more agricultural population than total rural population). 
@@ -313,108 +368,25 @@ print('Master results file exported to csv.\n')
 # 6. BUFFER ITERATION
 
 # =====================
-# 6.1 Define a function to create a buffer and recalculate the ADP estimate
+# 6.1 Function to create a buffer and recalculate the ADP estimate (generate_buffer, defined in buffer_tools.py)
 
 # Where:
 # 1. district_shp = districts_shp   
 # 2. crops_shp = gdf_crops
 # 3. rural_points = pop_points_rural
-# 4. district_code = string format of district code
-# 5. buffer_radius = set accordingly; default 50m
-# 6. buffer_type = 'enlarge' or 'reduce'
-
-def generate_buffer(districts_shp, crops_shp, rural_points, district_code, buffer_radius, buffer_type):
-        """
-        Generate a buffer around cropland area in district
-        ...
-
-        Arguments
-        ---------
-        districts_shp   : polygon of district boundaries
-        crops_shp       : polygon of cropland in state (or district)
-        rural_points    : vector grid of population points in rural areas
-        district_code   : census designated identifier of district
-        buffer_radius   : radius (in absolute m) of buffer to be generated
-        buffer_type     : takes one of 'enlarge', 'subtract', 'unchanged'
-
-        Returns
-        -------
-        check_buffer    : GeoDataFrame with 1 row, containing buffer details tied to district geometry 
-        d_buffer_gdf    : GeoDataFrame with 1 row, containing polygon of buffered zone
-
-        """
-        time_buff = time.time()
-
-        # Define district boundaries
-        district_boundary = districts_shp.loc[districts_shp['pc11_d_id'] == district_code]
-        crop_by_district_boundary = gpd.overlay(crops_shp, district_boundary, how='intersection')
-
-        # Convert to a Geoseries
-        district_series = crop_by_district_boundary['geometry']
-
-        # Convert buffer metre input into degrees (WGS84)
-        if buffer_type == 'enlarge':
-                degrees = buffer_radius * (0.00001/1.11)        # Transformation required if CRS is geographic (WGS84, EPSG:4326)
-        elif buffer_type == 'subtract':
-                buffer_radius = buffer_radius * -1              # negative buffer radius = reduction in size
-                degrees = buffer_radius * (0.00001/1.11)       
-        elif buffer_type == 'unchanged':
-                degrees = 0                                     # No buffer required (type == 'unchanged')
-
-        print('Creating ' + str(buffer_radius) + 'm buffers on crop lands for district: ' + district_code)  
-
-        # Calculate buffer
-        d_buffer = district_series.buffer(degrees)
-        d_buffer.name = 'geometry'
-        d_buffer_gdf = gpd.GeoDataFrame(d_buffer, crs="EPSG:4326", geometry='geometry')
-        d_buffer_gdf['pc11_d_id'] = district_code
-
-        # Join rural points to buffer zone
-        ru_points_buffer = rural_points.sjoin(d_buffer_gdf, how='inner', predicate='within')
-        ru_points_buffer = ru_points_buffer.drop(columns='index_right')
-
-        # Dissolve points to calculate aggregated population for district
-        sum_buffer_points = ru_points_buffer.dissolve(as_index=False, aggfunc={'raster_value':'sum'})
-        sum_buffer_points['raster_value'] = sum_buffer_points['raster_value'].round()
-
-        # Add district code and buffer radius to geodataframe
-        sum_buffer_points['pc11_d_id'] = district_code
-        sum_buffer_points['buffer_r'] = buffer_radius
-
-        print(f'Rural pop points joined to buffer area and new ADP calculated.')
-
-        # Merge census data from masterdf
-        if ADPcn == 'ADPc3':
-                ADPcn_pctotal = 'ADPc3_pctotal'
-        elif ADPcn == 'ADPc5':
-                ADPcn_pctotal = 'ADPc5_pctotal'
-        elif ADPcn == 'ADPc1':
-                ADPcn_pctotal = 'ADPc1_pctotal'
-        elif ADPcn == 'ADPc2':
-                ADPcn_pctotal = 'ADPc2_pctotal'
-        elif ADPcn == 'ADPc4':
-                ADPcn_pctotal = 'ADPc4_pctotal'
-        
-        check_buffer = sum_buffer_points.merge(masterdf[['pc11_d_id', 'Population', 'crop_area_pc', 'rural_area_pc', ADPcn_pctotal, 'need_buffer']]
-                                               , how='left', on='pc11_d_id')
-
-        check_buffer['buffered_pctotal'] = check_buffer['raster_value']/check_buffer['Population']*100
-        check_buffer['d_bufferedpc'] = check_buffer[ADPcn_pctotal] - check_buffer['buffered_pctotal']
-
-        # Next apply conditional rows to each row of masterdf
-        check_buffer['revised_buffer'] = check_buffer.apply(lambda row: buffer_logic(row, 'need_buffer', 'd_bufferedpc'), axis=1)
-
-        timestamp(time_buff)
-        return check_buffer, d_buffer_gdf
+# 4. masterdf = masterdf
+# 5. district_code = string format of district code
+# 6. buffer_radius = set accordingly; default 50m
+# 7. buffer_type = 'enlarge' or 'reduce'
 
 # # TEST RUN
-# sum_buffer_gdf = generate_buffer(districts_shp, gdf_crops, pop_points_rural, '583', 50, 'subtract')
+# sum_buffer_gdf = generate_buffer(districts_shp, gdf_crops, pop_points_rural, masterdf, '583', 50, 'subtract')
 
 # # TEST ZERO BUFFER
-# sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, '518', 50, 'unchanged')
+# sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, masterdf, '518', 50, 'unchanged')
 
 # # TEST INPUT 'UNCHANGED'
-# sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, '582', -50, 'enlarge')
+# sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, masterdf, '582', -50, 'enlarge')
 
 
 # =====================
@@ -435,40 +407,52 @@ for i in ['518', '244']:
 buffer_gdf_list = []
 buffer_poly_list = []
 
+# Raster buffer method: calculate the signed distance of every WorldPop cell to the cropland edge of its district once,
+#       and build a cumulative population vs radius curve for each district. No geometry work is needed per iteration.
+if buffer_method == 'raster':
+        time_curves = time.time()
+
+        pop_array, pop_transform = read_population(pop_grid_path)
+        district_idx = rasterise_districts(districts_shp, pop_array.shape, pop_transform)
+        rural_mask = rasterise_mask(gdf_ghsl, pop_array.shape, pop_transform)
+        crop_mask = read_mask_on_grid(cropland, [1], pop_array.shape, pop_transform, districts_shp.crs)
+
+        crop_distance = signed_distance_to_cropland(crop_mask, pop_transform, district_idx)
+        buffer_curves = buffer_population_curves(crop_distance, pop_array, rural_mask, district_idx, list(districts_shp['pc11_d_id']))
+
+        print('Buffer distance curves generated for all districts.\n')
+        timestamp(time_curves)
+
+# Vector buffer method: clip cropland and slice rural points by district once, so each iteration only uses the district's data
+if buffer_method == 'vector' and partition_districts:
+        crop_partitions, point_partitions = partition_by_district(districts_shp, gdf_crops, pop_points_rural)
+        if buffer_workers > 1:
+                write_partitions(crop_partitions, point_partitions, buffer_partition_folder)
+
 # 2. Run for loop (loop through each district)
-for key, value in buffer_dict.items():
-        buffer_radius = 50
-        iteration_count = 0
-        
-        # Run initial buffer function 
-        sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, key, buffer_radius, value)
-        print('1st Run: District ' + key + ' value is ' + value + ' and result: ' + sum_buffer_gdf['revised_buffer'].item())
-        print('d_bufferedpc: ' + str(round(sum_buffer_gdf['d_bufferedpc'].item(),2)))
-        # 3. Run while loop (iterate over a single district until threshold is met)
-        #       Iteration count is designed to present unseen errors from looping forever; buffer process will cut off after 5 runs
-        while (abs(sum_buffer_gdf['d_bufferedpc'].item()) > 5) and (iteration_count <= iteration_max):
-                if value in ['unchanged', 'ineligible']:        # Ensures districts that are initially within threshold or are ineligible 
-                        break                                   #  do not run through the buffer iteration process
-                elif sum_buffer_gdf['revised_buffer'].item() in ['enlarge', 'subtract']:
-                        buffer_radius = round(buffer_radius + (buffer_radius/2))
-                        sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, key, buffer_radius, value)
-                elif sum_buffer_gdf['revised_buffer'].item() == 'overenlarged': 
-                        buffer_radius = round(buffer_radius - (buffer_radius/2))
-                        sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, key, buffer_radius, 'enlarge')
-                elif sum_buffer_gdf['revised_buffer'].item() == 'oversubtracted': 
-                        buffer_radius = round(buffer_radius - (buffer_radius/2))
-                        sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, gdf_crops, pop_points_rural, key, buffer_radius, 'subtract')
-                
-                print('District ' + key + ' value is ' + value + ' and result: ' + sum_buffer_gdf['revised_buffer'].item())
-                print('d_bufferedpc: ' + str(round(sum_buffer_gdf['d_bufferedpc'].item(),2)))
-                iteration_count = iteration_count + 1
-
-        # Append the single-row GeoDataFrame to the list
+#       Districts needing a buffer are passed to solve_buffer_radius, which treats d_bufferedpc as a decreasing function 
+#       of the signed buffer radius (negative = subtract). The radius is bracketed and then narrowed with secant/bisection 
+#       steps until abs(d_bufferedpc) <= 5, with at most iteration_max calls to generate_buffer.
+#       With the raster buffer method, the radius is found directly by binary search of the district's buffer curve.
+#       With buffer_workers > 1 (vector buffer method), districts are run in parallel on a process pool.
+if buffer_workers > 1 and buffer_method == 'vector':
+        buffer_results = run_buffers_parallel(buffer_dict, districts_filepath, cropland_poly_dissolved, pop_grid_path, pop_rural_cells_path, masterdf_path, buffer_workers
+                                              , partition_folder=buffer_partition_folder if partition_districts else None)
+else:
+        buffer_results = []
+        for key, value in buffer_dict.items():
+                if buffer_method == 'raster':
+                        buffer_results.append(run_district_buffer(districts_shp, gdf_crops, None, masterdf, key, value, buffer_curves[key]))
+                elif partition_districts:
+                        buffer_results.append(run_district_buffer(districts_shp, crop_partitions[key], point_partitions[key], masterdf, key, value))
+                else:
+                        buffer_results.append(run_district_buffer(districts_shp, gdf_crops, pop_points_rural, masterdf, key, value))
+
+# Append the single-row GeoDataFrames to the lists
+for sum_buffer_gdf, buffer_poly in buffer_results:
         buffer_gdf_list.append(sum_buffer_gdf)
         buffer_poly_list.append(buffer_poly)
 
-        print('*** District ' + key + ' complete. ***\n Iterations: ' + str(iteration_count) + '\n')
-
 timestamp(time_buffer)
 
 # Concatenate all GeoDataFrames in the list
@@ -496,6 +480,22 @@ buffer_map = districts_shp.merge(buffer_df, on='pc11_d_id')
 buffer_map.to_file(buffermap_path)
 buffer_poly_state.to_file(buffer_poly_path)
 
+
+
+# ==================================================================================================================
+# 7. SWEEP MODE
+# Calibrate the buffers for every ADP definition (ADPc1 - ADPc5) and tru_cat, sharing the district WorldPop sums and areas,
+#   and the rural points / cropland partitions / buffer curves of section 6. Results are exported as one long-format table.
+
+if sweep_mode:
+        sweep_df = run_sweep(districts_shp, district_df, gdf_crops, pop_points_rural
+                             , crop_partitions=crop_partitions if buffer_method == 'vector' and partition_districts else None
+                             , point_partitions=point_partitions if buffer_method == 'vector' and partition_districts else None
+                             , buffer_curves=buffer_curves if buffer_method == 'raster' else None)
+        sweep_df.to_csv(sweep_results_path, index=False)
+        print('Sweep results exported to csv.\n')
+
+
 print('\nScript complete.\n')
 timestamp(start_time)
 
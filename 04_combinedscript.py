@@ -2,29 +2,78 @@
 
 # DISSERTATION
 # SECTION 04: COMBINED SCRIPT
-#   This script executes each of the components 01, 01C & 02 in sequence. 
+#   This script runs the processing stages of scripts 01, 02, 03 and 05 as a pipeline of tasks (see pipeline.py).
+#   Independent tasks run at the same time, and a failed or partial run resumes from the last finished task.
+#   With --states, the pipeline is run for a list of states (or all states) and the results combined (see batch.py).
+#
+#   Usage:
+#       python 04_combinedscript.py                             run all tasks (finished tasks are skipped)
+#       python 04_combinedscript.py --from ghsl_clip            re-run ghsl_clip and every task downstream of it
+#       python 04_combinedscript.py --until area_overlays       run area_overlays and the tasks it depends on
+#       python 04_combinedscript.py --workers 3 --restart       re-run every task, 3 at a time
+#       python 04_combinedscript.py --list                      list the tasks and their dependencies
+#       python 04_combinedscript.py --states 29 27 --batch-workers 2     run two states at a time, then combine
+#       python 04_combinedscript.py --states all                run every state in the census A-1 table
 # Date created: 2023-08-16
 # Author: J Post
 
 # ==================================================================================================================
 
+import argparse
 
 from globals import *       # Imports the filepaths defined in globals.py
+from cache import evict_intermediates
+from stages import create_folders
+from pipeline import pipeline_tasks, task_dependencies, run_pipeline
+from batch import run_batch
+from profiling import set_run_id, write_chrome_trace
 
-script04_start = time.time()
 
-with open("01_preparefiles.py") as f:
-    exec(f.read())
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the ADP processing pipeline.')
+    parser.add_argument('--from', dest='start', choices=list(pipeline_tasks), help='re-run this task and all downstream tasks')
+    parser.add_argument('--until', choices=list(pipeline_tasks), help='stop after this task (runs only the tasks it depends on)')
+    parser.add_argument('--workers', type=int, default=pipeline_workers, help='number of tasks run at the same time')
+    parser.add_argument('--restart', action='store_true', help='ignore finished tasks and re-run everything')
+    parser.add_argument('--list', action='store_true', help='list the tasks and their dependencies')
+    parser.add_argument('--states', nargs='+', help="run a list of state codes (or 'all'), then combine the results")
+    parser.add_argument('--batch-workers', type=int, default=batch_workers, help='number of states run at the same time')
+    parser.add_argument('--no-evict', action='store_true', help='do not evict cached intermediate files (set for the state processes of a batch)')
+    args = parser.parse_args()
 
-with open("02_vectorisation.py") as f:
-    exec(f.read())
+    if args.list:
+        for name, deps in task_dependencies(pipeline_tasks).items():
+            print(f"{name:<22}<- {', '.join(deps) if deps else '(input data)'}")
+        raise SystemExit(0)
 
-with open("03_aggregation_buffers.py") as f:
-    exec(f.read())
+    # Spans of this run (and of the worker and state processes it starts) share one run identifier (see profiling.py)
+    run_id = set_run_id()
 
-print("Combined script process complete.")
-timestamp(script04_start)
+    if args.states:
+        memory_bytes = batch_memory_gb * 1024**3 if batch_memory_gb is not None else None
+        failed_states = run_batch(args.states, workers=args.batch_workers, memory_bytes=memory_bytes
+                                  , until=args.until or 'adp_raster', pipeline_workers=args.workers)
+        if profiling and profile_trace:
+            print(f'Chrome trace of run {run_id} written to {write_chrome_trace(run_id=run_id)}')
+        raise SystemExit(1 if failed_states else 0)
 
+    script04_start = time.time()
+    create_folders()
 
-# buffer_poly_state.plot()
-# plt.show()
\ No newline at end of file
+    failed = run_pipeline(start=args.start, until=args.until, workers=args.workers, restart=args.restart)
+
+    # Remove least recently used intermediate files if the cache is over its size limit
+    #   (in a batch, the states share the intermediates folder; run_batch evicts once, after all states are finished)
+    if not args.no_evict:
+        evict_intermediates(outputintermediates, cache_max_bytes)
+
+    if profiling and profile_trace:
+        print(f'Chrome trace of run {run_id} written to {write_chrome_trace(run_id=run_id)}')
+
+    if failed:
+        print('Combined script FAILED. Re-run to resume from the last finished task.')
+        timestamp(script04_start)
+        raise SystemExit(1)
+
+    print("Combined script process complete.")
+    timestamp(script04_start)
@@ -0,0 +1,148 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# BATCH: Run the pipeline for a list of states (04 --states)
+#   State-independent work (census A-1 parse; GHSL India merge and reprojection if ghsl_ingest = 'mosaic') is done
+#   once. Each state is then run in its own process (04_combinedscript.py with ADP_STATE_CODE set, as globals.py sets the file paths of one state).
+#   States are admitted largest first, while their estimated memory fits within the memory available to the batch.
+#   The all-India combine step (every completed state, including states finished by earlier runs), and the eviction of
+#   cached intermediate files, run once, at the end.
+
+# ==================================================================================================================
+
+import os
+import sys
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+import psutil
+import rasterio
+
+os.environ['USE_PYGEOS'] = '0'    # Disable pygeos (retired; geopandas integrates shapely)
+import geopandas as gpd
+
+from globals import *       # Imports the filepaths defined in globals.py
+from stages import create_folders, merge_ghsl, reproject_ghsl, parse_census_population, census_location_codes, combine_states
+from census import read_census
+from cache import evict_intermediates
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# State codes with the state-specific inputs required to run (census B-04/B-06 tables and DynamicWorld cropland)
+def available_states(state_list):
+    available = []
+    for code in state_list:
+        required = [os.path.join(datafolder, 'census', f'DDW-B04-{code}00.xls')
+                    , os.path.join(datafolder, 'census', f'DDW-B06-{code}00.xls')
+                    , os.path.join(datafolder, 'dynamicworld', f'2020_dw_{code}_cropland_{scale}.tif')]
+        missing = [os.path.basename(path) for path in required if not os.path.isfile(path)]
+        if missing:
+            print(f"State {code}: skipped, missing input files {', '.join(missing)}")
+        else:
+            available.append(code)
+    return available
+
+
+# Estimated peak memory (bytes) of each state, from the number of WorldPop pixels in the state's bounding box
+def state_memory_estimates(state_list):
+    districts = gpd.read_file(boundaries_district)
+    with rasterio.open(pop_tif) as src:
+        res_x, res_y = src.res
+    estimates = {}
+    for code in state_list:
+        minx, miny, maxx, maxy = districts[districts['pc11_s_id'] == code].total_bounds
+        n_pixels = ((maxx - minx) / res_x) * ((maxy - miny) / res_y)
+        estimates[code] = int(n_pixels * batch_bytes_per_pixel)
+    return estimates
+
+
+# Run the pipeline of one state in its own process; the output is written to a log file per state
+#   Cached intermediate files are not evicted by the state process, as other states may be reading them
+def run_state(code, until, pipeline_workers):
+    log_path = os.path.join(batch_log_folder, f'state_{code}.log')
+    env = dict(os.environ, ADP_STATE_CODE=code)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '04_combinedscript.py')
+    with open(log_path, 'w') as log:
+        result = subprocess.run([sys.executable, script, '--until', until, '--workers', str(pipeline_workers), '--no-evict']
+                                , env=env, stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode
+
+
+def run_batch(state_list, workers=1, memory_bytes=None, until='adp_raster', pipeline_workers=1):
+        """
+        Run the pipeline for a list of states, several at a time, then combine the results for India
+        ...
+
+        Arguments
+        ---------
+        state_list      : list of Census state codes, or ['all'] for every state in the census A-1 table
+        workers         : maximum number of states run at the same time
+        memory_bytes    : memory available to the states run at the same time; None = available memory at start
+        until           : last pipeline task run for each state
+        pipeline_workers: number of tasks run at the same time within each state
+
+        Returns
+        -------
+        failed          : list of state codes that failed (see the state's log file in batch_log_folder)
+
+        """
+        batch_start = time.time()
+        create_folders()
+        os.makedirs(batch_log_folder, exist_ok=True)
+
+        # State-independent work, shared by all states
+        if ghsl_ingest == 'mosaic':
+                merge_ghsl()
+                reproject_ghsl()
+        parse_census_population()
+
+        if state_list == ['all']:
+                state_codes, district_codes = census_location_codes(read_census(census_pop_cache, 'State Code'))
+                state_list = list(state_codes['State Code'])
+        state_list = available_states(state_list)
+
+        # Admit states largest first, while their estimated memory fits (a state too large for the budget runs alone)
+        estimates = state_memory_estimates(state_list)
+        if memory_bytes is None:
+                memory_bytes = psutil.virtual_memory().available
+        queue = sorted(state_list, key=lambda code: estimates[code], reverse=True)
+        running = {}
+        completed = []
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+                while queue or running:
+                        reserved = sum(estimates[code] for code in running.values())
+                        admitted = [code for code in queue if len(running) < workers
+                                    and (not running or reserved + estimates[code] <= memory_bytes)][:1]
+                        if admitted:
+                                code = admitted[0]
+                                queue.remove(code)
+                                print(f'State {code}: started (estimated memory {estimates[code] / 1024**3:.1f} GB).')
+                                running[executor.submit(run_state, code, until, pipeline_workers)] = code
+                                continue
+
+                        done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                                code = running.pop(future)
+                                if future.result() == 0:
+                                        print(f'State {code}: complete.')
+                                        completed.append(code)
+                                else:
+                                        print(f"State {code}: FAILED (see {os.path.join(batch_log_folder, f'state_{code}.log')})")
+                                        failed.append(code)
+
+        # Combine the results of every completed state (this batch and earlier runs) once, at the end
+        if completed:
+                combine_states()
+
+        # Remove least recently used intermediate files once no state is running
+        evict_intermediates(outputintermediates, cache_max_bytes)
+
+        print(f'Batch complete: {len(completed)} states complete, {len(failed)} failed.')
+        timestamp(batch_start)
+        return failed
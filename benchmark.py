@@ -0,0 +1,368 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# BENCHMARK: Timing of the processing stages on synthetic state-sized inputs
+#   The real inputs (WorldPop, GHSL, DynamicWorld, census) are not part of the repository. This script generates
+#   synthetic equivalents at a chosen scale: WorldPop, GHSL and cropland GeoTIFFs on a 100m (3 arc second) grid,
+#   Voronoi district boundaries, and census B-04, B-06 and A-1 workbooks. It then times each processing stage on them.
+#   Results are appended to a JSON-lines file, tagged with the git commit, so runs can be compared across commits.
+#
+#   Usage:
+#       python benchmark.py                                 run the 'district' scale once
+#       python benchmark.py --scale uttar_pradesh --repeat 3
+#       python benchmark.py --compare --scale state         median time of each stage, by commit
+#
+# NOTE: Fixtures are generated once per scale and seed (benchmark_folder/fixtures), and reused by later runs.
+
+# ==================================================================================================================
+
+import os
+import io
+import json
+import time
+import argparse
+import platform
+import subprocess
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+from scipy.ndimage import zoom
+
+os.environ['USE_PYGEOS'] = '0'    # Disable pygeos (retired; geopandas integrates shapely)
+import geopandas as gpd
+
+from globals import *       # Imports the settings and filepaths defined in globals.py
+from census import census_to_parquet, read_census, A1_LAYOUT, B04_LAYOUT, B06_LAYOUT, A1_COLUMNS, B04_COLUMNS, B06_COLUMNS
+from raster_tools import write_grid_store, open_grid_store, grid_points, vectorise_raster_tiled
+from vector_tools import points_within
+from zonal import zonal_population_sums
+from buffer_tools import partition_by_district, run_district_buffer
+from stages import census_adp, merge_adp_rasters
+from profiling import memory_mb
+
+
+# ==================================================================================================================
+# SCALES
+#   Grid size (pixels at 3 arc seconds, ~100m) and number of districts of each benchmark scale
+
+SCALES = {
+    'tiny':             {'width': 240, 'height': 240, 'districts': 4},          # ~24 km x 24 km (quick check)
+    'district':         {'width': 720, 'height': 720, 'districts': 1},          # ~70 km x 70 km, a single district
+    'state':            {'width': 3600, 'height': 3000, 'districts': 30},       # ~350 km x 300 km, a mid-sized state
+    'uttar_pradesh':    {'width': 9600, 'height': 6000, 'districts': 75},       # ~900 km x 600 km, 75 districts
+}
+
+CELL_SIZE = 1 / 1200            # 3 arc seconds (WorldPop 100m grid)
+ORIGIN = (77.0, 30.0)           # Top left corner (lon, lat) of the synthetic state
+GHSL_RURAL_CLASSES = [11, 12, 13, 21]
+
+# Stages timed by the benchmark, in the order they are run
+BENCHMARK_STAGES = ['census_parse', 'worldpop_grid', 'vectorise_ghsl', 'vectorise_cropland', 'join_rural', 'join_cropland'
+                    , 'sjoin_districts', 'dissolve_districts', 'zonal_sums', 'buffer_calibration', 'raster_merge']
+
+
+# ==================================================================================================================
+# FIXTURES
+
+# Smooth random field in [0, 1] (low resolution noise, interpolated onto the grid), used for land cover and population
+def smooth_field(rng, shape, feature_pixels):
+    low = rng.random((shape[0] // feature_pixels + 2, shape[1] // feature_pixels + 2))
+    field = zoom(low, feature_pixels, order=1)[:shape[0], :shape[1]]
+    return (field - field.min()) / (field.max() - field.min())
+
+
+# Write a single band GeoTIFF on the synthetic state grid
+def write_fixture_raster(path, data, transform, nodata=None):
+    with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=1, dtype=data.dtype
+                       , crs='EPSG:4326', transform=transform, nodata=nodata, tiled=True, compress='deflate') as dst:
+        dst.write(data, 1)
+
+
+# Write a census table in the layout of its workbook (header rows above, footer rows below the data)
+def write_fixture_workbook(path, table, layout):
+    header = pd.DataFrame([[f'Census of India 2011 (synthetic benchmark table), header row {i + 1}'] + [None] * (table.shape[1] - 1)
+                           for i in range(layout['skiprows'])], columns=table.columns)
+    footer = pd.DataFrame([[f'Note {i + 1}'] + [None] * (table.shape[1] - 1) for i in range(layout['skipfooter'])], columns=table.columns)
+    pd.concat([header, table, footer]).to_excel(path, header=False, index=False)
+
+
+def generate_fixtures(scale, seed=0, folder=None):
+        """
+        Generate (or reuse) the synthetic inputs of a benchmark scale
+        ...
+
+        Arguments
+        ---------
+        scale           : name of benchmark scale (see SCALES)
+        seed            : seed of the random generator (same seed = same inputs)
+        folder          : folder of fixtures (default: benchmark_folder/fixtures/<scale>_<seed>)
+
+        Returns
+        -------
+        fixtures        : dictionary of fixture name -> filepath
+
+        """
+        size = SCALES[scale]
+        folder = folder or os.path.join(benchmark_folder, 'fixtures', f'{scale}_{seed}')
+        fixtures = {name: os.path.join(folder, filename) for name, filename in
+                    [('worldpop', 'worldpop.tif'), ('ghsl', 'ghsl.tif'), ('cropland', 'cropland.tif'), ('districts', 'districts.shp')
+                     , ('census_main', 'DDW-B04.xlsx'), ('census_marginal', 'DDW-B06.xlsx'), ('census_pop', 'A-1.xlsx')]}
+        meta_path = os.path.join(folder, 'fixtures.json')
+        if os.path.isfile(meta_path):
+                return fixtures
+
+        time_fixtures = time.time()
+        os.makedirs(folder, exist_ok=True)
+        rng = np.random.default_rng(seed)
+        shape = (size['height'], size['width'])
+        transform = from_origin(ORIGIN[0], ORIGIN[1], CELL_SIZE, CELL_SIZE)
+
+        # Land cover: GHSL urban (30) / suburban (22, 23) / rural classes, and DynamicWorld cropland (1) mostly in rural areas
+        urban = smooth_field(rng, shape, 60)
+        rural_class = np.array(GHSL_RURAL_CLASSES)[np.minimum((smooth_field(rng, shape, 30) * 4).astype(int), 3)]
+        ghsl = np.select([urban > 0.85, urban > 0.75, urban > 0.7], [30, 23, 22], default=rural_class).astype(np.uint8)
+        crop = ((smooth_field(rng, shape, 20) > 0.45) & (urban < 0.8)).astype(np.uint8)
+
+        # WorldPop: population per cell, higher in urban areas; a few nodata cells
+        pop = (rng.lognormal(0, 1, shape) * (1 + 50 * urban ** 8)).astype(np.float32)
+        pop[rng.random(shape) < 0.02] = -99999
+
+        write_fixture_raster(fixtures['worldpop'], pop, transform, nodata=-99999)
+        write_fixture_raster(fixtures['ghsl'], ghsl, transform, nodata=0)
+        write_fixture_raster(fixtures['cropland'], crop, transform)
+
+        # Districts: Voronoi cells of random seeds, clipped to the state
+        minx, maxy = ORIGIN
+        maxx, miny = minx + shape[1] * CELL_SIZE, maxy - shape[0] * CELL_SIZE
+        state_box = shapely.box(minx, miny, maxx, maxy)
+        if size['districts'] > 1:
+                seeds = shapely.multipoints(np.column_stack([rng.uniform(minx, maxx, size['districts']), rng.uniform(miny, maxy, size['districts'])]))
+                cells = shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=state_box))
+                cells = shapely.intersection(cells, state_box)
+        else:
+                cells = np.array([state_box])
+        district_codes = [f'{500 + i:03d}' for i in range(len(cells))]
+        districts = gpd.GeoDataFrame({'pc11_s_id': state_code, 'pc11_d_id': district_codes
+                                      , 'd_name': [f'District {code}' for code in district_codes]}, geometry=cells, crs='EPSG:4326')
+        districts.to_file(fixtures['districts'])
+
+        # Census: district population close to the WorldPop sum; workers a share of the population
+        zonal = zonal_population_sums(fixtures['worldpop'], districts, districts.iloc[0:0], districts.iloc[0:0])
+        population = (zonal['worldpop'].fillna(0).to_numpy() * rng.uniform(0.9, 1.1, len(districts))).astype(np.int64)
+        categories = ['Total', 'Rural', 'Urban']
+        shares = {'Total': 1.0, 'Rural': 0.7, 'Urban': 0.3}
+        age_groups = ['Total', '15-19', '20-24', '25-29', '30-34', '35-39', '40-49', '50-59', '60-69', '70-79', '80+', 'Age not stated']
+
+        main_rows, marginal_rows, pop_rows = [], [], []
+        for code, district_pop in zip(district_codes, population):
+                for category in categories:
+                        cat_pop = district_pop * shares[category]
+                        pop_rows.append([state_code, code, '00000', 'DISTRICT', f'District {code}', category, 100, 2, 5, int(cat_pop / 5)
+                                         , int(cat_pop), int(cat_pop * 0.51), int(cat_pop * 0.49), 5000.0, cat_pop / 5000])
+                        for age in age_groups:
+                                part = 1.0 if age == 'Total' else 0.1
+                                workers = rng.uniform(0.3, 0.45) * cat_pop * part
+                                ag = rng.uniform(0.2, 0.8)
+                                main = [workers, workers * 0.6, workers * 0.4, workers * ag * 0.5, workers * ag * 0.3, workers * ag * 0.2
+                                        , workers * ag * 0.5, workers * ag * 0.3, workers * ag * 0.2, workers * 0.05, workers * 0.03, workers * 0.02]
+                                main_rows.append(['B0104', state_code, code, f'District {code}', category, age] + [int(v) for v in main])
+                                marginal = [workers * 0.2, workers * 0.1, workers * 0.1, workers * 0.05, workers * 0.03, workers * 0.02] + main[3:]
+                                marginal_rows.append(['B0106', state_code, code, f'District {code}', category, age]
+                                                     + [int(v * 0.2) for v in marginal])
+
+        write_fixture_workbook(fixtures['census_main'], pd.DataFrame(main_rows, columns=B04_COLUMNS), B04_LAYOUT)
+        write_fixture_workbook(fixtures['census_marginal'], pd.DataFrame(marginal_rows, columns=B06_COLUMNS), B06_LAYOUT)
+        write_fixture_workbook(fixtures['census_pop'], pd.DataFrame(pop_rows, columns=A1_COLUMNS), A1_LAYOUT)
+
+        with open(meta_path, 'w') as f:
+                json.dump({'scale': scale, 'seed': seed, 'shape': list(shape), 'districts': len(districts)}, f)
+        print(f'Benchmark fixtures generated for scale {scale} ({shape[1]} x {shape[0]} pixels, {len(districts)} districts).')
+        timestamp(time_fixtures)
+        return fixtures
+
+
+# ==================================================================================================================
+# BENCHMARK
+
+# Git commit of the code being benchmarked ('+' = uncommitted changes)
+def git_commit():
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=folder, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=folder, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('+' if dirty else '')
+
+
+# Run a stage and measure it; the stage's printed output is suppressed. Returns (result, measurement)
+def measure(function):
+    rss_start = memory_mb()[0]
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with redirect_stdout(io.StringIO()):
+        result = function()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    rss_end, peak = memory_mb()
+    return result, {'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4), 'rss_start_mb': rss_start, 'rss_end_mb': rss_end, 'peak_rss_mb': peak}
+
+
+def run_benchmark(scale, seed=0, repeat=1, results_path=None):
+        """
+        Time each processing stage on the synthetic inputs of a scale, and append the results to the results file
+        ...
+
+        Arguments
+        ---------
+        scale           : name of benchmark scale (see SCALES)
+        seed            : seed of the synthetic inputs
+        repeat          : number of times each stage is run (each run is recorded)
+        results_path    : filepath of JSON-lines results file (default: benchmark_results_path)
+
+        Returns
+        -------
+        results_df      : DataFrame with one row per stage and run (wall and CPU time, memory, counts)
+
+        """
+        results_path = results_path or benchmark_results_path
+        fixtures = generate_fixtures(scale, seed)
+        work = os.path.join(os.path.dirname(fixtures['worldpop']), 'work')
+        os.makedirs(work, exist_ok=True)
+        run_info = {'commit': git_commit(), 'run_start': time.strftime('%Y-%m-%d %H:%M:%S'), 'scale': scale, 'seed': seed
+                    , 'python': platform.python_version(), 'machine': platform.node()}
+
+        districts_shp = gpd.read_file(fixtures['districts'])
+        ctx = {}
+
+        def census_parse():
+                tables = {}
+                for name, layout in [('census_main', B04_LAYOUT), ('census_marginal', B06_LAYOUT), ('census_pop', A1_LAYOUT)]:
+                        parquet_path = os.path.join(work, f'{name}.parquet')
+                        for path in (parquet_path, parquet_path + '.provenance.json'):
+                                if os.path.exists(path):
+                                        os.remove(path)
+                        census_to_parquet(fixtures[name], parquet_path, layout, {'inputs': [fixtures[name]], 'params': {}, 'version': 1})
+                        tables[name] = read_census(parquet_path, layout['code_columns'][0], state_code)
+                ctx['ag_workers'] = census_adp(tables['census_main'], tables['census_marginal'], tables['census_pop'], 'Total')
+                return {'districts': len(ctx['ag_workers'])}
+
+        def worldpop_grid():
+                write_grid_store(fixtures['worldpop'], os.path.join(work, 'pop_grid.npy'))
+                pop_grid, transform, crs = open_grid_store(os.path.join(work, 'pop_grid.npy'))
+                ctx['gdf_pop'] = grid_points(pop_grid, transform, crs)
+                return {'pixels': pop_grid.size, 'points': len(ctx['gdf_pop'])}
+
+        def vectorise_ghsl():
+                ctx['gdf_ghsl'] = vectorise_raster_tiled(fixtures['ghsl'], GHSL_RURAL_CLASSES, tile_size=vectorise_tile_size, workers=vectorise_workers)
+                return {'vertices': shapely.get_num_coordinates(ctx['gdf_ghsl'].geometry.values).sum()}
+
+        def vectorise_cropland():
+                ctx['gdf_crops'] = vectorise_raster_tiled(fixtures['cropland'], [1], tile_size=vectorise_tile_size, workers=vectorise_workers)
+                return {'vertices': shapely.get_num_coordinates(ctx['gdf_crops'].geometry.values).sum()}
+
+        def join_rural():
+                gdf_pop = ctx['gdf_pop']
+                ctx['rural_points'] = gdf_pop[points_within(gdf_pop.geometry.values, ctx['gdf_ghsl'].geometry.values)].reset_index(drop=True)
+                return {'points': len(gdf_pop), 'rural_points': len(ctx['rural_points'])}
+
+        def join_cropland():
+                gdf_pop = ctx['gdf_pop']
+                ctx['cropland_points'] = gdf_pop[points_within(gdf_pop.geometry.values, ctx['gdf_crops'].geometry.values)].reset_index(drop=True)
+                return {'points': len(gdf_pop), 'cropland_points': len(ctx['cropland_points'])}
+
+        def sjoin_districts():
+                ctx['pop_jn_districts'] = ctx['gdf_pop'].sjoin(districts_shp, how='inner', predicate='within')
+                return {'points': len(ctx['gdf_pop'])}
+
+        def dissolve_districts():
+                dissolve_df = ctx['pop_jn_districts'][['raster_value', 'geometry', 'pc11_d_id', 'd_name']]
+                dissolve_df.dissolve(by='pc11_d_id', as_index=False, aggfunc={'raster_value': 'sum', 'd_name': 'first'})
+                return {'points': len(dissolve_df)}
+
+        def zonal_sums():
+                ctx['zonal_df'] = zonal_population_sums(os.path.join(work, 'pop_grid.npy'), districts_shp, ctx['gdf_ghsl'], ctx['gdf_crops'])
+                return {'districts': len(districts_shp)}
+
+        def buffer_calibration():
+                # Census ADP set around the WorldPop cropland population, so that districts need enlarging and subtracting
+                masterdf = ctx['zonal_df'].merge(ctx['ag_workers'][['District code', 'Population']], left_on='pc11_d_id', right_on='District code')
+                masterdf['ADPa_pctotal'] = masterdf['worldpop_crop'] / masterdf['Population'] * 100
+                masterdf[adp_columns(ADPcn)[0]] = masterdf['ADPa_pctotal'] + np.random.default_rng(seed).uniform(-20, 20, len(masterdf))
+                masterdf['need_buffer'] = categorise_buffer(masterdf[adp_columns(ADPcn)[0]] - masterdf['ADPa_pctotal'])
+                masterdf['crop_area_pc'] = np.nan
+                masterdf['rural_area_pc'] = np.nan
+
+                crop_partitions, point_partitions = partition_by_district(districts_shp, ctx['gdf_crops'], ctx['rural_points'])
+                iterations = 0
+                for district_code, need_buffer in zip(masterdf['pc11_d_id'], masterdf['need_buffer']):
+                        sum_buffer_gdf, buffer_poly = run_district_buffer(districts_shp, crop_partitions[district_code], point_partitions[district_code]
+                                                                          , masterdf, district_code, need_buffer)
+                        iterations = iterations + int(sum_buffer_gdf['iterations'].item())
+                return {'districts': len(masterdf), 'iterations': iterations}
+
+        def raster_merge():
+                # Split WorldPop into four quadrant rasters (as per-state ADP rasters) and merge them back together
+                with rasterio.open(fixtures['worldpop']) as src:
+                        pop, transform, nodata = src.read(1), src.transform, src.nodata
+                half_rows, half_cols = pop.shape[0] // 2, pop.shape[1] // 2
+                quadrants = []
+                for i, (row, col) in enumerate([(0, 0), (0, half_cols), (half_rows, 0), (half_rows, half_cols)]):
+                        path = os.path.join(work, f'adp_quadrant_{i}.tif')
+                        block = pop[row:row + half_rows, col:col + half_cols]
+                        write_fixture_raster(path, block, transform * transform.translation(col, row), nodata)
+                        quadrants.append(path)
+                merge_adp_rasters(quadrants, os.path.join(work, 'adp_merged.tif'))
+                return {'pixels': pop.size}
+
+        stage_functions = {'census_parse': census_parse, 'worldpop_grid': worldpop_grid, 'vectorise_ghsl': vectorise_ghsl
+                           , 'vectorise_cropland': vectorise_cropland, 'join_rural': join_rural, 'join_cropland': join_cropland
+                           , 'sjoin_districts': sjoin_districts, 'dissolve_districts': dissolve_districts, 'zonal_sums': zonal_sums
+                           , 'buffer_calibration': buffer_calibration, 'raster_merge': raster_merge}
+
+        records = []
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+        for stage in BENCHMARK_STAGES:
+                for run in range(repeat):
+                        counts, measurement = measure(stage_functions[stage])
+                        record = dict(run_info, stage=stage, run=run, **measurement, counts={k: int(v) for k, v in counts.items()})
+                        records.append(record)
+                        with open(results_path, 'a') as f:
+                                f.write(json.dumps(record) + '\n')
+                print(f"{stage:<20} {min(r['wall_s'] for r in records if r['stage'] == stage):>10.2f} s")
+
+        return pd.DataFrame(records)
+
+
+# Median wall time (s) of each stage by commit, for one scale (commits in the order they were first benchmarked)
+def compare_results(scale, results_path=None):
+    results_path = results_path or benchmark_results_path
+    with open(results_path) as f:
+        results_df = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    results_df = results_df[results_df['scale'] == scale]
+    commits = list(dict.fromkeys(results_df['commit']))
+    table = results_df.pivot_table(index='stage', columns='commit', values='wall_s', aggfunc='median')
+    table = table.reindex(index=[s for s in BENCHMARK_STAGES if s in table.index], columns=commits)
+    if len(commits) > 1:
+        table['change_%'] = ((table[commits[-1]] / table[commits[-2]] - 1) * 100).round(1)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ADP processing stages on synthetic inputs.')
+    parser.add_argument('--scale', choices=list(SCALES), default='district', help='size of the synthetic state')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic inputs')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of each stage')
+    parser.add_argument('--compare', action='store_true', help='compare the stored results of this scale across commits')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare_results(args.scale).to_string())
+        raise SystemExit(0)
+
+    benchmark_start = time.time()
+    run_benchmark(args.scale, seed=args.seed, repeat=args.repeat)
+    print(f'Benchmark results appended to {benchmark_results_path}')
+    timestamp(benchmark_start)
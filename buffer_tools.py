@@ -0,0 +1,457 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# BUFFER TOOLS: Functions supporting the buffer iteration process in script 03
+#   The buffer iteration searches, for each district, for the cropland buffer radius at which the WorldPop
+#   population within the buffer (ADPa) matches the census ADP estimate (ADPc) to within 5 percentage points.
+
+# ==================================================================================================================
+
+import os
+import math
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from globals import *       # Imports the settings and functions defined in globals.py
+from zonal import buffered_population, radius_for_target
+from raster_tools import read_points_feather, write_points_feather, open_grid_store, grid_points
+from vector_tools import buffer_membership
+from geodesy import local_projection, buffer_metres
+from profiling import profiled, span_counts
+from workers import spawn_pool, run_pool_job
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+def solve_buffer_radius(evaluate, need_buffer, initial_radius=50, tolerance=5, max_evaluations=10):
+        """
+        Find the buffer radius at which the ADP difference is within the tolerance, using bracketing and regula falsi
+        ...
+
+        The difference d_bufferedpc (ADPc - ADPa, as % of population) decreases as the signed buffer radius increases
+        (positive = enlarge cropland, negative = subtract from cropland). The search:
+            1. Starts at +initial_radius ('enlarge') or -initial_radius ('subtract')
+            2. Steps outwards, doubling the step, until the difference changes sign (root is bracketed)
+            3. Narrows the bracket with secant (regula falsi, Illinois variant) steps, falling back to bisection
+
+        Arguments
+        ---------
+        evaluate        : function taking a signed radius (m) and returning (d_bufferedpc, result)
+        need_buffer     : initial classification of district, one of 'enlarge', 'subtract'
+        initial_radius  : radius (in absolute m) of first buffer to be generated
+        tolerance       : absolute difference (percentage points) at which the search stops
+        max_evaluations : maximum number of calls to evaluate
+
+        Returns
+        -------
+        radius          : signed radius (m) of the best buffer found
+        result          : result returned by evaluate for that radius
+        evaluations     : number of calls made to evaluate
+        residual        : d_bufferedpc for that radius
+        converged       : True if abs(residual) <= tolerance
+
+        """
+        direction = 1 if need_buffer == 'enlarge' else -1
+        evaluations = 0
+        best = None
+
+        def run(radius):
+                nonlocal evaluations, best
+                residual, result = evaluate(radius)
+                evaluations = evaluations + 1
+                if best is None or abs(residual) < abs(best[2]):
+                        best = (radius, result, residual)
+                return residual
+
+        def finish():
+                radius, result, residual = best
+                return radius, result, evaluations, residual, abs(residual) <= tolerance
+
+        # 1. Initial radius
+        radius = direction * initial_radius
+        residual = run(radius)
+        if abs(residual) <= tolerance:
+                return finish()
+
+        # 2. Bracket the root: residual > 0 means ADPa is too low (increase radius); < 0 means too high (decrease radius)
+        step = initial_radius
+        lo, f_lo, hi, f_hi = None, None, None, None
+        if residual > 0:
+                lo, f_lo = radius, residual
+        else:
+                hi, f_hi = radius, residual
+        while (lo is None or hi is None) and evaluations < max_evaluations:
+                step = step * 2
+                radius = radius + step if hi is None else radius - step
+                residual = run(radius)
+                if abs(residual) <= tolerance:
+                        return finish()
+                if residual > 0:
+                        lo, f_lo = radius, residual
+                else:
+                        hi, f_hi = radius, residual
+
+        # 3. Narrow the bracket [lo, hi] (f_lo > 0 > f_hi)
+        side = 0
+        while lo is not None and hi is not None and evaluations < max_evaluations and abs(hi - lo) > 1:
+                radius = round(hi - f_hi * (hi - lo) / (f_hi - f_lo)) if f_hi != f_lo else None
+                if radius is None or not (min(lo, hi) < radius < max(lo, hi)) or not math.isfinite(radius):
+                        radius = round((lo + hi) / 2)           # bisection fallback
+                residual = run(radius)
+                if abs(residual) <= tolerance:
+                        break
+                if residual > 0:
+                        lo, f_lo = radius, residual
+                        if side == -1:
+                                f_hi = f_hi / 2                 # Illinois: halve the retained end to avoid one-sided convergence
+                        side = -1
+                else:
+                        hi, f_hi = radius, residual
+                        if side == 1:
+                                f_lo = f_lo / 2
+                        side = 1
+
+        return finish()
+
+
+@profiled()
+def generate_buffer(districts_shp, crops_shp, rural_points, masterdf, district_code, buffer_radius, buffer_type, adp_definition=ADPcn, membership=None):
+        """
+        Generate a buffer around cropland area in district
+        ...
+
+        Arguments
+        ---------
+        districts_shp   : polygon of district boundaries
+        crops_shp       : polygon of cropland in state (or district)
+        rural_points    : vector grid of population points in rural areas
+        masterdf        : master results table (census ADP estimates and need_buffer by district)
+        district_code   : census designated identifier of district
+        buffer_radius   : radius (in absolute m) of buffer to be generated
+        buffer_type     : takes one of 'enlarge', 'subtract', 'unchanged'
+        adp_definition  : census ADP definition the buffered population is compared against, e.g. 'ADPc5'
+        membership      : incremental point-in-buffer test of rural_points, kept across the iterations of a district
+                          (see vector_tools.buffer_membership); if None, all rural points are tested
+
+        Returns
+        -------
+        check_buffer    : GeoDataFrame with 1 row, containing buffer details tied to district geometry 
+        d_buffer_gdf    : GeoDataFrame with 1 row, containing polygon of buffered zone
+
+        """
+        time_buff = time.time()
+
+        # Buffer radius in metres (drawn in a local projection of the district, see geodesy.buffer_metres)
+        if buffer_type == 'enlarge':
+                metres = buffer_radius
+        elif buffer_type == 'subtract':
+                buffer_radius = buffer_radius * -1              # negative buffer radius = reduction in size
+                metres = buffer_radius
+        elif buffer_type == 'unchanged':
+                metres = 0                                      # No buffer required (type == 'unchanged')
+
+        print('Creating ' + str(buffer_radius) + 'm buffers on crop lands for district: ' + district_code)  
+
+        # Calculate buffer
+        d_buffer_gdf = buffer_district_cropland(districts_shp, crops_shp, district_code, metres)
+
+        # Join rural points to buffer zone (only points near the change from the previous buffer are re-tested)
+        if membership is None:
+                membership = buffer_membership(rural_points)
+        within, buffer_pop = membership(d_buffer_gdf.union_all())
+        span_counts(buffer_radius=buffer_radius, points_within=within.sum())
+
+        # Aggregate population for district
+        #       (a large subtracted buffer can remove all rural points; the buffered population is then zero)
+        buffer_points = shapely.multipoints(np.asarray(rural_points.geometry.values)[within]) if within.any() else None
+        sum_buffer_points = gpd.GeoDataFrame({'raster_value': [np.round(buffer_pop)]}, geometry=[buffer_points], crs="EPSG:4326")
+
+        print(f'Rural pop points joined to buffer area and new ADP calculated.')
+
+        check_buffer = check_buffered_adp(sum_buffer_points, masterdf, district_code, buffer_radius, adp_definition)
+
+        timestamp(time_buff)
+        return check_buffer, d_buffer_gdf
+
+
+# Clip the cropland to a district (skipped if the cropland has already been clipped to the district, see partition_by_district)
+def district_cropland(districts_shp, crops_shp, district_code):
+        if 'pc11_d_id' in crops_shp.columns and (crops_shp['pc11_d_id'] == district_code).all():
+                return crops_shp
+        district_boundary = districts_shp.loc[districts_shp['pc11_d_id'] == district_code]
+        return gpd.overlay(crops_shp, district_boundary, how='intersection')
+
+
+# Local projection of each district's cropland (see geodesy.local_projection), built on its first buffer
+_district_projections = {}
+
+
+# Clip the cropland to a district and buffer it by the given distance (in metres; negative = subtract)
+def buffer_district_cropland(districts_shp, crops_shp, district_code, metres):
+        crop_by_district_boundary = district_cropland(districts_shp, crops_shp, district_code)
+
+        # Convert to a Geoseries
+        district_series = crop_by_district_boundary['geometry']
+
+        if district_code not in _district_projections:
+                _district_projections[district_code] = local_projection(district_series.values)
+        d_buffer = gpd.GeoSeries(buffer_metres(district_series.values, metres, _district_projections[district_code])
+                                 , index=district_series.index, name='geometry')
+        d_buffer_gdf = gpd.GeoDataFrame(d_buffer, crs="EPSG:4326", geometry='geometry')
+        d_buffer_gdf['pc11_d_id'] = district_code
+        return d_buffer_gdf
+
+
+# Compare the buffered population (sum_buffer_points['raster_value']) against the census ADP for the district
+def check_buffered_adp(sum_buffer_points, masterdf, district_code, buffer_radius, adp_definition=ADPcn):
+        # Add district code and buffer radius to geodataframe
+        sum_buffer_points['pc11_d_id'] = district_code
+        sum_buffer_points['buffer_r'] = buffer_radius
+
+        # Merge census data from masterdf
+        ADPcn_pctotal = adp_columns(adp_definition)[0]
+
+        check_buffer = sum_buffer_points.merge(masterdf[['pc11_d_id', 'Population', 'crop_area_pc', 'rural_area_pc', ADPcn_pctotal, 'need_buffer']]
+                                               , how='left', on='pc11_d_id')
+
+        check_buffer['buffered_pctotal'] = check_buffer['raster_value']/check_buffer['Population']*100
+        check_buffer['d_bufferedpc'] = check_buffer[ADPcn_pctotal] - check_buffer['buffered_pctotal']
+
+        # Next apply conditional rules to the rows of check_buffer
+        check_buffer['revised_buffer'] = buffer_logic(check_buffer['need_buffer'], check_buffer['d_bufferedpc'])
+        return check_buffer
+
+
+@profiled()
+def generate_buffer_raster(districts_shp, crops_shp, masterdf, buffer_curve, district_code, need_buffer, adp_definition=ADPcn):
+        """
+        Find the buffer radius for a district from its precomputed buffer curve (raster buffer method)
+        ...
+
+        Arguments
+        ---------
+        districts_shp   : polygon of district boundaries
+        crops_shp       : polygon of cropland in state (or district)
+        masterdf        : master results table (census ADP estimates and need_buffer by district)
+        buffer_curve    : (sorted distances, cumulative rural population) for the district (see zonal.buffer_population_curves)
+        district_code   : census designated identifier of district
+        need_buffer     : takes one of 'enlarge', 'subtract', 'unchanged'
+        adp_definition  : census ADP definition the buffered population is compared against, e.g. 'ADPc5'
+
+        Returns
+        -------
+        check_buffer    : GeoDataFrame with 1 row, containing buffer details tied to district geometry 
+        d_buffer_gdf    : GeoDataFrame with 1 row, containing polygon of buffered zone (generated once, at the final radius)
+
+        """
+        time_buff = time.time()
+
+        district_row = masterdf.loc[masterdf['pc11_d_id'] == district_code].iloc[0]
+        if need_buffer in ['enlarge', 'subtract']:
+                target_pop = district_row[adp_columns(adp_definition)[0]] * district_row['Population'] / 100
+                buffer_radius, buffered_pop = radius_for_target(buffer_curve, target_pop)
+        else:
+                buffer_radius = 0
+                buffered_pop = buffered_population(buffer_curve, 0)
+
+        print('Buffer radius of ' + str(buffer_radius) + 'm found from raster distance curve for district: ' + district_code)
+
+        d_buffer_gdf = buffer_district_cropland(districts_shp, crops_shp, district_code, buffer_radius)
+        sum_buffer_points = gpd.GeoDataFrame({'raster_value': [round(buffered_pop)]}
+                                             , geometry=[d_buffer_gdf.union_all()], crs="EPSG:4326")
+
+        check_buffer = check_buffered_adp(sum_buffer_points, masterdf, district_code, buffer_radius, adp_definition)
+
+        timestamp(time_buff)
+        return check_buffer, d_buffer_gdf
+
+
+@profiled()
+def run_district_buffer(districts_shp, crops_shp, rural_points, masterdf, district_code, need_buffer, buffer_curve=None, adp_definition=ADPcn):
+        """
+        Run the buffer iteration process for a single district
+        ...
+
+        Arguments
+        ---------
+        districts_shp   : polygon of district boundaries
+        crops_shp       : polygon of cropland in state (or district)
+        rural_points    : vector grid of population points in rural areas (vector buffer method)
+        masterdf        : master results table (census ADP estimates and need_buffer by district)
+        district_code   : census designated identifier of district
+        need_buffer     : takes one of 'enlarge', 'subtract', 'unchanged', 'ineligible'
+        buffer_curve    : (sorted distances, cumulative rural population) for the district (raster buffer method only)
+        adp_definition  : census ADP definition the buffered population is compared against, e.g. 'ADPc5'
+
+        Returns
+        -------
+        sum_buffer_gdf  : GeoDataFrame with 1 row, containing buffer details, iterations used and convergence
+        buffer_poly     : GeoDataFrame containing polygon of buffered zone
+
+        """
+        buffer_radius = 50
+
+        if buffer_curve is not None:
+                sum_buffer_gdf, buffer_poly = generate_buffer_raster(districts_shp, crops_shp, masterdf, buffer_curve, district_code, need_buffer, adp_definition)
+                iteration_count = 1
+                converged = abs(sum_buffer_gdf['d_bufferedpc'].item()) <= 5
+        elif need_buffer in ['unchanged', 'ineligible']:        # Ensures districts that are initially within threshold or are ineligible 
+                                                                #  do not run through the buffer iteration process
+                sum_buffer_gdf, buffer_poly = generate_buffer(districts_shp, crops_shp, rural_points, masterdf, district_code, buffer_radius, need_buffer, adp_definition)
+                iteration_count = 1
+                converged = abs(sum_buffer_gdf['d_bufferedpc'].item()) <= 5
+        else:
+                # The district cropland and the points within the last buffer are kept across the iterations
+                crops_district = district_cropland(districts_shp, crops_shp, district_code)
+                membership = buffer_membership(rural_points)
+
+                # Signed radius -> (d_bufferedpc, (check_buffer, d_buffer_gdf))
+                def evaluate_radius(radius):
+                        buffer_type = 'enlarge' if radius >= 0 else 'subtract'
+                        check_buffer, d_buffer_gdf = generate_buffer(districts_shp, crops_district, rural_points, masterdf, district_code, abs(radius)
+                                                                     , buffer_type, adp_definition, membership)
+                        print('District ' + district_code + ' value is ' + need_buffer + ' and result: ' + check_buffer['revised_buffer'].item())
+                        print('d_bufferedpc: ' + str(round(check_buffer['d_bufferedpc'].item(),2)))
+                        return check_buffer['d_bufferedpc'].item(), (check_buffer, d_buffer_gdf)
+
+                buffer_radius, (sum_buffer_gdf, buffer_poly), iteration_count, residual, converged = solve_buffer_radius(
+                        evaluate_radius, need_buffer, initial_radius=buffer_radius, tolerance=5, max_evaluations=iteration_max)
+
+        # Record the search outcome for the district
+        sum_buffer_gdf['iterations'] = iteration_count
+        sum_buffer_gdf['converged'] = converged
+
+        print('*** District ' + district_code + ' complete. ***\n Iterations: ' + str(iteration_count) 
+              + '\n Residual (d_bufferedpc): ' + str(round(sum_buffer_gdf['d_bufferedpc'].item(),2)) + '\n')
+        return sum_buffer_gdf, buffer_poly
+
+
+@profiled()
+def partition_by_district(districts_shp, crops_shp, rural_points):
+        """
+        Split the state cropland and rural points into per-district partitions, before the buffer iteration
+        ...
+
+        NOTE: With partitions, a buffer only counts the rural points inside its own district (as the raster buffer
+              method does). Without partitions, an enlarged buffer can also count rural points in neighbouring districts.
+
+        Arguments
+        ---------
+        districts_shp   : polygon of district boundaries
+        crops_shp       : polygon of cropland in state (dissolved)
+        rural_points    : vector grid of population points in rural areas
+
+        Returns
+        -------
+        crop_partitions     : dictionary of district code -> GeoDataFrame of cropland clipped to the district
+        point_partitions    : dictionary of district code -> GeoDataFrame of rural points within the district
+
+        """
+        time_partition = time.time()
+        districts = districts_shp[['pc11_d_id', 'geometry']].reset_index(drop=True)
+
+        # Clip cropland to every district in a single overlay
+        crops_by_district = gpd.overlay(crops_shp, districts, how='intersection')
+        crop_partitions = {}
+        for district_code in districts['pc11_d_id']:
+                crop_partitions[district_code] = crops_by_district[crops_by_district['pc11_d_id'] == district_code].reset_index(drop=True)
+
+        # Slice rural points by district with one bulk query of the point spatial index
+        district_pos, point_pos = rural_points.sindex.query(districts.geometry, predicate='contains')
+        order = np.argsort(district_pos, kind='stable')
+        district_pos, point_pos = district_pos[order], point_pos[order]
+        bounds = np.searchsorted(district_pos, np.arange(len(districts) + 1))
+        point_partitions = {}
+        for i, district_code in enumerate(districts['pc11_d_id']):
+                point_partitions[district_code] = rural_points.iloc[point_pos[bounds[i]:bounds[i + 1]]].reset_index(drop=True)
+
+        print('Cropland and rural points partitioned by district.\n')
+        timestamp(time_partition)
+        return crop_partitions, point_partitions
+
+
+# Save district partitions to disk (one cropland and one rural points file per district)
+def write_partitions(crop_partitions, point_partitions, partition_folder):
+        os.makedirs(partition_folder, exist_ok=True)
+        for district_code in point_partitions:
+                crop_partitions[district_code].to_feather(os.path.join(partition_folder, f'crops_{district_code}.feather'))
+                write_points_feather(point_partitions[district_code], os.path.join(partition_folder, f'rural_{district_code}.feather'))
+
+
+# Read the cropland and rural points partitions of a single district (written by write_partitions)
+def read_partition(partition_folder, district_code):
+        crops_part = gpd.read_feather(os.path.join(partition_folder, f'crops_{district_code}.feather'))
+        points_part = read_points_feather(os.path.join(partition_folder, f'rural_{district_code}.feather'))
+        return crops_part, points_part
+
+
+# ==================================================================================================================
+# PARALLEL BUFFER ITERATION
+#   Districts are sent to a pool of worker processes. Each worker loads the shared inputs once (in init_buffer_worker),
+#   so only the district code and need_buffer value are sent with each task.
+
+_worker_inputs = {}
+
+
+# Load the shared buffer inputs into a worker process (called once per worker)
+#   The rural points are built from the memory-mapped WorldPop grid, whose pages are shared by all workers
+#   If partition_folder is given, each task reads only its own district's partition (see write_partitions)
+def init_buffer_worker(districts_path, crops_path, pop_grid_path, rural_cells_path, masterdf_path, partition_folder=None):
+        _worker_inputs['districts_shp'] = gpd.read_file(districts_path)
+        _worker_inputs['masterdf'] = pd.read_csv(masterdf_path, dtype = {'pc11_s_id':str, 'pc11_d_id':str})
+        _worker_inputs['partition_folder'] = partition_folder
+        if partition_folder is None:
+                _worker_inputs['crops_shp'] = gpd.read_feather(crops_path)
+                pop_grid, transform, crs = open_grid_store(pop_grid_path)
+                _worker_inputs['rural_points'] = grid_points(pop_grid, transform, crs, np.load(rural_cells_path))
+
+
+# Run the buffer iteration for one district, using the inputs loaded by init_buffer_worker
+def _buffer_worker(district_code, need_buffer):
+        if _worker_inputs['partition_folder'] is not None:
+                crops_shp, rural_points = read_partition(_worker_inputs['partition_folder'], district_code)
+        else:
+                crops_shp, rural_points = _worker_inputs['crops_shp'], _worker_inputs['rural_points']
+        return run_district_buffer(_worker_inputs['districts_shp'], crops_shp, rural_points
+                                   , _worker_inputs['masterdf'], district_code, need_buffer)
+
+
+def run_buffers_parallel(buffer_dict, districts_path, crops_path, pop_grid_path, rural_cells_path, masterdf_path, workers, partition_folder=None):
+        """
+        Run the buffer iteration process for all districts on a pool of worker processes
+        ...
+
+        NOTE: Workers are spawned in a pool host process (see workers.run_pool_job), so the pool runs on every platform,
+        including Windows, and the workers do not re-run the main script.
+
+        Arguments
+        ---------
+        buffer_dict         : dictionary of district code -> need_buffer
+        districts_path      : filepath of district boundaries
+        crops_path          : filepath of dissolved cropland polygon (.feather)
+        pop_grid_path       : filepath of WorldPop grid store (.npy, see raster_tools.write_grid_store)
+        rural_cells_path    : filepath of the grid cells of the rural WorldPop points (.npy of flat cell indices)
+        masterdf_path       : filepath of master results table (.csv)
+        workers             : number of worker processes
+        partition_folder    : folder of per-district partitions (see write_partitions); if None, each worker loads the
+                              full state cropland and rural points
+
+        Returns
+        -------
+        buffer_results      : list of (sum_buffer_gdf, buffer_poly), in the same order as buffer_dict
+
+        """
+        initargs = (districts_path, crops_path, pop_grid_path, rural_cells_path, masterdf_path, partition_folder)
+        return run_pool_job(run_buffer_pool, list(buffer_dict.keys()), list(buffer_dict.values()), workers, initargs)
+
+
+# Run the buffer iteration for a list of districts on a pool of spawned workers (a pool job, see workers.run_pool_job)
+def run_buffer_pool(district_codes, need_buffers, workers, initargs):
+        with spawn_pool(min(workers, max(len(district_codes), 1)), initializer=init_buffer_worker, initargs=initargs) as executor:
+                # executor.map returns results in submission order, so outputs are deterministic
+                return list(executor.map(_buffer_worker, district_codes, need_buffers))
@@ -0,0 +1,145 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# CACHE: Artifact cache for intermediate files
+#   Each intermediate file is recorded with a provenance file (<artifact>.provenance.json) holding a key built from:
+#       1. the fingerprints (path, size, modified time) of its input files
+#       2. the parameters used to generate it (state_code, scale, ghsl_model, etc.)
+#       3. the version of the code that generated it
+#   A stage is skipped only if its artifact exists and the key matches. Changing an input file, a parameter or the
+#   stage version invalidates the artifact (and, through the modified time of the new artifact, every later stage).
+
+# ==================================================================================================================
+
+import os
+import json
+import time
+import hashlib
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Sidecar files written alongside a shapefile (removed together on eviction)
+SHAPEFILE_PARTS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+
+# Path of the provenance file recorded alongside an artifact
+def provenance_path(artifact_path):
+    return artifact_path + '.provenance.json'
+
+
+# Identify an input file by path, size and modified time (content is not hashed; the national rasters are several GB)
+def file_fingerprint(path):
+    if not os.path.exists(path):
+        return {'path': os.path.normpath(path), 'missing': True}
+    stat = os.stat(path)
+    return {'path': os.path.normpath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Build the cache key of an artifact from its input fingerprints, parameters and stage version
+def artifact_key(inputs, params, version):
+    fingerprints = [file_fingerprint(path) for path in sorted(inputs)]
+    key_data = json.dumps({'inputs': fingerprints, 'params': params, 'version': version}, sort_keys=True, default=str)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest(), fingerprints
+
+
+def is_cached(artifact_path, inputs, params, version):
+        """
+        Check whether an artifact exists and was generated from the same inputs, parameters and code version
+        ...
+
+        Arguments
+        ---------
+        artifact_path   : filepath of the intermediate file
+        inputs          : list of filepaths that the artifact is generated from
+        params          : dictionary of parameters used to generate the artifact
+        version         : version of the code that generates the artifact (increase when the stage code changes)
+
+        Returns
+        -------
+        cached          : True if the artifact can be reused (the modified time of its provenance file is updated, for eviction)
+
+        """
+        if not os.path.isfile(artifact_path) or not os.path.isfile(provenance_path(artifact_path)):
+                return False
+
+        with open(provenance_path(artifact_path)) as f:
+                provenance = json.load(f)
+        key, fingerprints = artifact_key(inputs, params, version)
+        if provenance.get('key') != key:
+                print(f'Cached file {os.path.basename(artifact_path)} is out of date; regenerating.')
+                return False
+
+        # Record the use in the modified time of the provenance file (the file itself is not rewritten, as other state
+        #   processes may be reading it)
+        os.utime(provenance_path(artifact_path))
+        return True
+
+
+# Record the provenance of a newly generated artifact
+def record_artifact(artifact_path, inputs, params, version):
+    key, fingerprints = artifact_key(inputs, params, version)
+    provenance = {'artifact': os.path.normpath(artifact_path)
+                  , 'key': key
+                  , 'inputs': fingerprints
+                  , 'params': params
+                  , 'version': version
+                  , 'created': time.time()
+                  , 'last_used': time.time()}
+    # Written to a temporary file and moved into place, so a concurrent reader never sees a partial file
+    temp_path = f'{provenance_path(artifact_path)}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(provenance, f, indent=2, default=str)
+    os.replace(temp_path, provenance_path(artifact_path))
+
+
+# List the files that make up an artifact (a shapefile is several files)
+def artifact_files(artifact_path):
+    stem, ext = os.path.splitext(artifact_path)
+    if ext == '.shp':
+        return [stem + part for part in SHAPEFILE_PARTS if os.path.isfile(stem + part)]
+    return [artifact_path] if os.path.isfile(artifact_path) else []
+
+
+def evict_intermediates(folder, max_bytes):
+        """
+        Delete the least recently used cached artifacts until the folder is within the size limit
+        ...
+
+        Arguments
+        ---------
+        folder          : folder of intermediate files (searched recursively for provenance files)
+        max_bytes       : maximum total size (bytes) of cached artifacts; None = no limit
+
+        Returns
+        -------
+        evicted         : list of artifact filepaths deleted
+
+        """
+        if max_bytes is None:
+                return []
+
+        artifacts = []
+        for root, dirs, files in os.walk(folder):
+                for file in files:
+                        if file.endswith('.provenance.json'):
+                                with open(os.path.join(root, file)) as f:
+                                        provenance = json.load(f)
+                                artifact_path = os.path.join(root, file[:-len('.provenance.json')])
+                                size = sum(os.path.getsize(part) for part in artifact_files(artifact_path))
+                                last_used = max(provenance.get('last_used', 0), os.path.getmtime(os.path.join(root, file)))
+                                artifacts.append((last_used, artifact_path, size))
+
+        total_size = sum(size for last_used, artifact_path, size in artifacts)
+        evicted = []
+        for last_used, artifact_path, size in sorted(artifacts):
+                if total_size <= max_bytes:
+                        break
+                for part in artifact_files(artifact_path):
+                        os.remove(part)
+                os.remove(provenance_path(artifact_path))
+                total_size = total_size - size
+                evicted.append(artifact_path)
+                print(f'Evicted cached file {artifact_path}')
+        return evicted
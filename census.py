@@ -0,0 +1,103 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# CENSUS: Columnar cache of the Census India tables
+#   The census workbooks (B-04 main workers, B-06 marginal workers, A-1 population) are parsed from Excel once and
+#   stored as Parquet, with state and district codes fixed as strings. Tables are sorted by state code and written in
+#   small row groups, so a read filtered on the state code (predicate pushdown) only decodes that state's rows.
+#   The Parquet files are refreshed when the source workbook changes (see cache.py).
+
+# ==================================================================================================================
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cache import is_cached, record_artifact
+
+
+# ==================================================================================================================
+# TABLE LAYOUTS
+
+# Census B-04 = Main workers tables (one workbook per state)
+B04_COLUMNS = ['Table code', 'State code', 'District code', 'Area name', 'Total Rural Urban', 'Age group'
+               , 'Main workers P', 'Main workers M', 'Main workers F', 'Cultivators P', 'Cultivators M', 'Cultivators F'
+               , 'Agricultural labourers P', 'Agricultural labourers M', 'Agricultural labourers F'
+               , 'Primary sector other P', 'Primary sector other M', 'Primary sector other F'
+               ]
+B04_LAYOUT = {'names': B04_COLUMNS, 'usecols': 'A:R', 'skiprows': 8, 'skipfooter': 24
+              , 'code_columns': ['State code', 'District code']}
+
+# Census B-06 = Marginal workers tables (one workbook per state)
+B06_COLUMNS = ['Table code', 'State code', 'District code', 'Area name', 'Total Rural Urban', 'Age group'
+               , 'marginal_6m_p', 'marginal_6m_m', 'marginal_6m_f'
+               , 'marginal_3m_p', 'marginal_3m_m', 'marginal_3m_f'
+               , 'Cultivators P', 'Cultivators M', 'Cultivators F'
+               , 'Agricultural labourers P', 'Agricultural labourers M', 'Agricultural labourers F'
+               , 'Primary sector other P', 'Primary sector other M', 'Primary sector other F'
+               ]
+B06_LAYOUT = {'names': B06_COLUMNS, 'usecols': 'A:U', 'skiprows': 8, 'skipfooter': 24
+              , 'code_columns': ['State code', 'District code']}
+
+# Census A-1 = district populations (one workbook for all of India)
+A1_COLUMNS = ['State Code', 'District Code', 'Sub District Code', 'Region', 'Name', 'Total Rural Urban'
+              , 'Villages inhabited', 'Villages uninhabited', 'Number of towns', 'Number of households'
+              , 'Population', 'Males', 'Females', 'Area sq km', 'Population per sq km'
+              ]
+A1_LAYOUT = {'names': A1_COLUMNS, 'usecols': 'A:O', 'skiprows': 4, 'skipfooter': 28
+             , 'code_columns': ['State Code', 'District Code', 'Sub District Code']}
+
+# Rows per Parquet row group (the A-1 table has ~20 rows per district, so a state spans a few row groups)
+ROW_GROUP_SIZE = 2000
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+def census_to_parquet(workbook_path, parquet_path, layout, cache_key):
+        """
+        Parse a census workbook into a Parquet table, unless the cached table is up to date with the workbook
+        ...
+
+        Arguments
+        ---------
+        workbook_path   : filepath of census Excel workbook
+        parquet_path    : filepath of Parquet table
+        layout          : table layout (names, usecols, skiprows, skipfooter, code_columns), e.g. A1_LAYOUT
+        cache_key       : cache inputs, params and version of the table (see cache.py)
+
+        Returns
+        -------
+        parquet_path    : filepath of Parquet table
+
+        """
+        if is_cached(parquet_path, **cache_key):
+                return parquet_path
+
+        code_columns = layout['code_columns']
+        census_df = pd.read_excel(workbook_path
+                                  , sheet_name=0
+                                  , header = None
+                                  , names = layout['names']
+                                  , dtype = {column: str for column in code_columns}
+                                  , usecols = layout['usecols']
+                                  , skiprows = layout['skiprows']
+                                  , skipfooter = layout['skipfooter']
+                                  )
+
+        # Sort by state code so that the row group statistics of the state code column allow predicate pushdown
+        census_df = census_df.sort_values(code_columns[0], kind='stable').reset_index(drop=True)
+        schema = pa.Schema.from_pandas(census_df, preserve_index=False)
+        for column in code_columns:
+                schema = schema.set(schema.get_field_index(column), pa.field(column, pa.string()))
+        table = pa.Table.from_pandas(census_df, schema=schema, preserve_index=False)
+        pq.write_table(table, parquet_path, row_group_size=ROW_GROUP_SIZE)
+
+        record_artifact(parquet_path, **cache_key)
+        return parquet_path
+
+
+# Read a census table from its Parquet cache, keeping only the rows of one state (None = all states)
+def read_census(parquet_path, state_column, state_code=None):
+    filters = [(state_column, '==', state_code)] if state_code is not None else None
+    return pd.read_parquet(parquet_path, filters=filters)
@@ -0,0 +1,105 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# GEODESY: Metric distances and areas for WGS84 (EPSG:4326) data, without reprojecting the geometries
+#   The layers are kept in degrees (a to_crs of the dissolved cropland and GHSL polygons is too slow). Instead:
+#   - distances use the length (m) of a degree of latitude and longitude on the WGS84 ellipsoid, cached by
+#     latitude band (metres_per_degree);
+#   - buffers are drawn in a local projection of each district: coordinates are shifted to the district's centre and
+#     scaled to metres, buffered by the radius in metres, and scaled back (buffer_metres);
+#   - areas are calculated on a cylindrical equal-area grid of the WGS84 ellipsoid, a per-coordinate rescaling of the
+#     longitude and latitude (area_km2).
+
+# ==================================================================================================================
+
+import math
+from functools import lru_cache
+
+import numpy as np
+import shapely
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# WGS84 ellipsoid (semi-major axis in m, eccentricity squared)
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+
+# Width (degrees) of the latitude bands of the cached scale factors
+LATITUDE_BAND = 0.01
+
+
+# Length (m) of one degree of latitude and of longitude at the centre of a latitude band (meridian and parallel radii)
+@lru_cache(maxsize=None)
+def _band_scale(band):
+    phi = math.radians((band + 0.5) * LATITUDE_BAND)
+    w = 1 - WGS84_E2 * math.sin(phi)**2
+    m_per_deg_lat = math.radians(WGS84_A * (1 - WGS84_E2) / w**1.5)
+    m_per_deg_lon = math.radians(WGS84_A * math.cos(phi) / math.sqrt(w))
+    return m_per_deg_lat, m_per_deg_lon
+
+
+# Length (m) of one degree of latitude and of longitude at a latitude
+def metres_per_degree(latitude):
+    return _band_scale(math.floor(latitude / LATITUDE_BAND))
+
+
+# Local projection of a geometry (e.g. a district's cropland): origin at the centre of its bounds, metres per degree there
+def local_projection(geometry):
+    minx, miny, maxx, maxy = shapely.total_bounds(geometry)
+    lon0, lat0 = (minx + maxx) / 2, (miny + maxy) / 2
+    return (lon0, lat0) + metres_per_degree(lat0)
+
+
+# Convert coordinates (degrees) to metres in a local projection, or back (inverse=True)
+def _local_coords(coords, projection, inverse=False):
+    lon0, lat0, m_per_deg_lat, m_per_deg_lon = projection
+    scale = np.array([m_per_deg_lon, m_per_deg_lat])
+    if inverse:
+        return coords / scale + [lon0, lat0]
+    return (coords - [lon0, lat0]) * scale
+
+
+def buffer_metres(geometries, metres, projection=None):
+        """
+        Buffer geometries in EPSG:4326 by a distance in metres, in a local projection
+        ...
+
+        Arguments
+        ---------
+        geometries      : array or GeoSeries of geometries (EPSG:4326)
+        metres          : buffer radius in metres (negative = subtract)
+        projection      : local projection (see local_projection); built from the geometries if None. Keep the projection
+                          of a district to reuse it across the buffer iterations
+
+        Returns
+        -------
+        buffered        : array of buffered geometries (EPSG:4326)
+
+        """
+        geometries = np.asarray(geometries)
+        if metres == 0:
+                return shapely.buffer(geometries, 0)
+        if projection is None:
+                projection = local_projection(geometries)
+        local = shapely.transform(geometries, lambda coords: _local_coords(coords, projection))
+        buffered = shapely.buffer(local, metres)
+        return shapely.transform(buffered, lambda coords: _local_coords(coords, projection, inverse=True))
+
+
+# Cylindrical equal-area coordinates (km) of the WGS84 ellipsoid: x = a * lon, y = a * q(lat) / 2
+#   The area of a cell between two longitudes and latitudes is (x2 - x1) * (y2 - y1) (Snyder, Map Projections, eq. 3-12)
+def equal_area_xy(lon, lat):
+    e = math.sqrt(WGS84_E2)
+    sin_lat = np.sin(np.radians(lat))
+    q = (1 - WGS84_E2) * (sin_lat / (1 - WGS84_E2 * sin_lat**2) - np.log((1 - e * sin_lat) / (1 + e * sin_lat)) / (2 * e))
+    a_km = WGS84_A / 1000
+    return a_km * np.radians(lon), a_km * q / 2
+
+
+# Area (km2) of geometries in EPSG:4326, on the cylindrical equal-area grid (see equal_area_xy)
+def area_km2(geometries):
+    def equal_area(coords):
+        return np.column_stack(equal_area_xy(coords[:, 0], coords[:, 1]))
+    return shapely.area(shapely.transform(np.asarray(geometries), equal_area))
@@ -14,6 +14,9 @@ import glob
 import time
 from re import sub
 
+import numpy as np
+import pandas as pd
+
 
 # ********************************************
 # TODO: 
@@ -25,7 +28,7 @@ repository = 'C:/Users/joepo/Documents/Uni/UCL CASA/Dissertation/india_adp'
 scale = '100m'
 
 # 3. Set state (or list of states) to work with 
-state_code = '29'             # code taken from Census India
+state_code = os.environ.get('ADP_STATE_CODE', '29')        # code taken from Census India (batch mode sets ADP_STATE_CODE for each state, see batch.py)
 
 # 4. Set desired GHSL model to be used
 ghsl_model = 'smod_e2030_1000'      #GHSL Settlement Model Grid,    R2023, Epoch 2030, 1km,     Mollweide
@@ -48,8 +51,80 @@ tru_cat = 'Total'                   # Preference for using TOTAL count, due to d
 # ADPcn = 'ADPc3'
 ADPcn = 'ADPc5'
 
-# 9. Set maximum number of iterations for buffer process
+# 9. Set maximum number of iterations for buffer process (= calls to generate_buffer per district)
 iteration_max = 10
+
+# 10. Set method for aggregating WorldPop population to districts
+aggregation_method = 'raster'       # District, rural and cropland sums from rasterised masks and np.bincount (feasible at 100m)
+# aggregation_method = 'vector'     # Original method: sjoin + dissolve of WorldPop points
+
+# 11. Set method for the buffer iteration process
+buffer_method = 'vector'            # Buffer cropland polygons and sjoin rural WorldPop points at each iteration
+# buffer_method = 'raster'          # Signed distance of each rural WorldPop cell to cropland edge, calculated once per state
+                                    #   (distance to the district's own cropland, as the vector method clips cropland to the
+                                    #   district; counts rural cells within the district only; radius found by binary search)
+
+# 12. Set number of worker processes for the buffer iteration process (vector buffer method)
+buffer_workers = 1                  # Districts run in sequence
+# buffer_workers = os.cpu_count()   # Districts run in parallel, one worker per core
+
+# 13. Set whether to partition cropland and rural points by district before the buffer iteration process (vector buffer method)
+partition_districts = True          # Each iteration only uses the district's own cropland and rural points
+# partition_districts = False       # Each iteration uses the state cropland and rural points (buffers can count neighbouring districts' points)
+
+# 14. Set method for vectorising the GHSL and DynamicWorld rasters
+vectorise_method = 'tiled'          # Vectorise and dissolve in tiles, then merge tiles (lower memory; can run in parallel)
+# vectorise_method = 'whole'        # Original method: vectorise whole raster, then dissolve into single feature
+vectorise_tile_size = 2048          # Tile width/height in pixels
+vectorise_workers = 1               # Number of worker processes (1 = run tiles in sequence)
+
+# 15. Set maximum total size of cached intermediate files (least recently used files are deleted first)
+cache_max_gb = None                 # No limit
+# cache_max_gb = 50
+
+# 16. Set number of pipeline tasks run at the same time (script 04; independent GHSL, DynamicWorld and WorldPop tasks)
+pipeline_workers = 1                # Tasks run in sequence
+# pipeline_workers = 3              # GHSL, DynamicWorld and WorldPop branches run in parallel
+
+# 17. Set batch mode (04 --states) resources: number of states run at the same time, and memory available to them
+batch_workers = 1                   # States run in sequence
+# batch_workers = 4
+batch_memory_gb = None              # Use the memory available when the batch starts
+# batch_memory_gb = 32
+batch_bytes_per_pixel = 64          # Estimated peak memory of a state per WorldPop pixel of its bounding box (admission only)
+
+# 18. Set method for preparing the GHSL raster of the state
+ghsl_ingest = 'vrt'                 # Virtual mosaic of the tiles intersecting the state, warped onto the state's WorldPop grid
+# ghsl_ingest = 'mosaic'            # Original method: merge all tiles for India, reproject to EPSG:4326, then clip to state
+
+# 19. Set sweep mode: after the main run, calibrate buffers for every ADP definition (ADPc1 - ADPc5) and tru_cat in script 03
+sweep_mode = False
+# sweep_mode = True
+sweep_tru_cats = ['Total', 'Rural', 'Urban']
+
+# 20. Set profiling: record wall time, CPU time, memory and counts of each section in a JSON-lines run report (see profiling.py)
+profiling = False
+# profiling = True
+profile_trace = False               # Also write a Chrome trace of the run (script 04)
+profile_spans = []                  # Names of spans to run under a profiler, e.g. ['generate_buffer', 'vectorise_ghsl']
+profile_tool = 'cprofile'           # Saves a .prof file (view with snakeviz or pstats)
+# profile_tool = 'pyinstrument'     # Saves an .html call tree (requires pyinstrument)
+
+# 21. Set method for calculating the cropland and rural area of each district (area_overlays; crop_area_pc, rural_area_pc)
+area_method = 'raster'              # Count cropland / GHSL rural pixels by district, weighted by cell area in km2 (WGS84 ellipsoid)
+# area_method = 'vector'            # Original method: overlay of the dissolved polygons with the districts, area in km2 (geodesy.area_km2)
+
+# 22. Set format of the output ADP rasters (adpfinal by state, and combined for India)
+raster_output = 'cog'               # Cloud-Optimised GeoTIFF: tiled, compressed, internal overviews (average of populated cells)
+# raster_output = 'gtiff'           # Tiled, compressed GeoTIFF without overviews
+raster_compress = 'deflate'
+# raster_compress = 'zstd'          # Smaller and faster to read (requires GDAL >= 2.3)
+raster_nodata = -99999              # Nodata value of the masked cells if the WorldPop raster declares none (see raster_tools.clip_raster_tiled)
+
+# 23. Set method for combining the state ADP rasters into the India raster (script 05 / 04 --states)
+mosaic_mode = 'incremental'         # Keep the mosaic on disk and recompose only the windows of states added, changed or removed
+# mosaic_mode = 'full'              # Re-merge every state raster
+# mosaic_mode = 'vrt'               # Virtual mosaic (GDAL VRT) of the state rasters only, for previews (no pixels copied)
 # ********************************************
 
 
@@ -72,40 +147,48 @@ def snake_case(s):
     sub('([A-Z]+)', r' \1',
     s.replace('-', ' '))).split()).lower()
 
+# Census ADP definitions (see script 01, section 3)
+adp_definitions = ['ADPc1', 'ADPc2', 'ADPc3', 'ADPc4', 'ADPc5']
+
+# Column names of an ADP definition in masterdf: ADPc as % of population, and difference to ADPa (e.g. 'ADPc5_pctotal', 'd_pc5')
+def adp_columns(adp_definition):
+    return f'{adp_definition}_pctotal', f'd_pc{adp_definition[-1]}'
+
 # For the initial classification of ADP results, categorise districts on whether a buffer is required, and in which direction
-def categorise_buffer(row, column):
-    if row[column] < -5:
-        return 'subtract'
-    elif row[column] > 5:
-           return 'enlarge'
-    else:
-        return 'unchanged'
+#   Vectorised over a whole column (or array) of differences; NaN differences are 'unchanged'
+def categorise_buffer(diff):
+    diff = np.asarray(diff, dtype=float)
+    return np.select([diff < -5, diff > 5], ['subtract', 'enlarge'], default='unchanged')
 
 # For the iterative buffer process, classify if districts need:
-def buffer_logic(row, need_buffer, revised_diff): 
-    if row[need_buffer] == 'enlarge':
-        if row[revised_diff] > 5:           #   1. To enlarge the buffer further (ADPa still too low)
-            return 'enlarge'
-        elif row[revised_diff] < -5:        #   2. To enlarge using a smaller buffer radius (revised ADPa too high)
-            return 'overenlarged'
-        else:
-            return 'unchanged'
-    elif row[need_buffer] == 'subtract':   #   3. To subtract the buffer further (ADPa still too high)
-         if row[revised_diff] > 5:
-            return 'oversubtracted'
-         elif row[revised_diff] < -5:       #   4. To subtract using a smaller buffer radius (revised ADPa too low)
-            return 'subtract'
-         else:
-            return 'unchanged'
-    elif row[need_buffer] == 'unchanged':
-        if row[revised_diff] > 5:           
-            return 'enlarge'
-        if row[revised_diff] < -5:
-            return 'subtract'
-        else:
-            return 'unchanged'
-    else:
-        return 'unchanged'                  #   5. To complete the buffer iteration process (5% threshold reached)
+#   Vectorised over whole columns (or arrays) of previous labels and revised differences, e.g. many (district, radius) candidates
+def buffer_logic(need_buffer, revised_diff):
+    need_buffer = np.asarray(need_buffer)
+    revised_diff = np.asarray(revised_diff, dtype=float)
+    enlarge, subtract, unchanged = need_buffer == 'enlarge', need_buffer == 'subtract', need_buffer == 'unchanged'
+    conditions = [enlarge & (revised_diff > 5)          #   1. To enlarge the buffer further (ADPa still too low)
+                  , enlarge & (revised_diff < -5)       #   2. To enlarge using a smaller buffer radius (revised ADPa too high)
+                  , subtract & (revised_diff > 5)       #   3. To subtract using a smaller buffer radius (revised ADPa too low)
+                  , subtract & (revised_diff < -5)      #   4. To subtract the buffer further (ADPa still too high)
+                  , unchanged & (revised_diff > 5)
+                  , unchanged & (revised_diff < -5)]
+    choices = ['enlarge', 'overenlarged', 'oversubtracted', 'subtract', 'enlarge', 'subtract']
+    return np.select(conditions, choices, default='unchanged')      #   5. To complete the buffer iteration process (5% threshold reached)
+
+# Categorise districts for all ADP definitions in one call: returns a need_buffer_<ADPcN> column per definition
+def categorise_buffers(df, definitions=adp_definitions):
+    return pd.DataFrame({f'need_buffer_{adp}': categorise_buffer(df[adp_columns(adp)[1]]) for adp in definitions}, index=df.index)
+
+# Classify buffer candidates (rows of district, radius and 'buffered_pctotal') for all ADP definitions in one call
+#   The candidates need the '<ADPcN>_pctotal' and 'need_buffer_<ADPcN>' columns of each definition
+#   Returns a 'd_bufferedpc_<ADPcN>' and 'revised_buffer_<ADPcN>' column per definition
+def classify_buffer_candidates(candidates, definitions=adp_definitions):
+    classified = {}
+    for adp in definitions:
+        d_bufferedpc = candidates[adp_columns(adp)[0]] - candidates['buffered_pctotal']
+        classified[f'd_bufferedpc_{adp}'] = d_bufferedpc
+        classified[f'revised_buffer_{adp}'] = buffer_logic(candidates[f'need_buffer_{adp}'], d_bufferedpc)
+    return pd.DataFrame(classified, index=candidates.index)
   
 
 # ==================================================================================================================
@@ -132,6 +215,7 @@ boundaries_district =   os.path.join(datafolder, 'boundaries', 'district.shp' )
 locationcodes =         os.path.join(datafolder, 'census', 'CensusIndia2011_LocationDirectory.csv')         # State and district names and codes from Census
 # pop_tif =               os.path.join(datafolder, 'worldpop', f'ind_ppp_2011_{scale}_{worldpop_model}.tif')  # WorldPop UN adjusted 1km 2011 (adjust as necessary)
 # NOTE: CURRENT TRIAL = 100m CROPLAND; 1km POPULATION. NOT COMPUTATIONALLY FEASIBLE TO USE 100m POP POINTS DATA. 
+#       With aggregation_method = 'raster', district sums no longer use the points, and the 100m raster can be used for aggregation.
 pop_tif =               os.path.join(datafolder, 'worldpop', f'ind_ppp_2011_100m_{worldpop_model}.tif')  # WorldPop UN adjusted 1km 2011 (adjust as necessary)
 cropland =              os.path.join(datafolder, 'dynamicworld', f'2020_dw_{state_code}_cropland_{scale}.tif') # DynamicWorld extracted from GEE
 agworkers_main =        os.path.join(datafolder, 'census', f'DDW-B04-{state_code}00.xls')              # Census B-04 = Main workers tables
@@ -150,6 +234,7 @@ ghsl_to_merge = glob.glob(os.path.join(ghslfolder, '*.tif'))
 # These file paths store intermediate files generated during the analysis
 ghsl_merged =           os.path.join(outputfolder, 'intermediates', 'ghsl', 'ghsl_india.tif')
 ghsl_merged_wgs84 =     os.path.join(outputfolder, 'intermediates', 'ghsl', 'ghsl_india_wgs84.tif')         # CRS reprojected to WGS84
+ghsl_vrt =              os.path.join(outputfolder, 'intermediates', 'ghsl', f'ghsl_{state_code}_tiles.vrt')         # Virtual mosaic of tiles intersecting the state
 ghsl_clipped =          os.path.join(outputfolder, 'intermediates', 'ghsl', f'ghsl_{state_code}_clipped.tif')
 ghsl_poly_dissolved =   os.path.join(outputfolder, 'intermediates', 'ghsl', f'ghsl_{state_code}_vector_dissolved{sfmt}')
 ghsl_poly_shp =         os.path.join(outputfolder, 'intermediates', 'ghsl', f'ghsl_{state_code}_vector_dissolved.shp')
@@ -159,18 +244,56 @@ state_filepath =     os.path.join(outputfolder, 'intermediates', 'boundaries_sta
 districts_filepath = os.path.join(outputfolder, 'intermediates', 'boundaries_district', f'districts_{state_code}.shp')
 
 agworkers_filepath =        os.path.join(outputfolder, 'intermediates', 'census', f'agworkers_{state_code}_{tru_cat}.csv')
+census_main_cache =         os.path.join(outputfolder, 'intermediates', 'census', f'census_b04_{state_code}.parquet')   # Census workbooks parsed into Parquet (see census.py)
+census_marginal_cache =     os.path.join(outputfolder, 'intermediates', 'census', f'census_b06_{state_code}.parquet')
+census_pop_cache =          os.path.join(outputfolder, 'intermediates', 'census', 'census_a1_allstates.parquet')       # Census A-1 parsed once, shared by all states
 
 cropland_poly_dissolved =   os.path.join(outputfolder, 'intermediates', 'dynamicworld', f'cropland_vector_{state_code}_dissolved{sfmt}')
 cropland_area_path =        os.path.join(outputfolder, 'intermediates', 'dynamicworld', f'cropland_{state_code}_area.csv')
 
 pop_tif_clipped =           os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_tif_{state_code}_clipped.tif')
-pop_points =                os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_points_{state_code}{sfmt}')
-pop_points_rural_path =     os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_points_{state_code}_rural{sfmt}')
+pop_grid_path =             os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_grid_{state_code}.npy')            # Memory-mapped WorldPop grid (see raster_tools.write_grid_store)
+pop_rural_cells_path =      os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_grid_{state_code}_rural_cells.npy') # Grid cells of the rural WorldPop points
 pop_points_cropland_path =  os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_points_{state_code}_cropland{sfmt}')
 
 sum_pop_districts_path =    os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_points_{state_code}_bydistrict{sfmt}')
 sum_rupop_districts_path =  os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_points_{state_code}_rural_bydistrict{sfmt}')
 sum_crpop_districts_path =  os.path.join(outputfolder, 'intermediates', 'worldpop', f'pop_points_{state_code}_cropland_bydistrict{sfmt}')
+buffer_partition_folder =   os.path.join(outputfolder, 'intermediates', 'worldpop', f'buffer_partitions_{state_code}')
+
+# Cache keys
+# Inputs, parameters and code version of the stage that generates each intermediate file (see cache.py)
+# NOTE: Increase the version of a stage when its code changes, so that the file is regenerated
+cache_census_main =         {'inputs': [agworkers_main], 'params': {}, 'version': 1}
+cache_census_marginal =     {'inputs': [agworkers_marginal], 'params': {}, 'version': 1}
+cache_census_pop =          {'inputs': [census_population], 'params': {}, 'version': 2}
+cache_districts =           {'inputs': [boundaries_district], 'params': {'state_code': state_code}, 'version': 1}
+cache_ghsl_merged =         {'inputs': ghsl_to_merge, 'params': {'ghsl_model': ghsl_model}, 'version': 1}
+cache_ghsl_wgs84 =          {'inputs': [ghsl_merged], 'params': {'dst_crs': 'EPSG:4326'}, 'version': 1}
+cache_ghsl_clipped =        {'inputs': [ghsl_merged_wgs84, districts_filepath], 'params': {'state_code': state_code}, 'version': 2}
+cache_ghsl_warped =         {'inputs': ghsl_to_merge + [districts_filepath, pop_tif_clipped], 'params': {'state_code': state_code, 'ghsl_ingest': 'vrt'}, 'version': 1}
+cache_ghsl_poly =           {'inputs': [ghsl_clipped], 'params': {'target_classes': [11, 12, 13, 21], 'vectorise_method': vectorise_method, 'vectorise_tile_size': vectorise_tile_size}, 'version': 1}
+cache_cropland_poly =       {'inputs': [cropland], 'params': {'target_classes': [1], 'vectorise_method': vectorise_method, 'vectorise_tile_size': vectorise_tile_size}, 'version': 1}
+cache_pop_clipped =         {'inputs': [pop_tif, districts_filepath], 'params': {'state_code': state_code, 'worldpop_model': worldpop_model}, 'version': 2}
+cache_pop_grid =            {'inputs': [pop_tif_clipped], 'params': {'dtype': 'float32'}, 'version': 1}
+cache_cropland_area =       {'inputs': [cropland if area_method == 'raster' else cropland_poly_dissolved, districts_filepath], 'params': {'area_method': area_method}, 'version': 3}
+cache_rural_area =          {'inputs': [ghsl_clipped if area_method == 'raster' else ghsl_poly_dissolved, districts_filepath], 'params': {'area_method': area_method}, 'version': 3}
+
+cache_max_bytes = cache_max_gb * 1024**3 if cache_max_gb is not None else None
+
+# Pipeline state (finished tasks of script 04, used to resume a partial run)
+pipeline_state_path =       os.path.join(outputfolder, 'intermediates', f'pipeline_state_{state_code}.json')
+batch_log_folder =          os.path.join(outputfolder, 'intermediates', 'batch_logs')      # Output of each state run in batch mode
+
+# Profiling (see profiling.py)
+profile_folder =            os.path.join(outputfolder, 'intermediates', 'profiling')
+profile_report_path =       os.path.join(profile_folder, 'profile_report.jsonl')        # Spans of every run (and state), one JSON object per line
+profile_trace_path =        os.path.join(profile_folder, 'profile_trace.json')          # Chrome trace of the last run
+
+# Benchmarks (see benchmark.py): synthetic input fixtures, and the timings of every benchmark run (tagged by git commit)
+benchmark_folder =          os.path.join(outputfolder, 'benchmarks')
+benchmark_results_path =    os.path.join(benchmark_folder, 'benchmark_results.jsonl')
+
 
 # Output files
 # These file paths store the final output files used in the Results section
@@ -182,12 +305,15 @@ buffergdf_path =        os.path.join(outputfolder, 'final', 'spatial_files', f'b
 buffer_poly_path =      os.path.join(outputfolder, 'final', 'spatial_files', f'buffer_polygon_{state_code}_{tru_cat}_{ADPcn}.shp')
 bufferdf_path =         os.path.join(outputfolder, 'final', 'tables', f'bufferdf_{state_code}_{tru_cat}_{ADPcn}.csv')
 buffermap_path =        os.path.join(outputfolder, 'final', 'spatial_files', f'bufferdf_{state_code}_{tru_cat}_{ADPcn}.shp')
+sweep_results_path =    os.path.join(outputfolder, 'final', 'tables', f'sweep_{state_code}.csv')           # Sweep mode: long-format results, all definitions
 buffercombined_path =   os.path.join(outputfolder, 'final', 'tables', f'bufferdf_COMBINED_{tru_cat}_{ADPcn}.csv')
 buffercombined_map =    os.path.join(outputfolder, 'final', 'spatial_files', f'bufferdf_COMBINED_{tru_cat}_{ADPcn}.shp')
 
-pop_tif_buffer_mask =   os.path.join(outputfolder, 'final', 'spatial_files', f'adptif_{state_code}_{tru_cat}_{ADPcn}.tif')
 pop_tif_final =         os.path.join(outputfolder, 'final', 'spatial_files', f'adpfinal_{state_code}_{tru_cat}_{ADPcn}.tif')
 pop_tif_combined =      os.path.join(outputfolder, 'final', 'spatial_files', f'adpfinal_COMBINED_{tru_cat}_{ADPcn}.tif')
+pop_tif_combined_vrt =  os.path.join(outputfolder, 'final', 'spatial_files', f'adpfinal_COMBINED_{tru_cat}_{ADPcn}.vrt')
+pop_tif_mosaic =        os.path.join(outputfolder, 'final', 'spatial_files', f'adpfinal_COMBINED_{tru_cat}_{ADPcn}_mosaic.tif')    # Incremental mosaic (tiled GeoTIFF), copied to the COG
+mosaic_manifest_path =  os.path.join(outputfolder, 'final', 'spatial_files', f'adpfinal_COMBINED_{tru_cat}_{ADPcn}_tiles.json')     # State rasters of the mosaic
 
 # Figures
 bplot_adp = os.path.join(outputfolder, 'final', 'figures', f'bplot_adp_{state_code}_{tru_cat}.png')
@@ -0,0 +1,180 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# MOSAIC: Incremental India-wide mosaic of the state ADP rasters
+#   The combined raster is kept on disk (tiled GeoTIFF) with a manifest of the state rasters that fed it: path, size,
+#   modified time, content hash and bounds. When the states are combined again, only the windows covered by states
+#   that were added, changed or removed are recomposed from the state rasters; the rest of the mosaic is untouched.
+#   A virtual mosaic (GDAL VRT) of the state rasters can also be written for instant previews (no pixels copied).
+
+# ==================================================================================================================
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.windows import Window
+
+from cache import file_fingerprint
+from raster_tools import tiled_profile, build_vrt
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Content hash (sha256) of a file, read in chunks
+def file_hash(path, chunk_bytes=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Read the manifest of a mosaic (empty if the mosaic has not been built)
+def read_manifest(manifest_path):
+    if not os.path.isfile(manifest_path):
+        return {'grid': None, 'tiles': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+# Fingerprint of a state raster (path, size, modified time and bounds); the content hash is reused while size and
+#   modified time are unchanged, and only computed for new or touched files
+def tile_record(path, previous=None):
+    record = file_fingerprint(path)
+    if previous is not None and previous['size'] == record['size'] and previous['mtime_ns'] == record['mtime_ns']:
+        record['sha256'] = previous['sha256']
+    else:
+        record['sha256'] = file_hash(path)
+    with rasterio.open(path) as src:
+        record['bounds'] = list(src.bounds)
+    return record
+
+
+# Grid of a mosaic covering a list of rasters (on the grid of the first raster): transform, shape, dtype, nodata, crs
+def mosaic_grid(input_rasters):
+    with rasterio.open(input_rasters[0]) as src:
+        res_x, res_y = src.res
+        grid = {'dtype': src.dtypes[0], 'nodata': src.nodata, 'crs': src.crs.to_wkt(), 'res': [res_x, res_y]}
+        left, bottom, right, top = src.bounds
+    for path in input_rasters[1:]:
+        with rasterio.open(path) as src:
+            left, bottom = min(left, src.bounds.left), min(bottom, src.bounds.bottom)
+            right, top = max(right, src.bounds.right), max(top, src.bounds.top)
+    grid['width'] = int(round((right - left) / res_x))
+    grid['height'] = int(round((top - bottom) / res_y))
+    grid['transform'] = list(Affine(res_x, 0, left, 0, -res_y, top))[:6]
+    return grid
+
+
+# Window of the mosaic covering a bounding box (snapped outwards to whole pixels, limited to the mosaic)
+def bounds_window(bounds, transform, width, height):
+    left, bottom, right, top = bounds
+    col_start = max(int(np.floor((left - transform.c) / transform.a + 1e-6)), 0)
+    row_start = max(int(np.floor((transform.f - top) / -transform.e + 1e-6)), 0)
+    col_stop = min(int(np.ceil((right - transform.c) / transform.a - 1e-6)), width)
+    row_stop = min(int(np.ceil((transform.f - bottom) / -transform.e - 1e-6)), height)
+    return Window(col_start, row_start, max(col_stop - col_start, 0), max(row_stop - row_start, 0))
+
+
+# Recompose one window of the mosaic from the state rasters that overlap it (first raster wins, as rasterio.merge)
+def compose_window(dst, window, input_rasters, nodata):
+    fill = nodata if nodata is not None else 0
+    data = np.full((window.height, window.width), fill, dtype=dst.dtypes[0])
+    empty = np.ones(data.shape, dtype=bool)
+    left, bottom, right, top = dst.window_bounds(window)
+    for path in input_rasters:
+        with rasterio.open(path) as src:
+            if src.bounds.left >= right or src.bounds.right <= left or src.bounds.bottom >= top or src.bounds.top <= bottom:
+                continue
+            src_window = Window(int(round((left - src.transform.c) / src.transform.a))
+                                , int(round((src.transform.f - top) / -src.transform.e)), window.width, window.height)
+            src_data = src.read(1, window=src_window, boundless=True, fill_value=fill)
+            # Pixels of the window inside the source raster (the rest of the boundless read is fill)
+            inside = np.zeros(data.shape, dtype=bool)
+            inside[max(-src_window.row_off, 0):max(min(src.height - src_window.row_off, window.height), 0)
+                   , max(-src_window.col_off, 0):max(min(src.width - src_window.col_off, window.width), 0)] = True
+        if nodata is None:
+            valid = empty & inside
+        elif np.isnan(nodata):
+            valid = empty & inside & ~np.isnan(src_data)
+        else:
+            valid = empty & inside & (src_data != nodata)
+        data[valid] = src_data[valid]
+        empty &= ~valid
+    dst.write(data, 1, window=window)
+
+
+def update_mosaic(input_rasters, mosaic_path, manifest_path, compress='deflate', block_rows=1024):
+        """
+        Bring the on-disk mosaic of the state ADP rasters up to date, recomposing only the windows of states that changed
+        ...
+
+        The mosaic is rebuilt in full when it does not exist, or when its grid (extent, resolution, data type) no longer
+        covers the state rasters. Otherwise, a state raster is changed when its content hash differs from the manifest
+        (the hash is only recomputed when its size or modified time changed), new when it is not in the manifest, and
+        removed when it is in the manifest but not in input_rasters.
+
+        Arguments
+        ---------
+        input_rasters   : list of filepaths of state ADP rasters (same grid resolution and CRS)
+        mosaic_path     : filepath of mosaic (tiled GeoTIFF, updated in place)
+        manifest_path   : filepath of mosaic manifest (.json)
+        compress        : compression of the mosaic tiles, e.g. 'deflate', 'zstd'
+        block_rows      : maximum number of rows of a window recomposed at a time
+
+        Returns
+        -------
+        updated         : list of filepaths of the state rasters whose windows were recomposed (added, changed or removed)
+
+        """
+        manifest = read_manifest(manifest_path)
+        previous_tiles = manifest['tiles']
+        tiles = {os.path.normpath(path): tile_record(path, previous_tiles.get(os.path.normpath(path))) for path in input_rasters}
+        grid = mosaic_grid(input_rasters)
+
+        # States added, changed or removed since the mosaic was last updated
+        if manifest['grid'] != grid or not os.path.isfile(mosaic_path):
+                updated = list(tiles) + [path for path in previous_tiles if path not in tiles]
+                rebuild = True
+        else:
+                updated = [path for path, record in tiles.items()
+                           if path not in previous_tiles or previous_tiles[path]['sha256'] != record['sha256']]
+                updated += [path for path in previous_tiles if path not in tiles]
+                rebuild = False
+        if not rebuild and len(updated) == 0:
+                return []
+
+        transform = Affine(*grid['transform'])
+        if rebuild:
+                profile = tiled_profile(grid['dtype'], compress)
+                profile.update({'width': grid['width'], 'height': grid['height'], 'count': 1, 'dtype': grid['dtype']
+                                , 'crs': grid['crs'], 'transform': transform, 'nodata': grid['nodata']})
+                rasterio.open(mosaic_path, 'w', **profile).close()
+
+        # Recompose the windows covered by the updated states (new and old bounds of each), in blocks of rows
+        with rasterio.open(mosaic_path, 'r+') as dst:
+                if rebuild:
+                        windows = [Window(0, 0, grid['width'], grid['height'])]
+                else:
+                        bounds = [tiles[path]['bounds'] for path in updated if path in tiles]
+                        bounds += [previous_tiles[path]['bounds'] for path in updated if path in previous_tiles]
+                        windows = [bounds_window(b, transform, grid['width'], grid['height']) for b in bounds]
+                for window in windows:
+                        for row_off in range(window.row_off, window.row_off + window.height, block_rows):
+                                block = Window(window.col_off, row_off, window.width, min(block_rows, window.row_off + window.height - row_off))
+                                compose_window(dst, block, input_rasters, grid['nodata'])
+
+        with open(manifest_path, 'w') as f:
+                json.dump({'grid': grid, 'tiles': tiles}, f, indent=2)
+        return updated
+
+
+# Write a virtual mosaic (GDAL VRT) of the state ADP rasters for previews
+#   Later sources are drawn over earlier ones in a VRT, so the list is reversed: the first raster wins, as rasterio.merge
+def write_mosaic_vrt(input_rasters, vrt_path):
+    return build_vrt(list(reversed(input_rasters)), vrt_path)
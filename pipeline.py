@@ -0,0 +1,248 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# PIPELINE: Task graph and scheduler for the combined script (04)
+#   Each processing stage is a task with declared input and output files. A task depends on the tasks that write its
+#   inputs, so independent branches (GHSL, DynamicWorld, WorldPop) can run at the same time. Each task runs in its own
+#   worker process, so the memory of earlier stages is released when the task finishes.
+#   Finished tasks are recorded in a state file (pipeline_state_path), keyed on their input files, so a failed or
+#   partial run resumes from the last finished task.
+
+# ==================================================================================================================
+
+import os
+import json
+import time
+import runpy
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from globals import *       # Imports the filepaths defined in globals.py
+from cache import artifact_key
+from profiling import span
+
+
+# ==================================================================================================================
+# TASKS
+#   'run' is either a stage function ('module.function') or a script (.py), run in a fresh namespace
+#   'params' are the settings (globals.py) the task reads; changing one re-runs the task and every task downstream
+# NOTE: Script 03 runs as a single task; its zonal aggregation and buffer iteration sections share the districts,
+#       cropland and rural points already loaded in memory.
+
+pipeline_tasks = {
+    'census_prep':          {'run': 'stages.prepare_census'
+                             , 'inputs': [agworkers_main, agworkers_marginal, census_population, boundaries_state, boundaries_district]
+                             , 'outputs': [districts_filepath, agworkers_filepath]
+                             , 'params': {'state_code': state_code}},
+    'ghsl_merge':           {'run': 'stages.merge_ghsl'
+                             , 'inputs': ghsl_to_merge
+                             , 'outputs': [ghsl_merged]
+                             , 'params': {'ghsl_model': ghsl_model}},
+    'ghsl_reproject':       {'run': 'stages.reproject_ghsl'
+                             , 'inputs': [ghsl_merged]
+                             , 'outputs': [ghsl_merged_wgs84]
+                             , 'params': {}},
+    'ghsl_clip':            {'run': 'stages.clip_ghsl'
+                             , 'inputs': [ghsl_merged_wgs84, districts_filepath]
+                             , 'outputs': [ghsl_clipped]
+                             , 'params': {'state_code': state_code, 'ghsl_ingest': ghsl_ingest}},
+    'ghsl_vectorise':       {'run': 'stages.vectorise_ghsl'
+                             , 'inputs': [ghsl_clipped]
+                             , 'outputs': [ghsl_poly_dissolved]
+                             , 'params': {'vectorise_method': vectorise_method, 'vectorise_tile_size': vectorise_tile_size}},
+    'cropland_vectorise':   {'run': 'stages.vectorise_cropland'
+                             , 'inputs': [cropland]
+                             , 'outputs': [cropland_poly_dissolved]
+                             , 'params': {'vectorise_method': vectorise_method, 'vectorise_tile_size': vectorise_tile_size}},
+    'worldpop_clip':        {'run': 'stages.clip_worldpop'
+                             , 'inputs': [pop_tif, districts_filepath]
+                             , 'outputs': [pop_tif_clipped]
+                             , 'params': {'state_code': state_code, 'worldpop_model': worldpop_model}},
+    'worldpop_grid':        {'run': 'stages.worldpop_grid'
+                             , 'inputs': [pop_tif_clipped]
+                             , 'outputs': [pop_grid_path]
+                             , 'params': {}},
+    'area_overlays':        {'run': 'stages.area_by_district'
+                             , 'inputs': [cropland_poly_dissolved, ghsl_poly_dissolved, districts_filepath]
+                             , 'outputs': [cropland_area_path, rural_area_path]
+                             , 'params': {'area_method': area_method}},
+    'aggregation_buffers':  {'run': '03_aggregation_buffers.py'
+                             , 'inputs': [pop_grid_path, cropland, cropland_poly_dissolved, ghsl_poly_dissolved
+                                          , districts_filepath, agworkers_filepath, cropland_area_path, rural_area_path]
+                             , 'outputs': [masterdf_path, ineligibledf_path, buffergdf_path, bufferdf_path, buffermap_path, buffer_poly_path]
+                             , 'params': {'tru_cat': tru_cat, 'ADPcn': ADPcn, 'iteration_max': iteration_max, 'aggregation_method': aggregation_method
+                                        , 'buffer_method': buffer_method, 'partition_districts': partition_districts
+                                        , 'sweep_mode': sweep_mode, 'sweep_tru_cats': sweep_tru_cats}},
+    'adp_raster':           {'run': 'stages.adp_raster'
+                             , 'inputs': [pop_tif, ghsl_poly_dissolved, buffermap_path, districts_filepath]
+                             , 'outputs': [pop_tif_final]
+                             , 'params': {'tru_cat': tru_cat, 'ADPcn': ADPcn, 'raster_output': raster_output, 'raster_compress': raster_compress, 'raster_nodata': raster_nodata}},
+    'combine':              {'run': 'stages.combine_states'
+                             , 'inputs': [bufferdf_path, buffermap_path, pop_tif_final]
+                             , 'outputs': [buffercombined_path, buffercombined_map, pop_tif_combined]
+                             , 'params': {'tru_cat': tru_cat, 'ADPcn': ADPcn, 'raster_output': raster_output, 'raster_compress': raster_compress, 'mosaic_mode': mosaic_mode}},
+}
+
+# With sweep_mode, script 03 also writes the long-format sweep results
+if sweep_mode:
+    pipeline_tasks['aggregation_buffers']['outputs'].append(sweep_results_path)
+
+# With mosaic_mode = 'vrt', the combined India raster is a virtual mosaic
+if mosaic_mode == 'vrt':
+    pipeline_tasks['combine']['outputs'] = [buffercombined_path, buffercombined_map, pop_tif_combined_vrt]
+
+# With area_method = 'raster', district areas are counted from the cropland and GHSL rasters (no polygons needed)
+if area_method == 'raster':
+    pipeline_tasks['area_overlays']['inputs'] = [cropland, ghsl_clipped, districts_filepath]
+
+# With ghsl_ingest = 'vrt', the GHSL tiles intersecting the state are warped onto the clipped WorldPop grid (no India mosaic)
+if ghsl_ingest == 'vrt':
+    del pipeline_tasks['ghsl_merge'], pipeline_tasks['ghsl_reproject']
+    pipeline_tasks['ghsl_clip']['inputs'] = ghsl_to_merge + [districts_filepath, pop_tif_clipped]
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Dependencies of each task: the tasks that write one of its input files
+def task_dependencies(tasks):
+    writers = {os.path.normpath(path): name for name, task in tasks.items() for path in task['outputs']}
+    return {name: sorted({writers[os.path.normpath(path)] for path in task['inputs']
+                          if os.path.normpath(path) in writers and writers[os.path.normpath(path)] != name})
+            for name, task in tasks.items()}
+
+
+# All tasks upstream (ancestors) of a task
+def upstream_tasks(dependencies, name):
+    found = set()
+    to_visit = list(dependencies[name])
+    while to_visit:
+        task = to_visit.pop()
+        if task not in found:
+            found.add(task)
+            to_visit.extend(dependencies[task])
+    return found
+
+
+# All tasks downstream (descendants) of a task
+def downstream_tasks(dependencies, name):
+    dependents = {task: [other for other, deps in dependencies.items() if task in deps] for task in dependencies}
+    return upstream_tasks(dependents, name)
+
+
+# Run a single task (in a worker process), in a profiling span named after the task's script or stage function
+def run_task(run):
+    with span(run):
+        if run.endswith('.py'):
+            runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), run), run_name='__main__')
+        else:
+            module_name, function_name = run.rsplit('.', 1)
+            getattr(importlib.import_module(module_name), function_name)()
+
+
+# Key of a task run, from its input file fingerprints and settings (a changed upstream output or setting re-runs the task)
+def task_key(name, task):
+    params = {'task': name, 'run': task['run'], 'outputs': task['outputs'], 'settings': task.get('params', {})}
+    key, fingerprints = artifact_key(task['inputs'], params, 1)
+    return key
+
+
+# Read and write the record of finished tasks
+def read_pipeline_state(state_path):
+    if not os.path.isfile(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def write_pipeline_state(state_path, state):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+# A task can be skipped if it finished with the same inputs and its outputs still exist
+def is_finished(name, task, state):
+    return (name in state
+            and state[name].get('key') == task_key(name, task)
+            and all(os.path.exists(path) for path in task['outputs']))
+
+
+def run_pipeline(tasks=pipeline_tasks, start=None, until=None, workers=1, state_path=pipeline_state_path, restart=False):
+        """
+        Run the pipeline tasks in dependency order, running independent tasks at the same time
+        ...
+
+        Arguments
+        ---------
+        tasks           : dictionary of task name -> {'run', 'inputs', 'outputs', 'params'}
+        start           : name of task to start from (this task and all downstream tasks are re-run; None = all tasks)
+        until           : name of task to stop at (only this task and its upstream tasks are run; None = all tasks)
+        workers         : number of tasks run at the same time
+        state_path      : filepath of the record of finished tasks
+        restart         : True = ignore the record of finished tasks and re-run every selected task
+
+        Returns
+        -------
+        failed          : dictionary of task name -> error message, for tasks that failed (empty if the run completed)
+
+        """
+        dependencies = task_dependencies(tasks)
+        for name in (start, until):
+                if name is not None and name not in tasks:
+                        raise ValueError(f"Unknown task '{name}'. Tasks: {', '.join(tasks)}")
+
+        # Select the tasks to run
+        selected = set(tasks)
+        forced = set()
+        if until is not None:
+                selected = upstream_tasks(dependencies, until) | {until}
+        if start is not None:
+                forced = downstream_tasks(dependencies, start) | {start}
+                selected = selected & forced
+
+        state = {} if restart else read_pipeline_state(state_path)
+        pending = [name for name in tasks if name in selected]
+        completed = set()
+        running = {}
+        failed = {}
+
+        # Tasks are started in fresh worker processes ('spawn'), one process per task
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, max_tasks_per_child=1) as executor:
+                while pending or running:
+                        # Start (or skip) every task whose selected upstream tasks have completed
+                        ready = [name for name in pending if all(dep in completed or dep not in selected for dep in dependencies[name])]
+                        for name in (ready if not failed else []):
+                                pending.remove(name)
+                                if name not in forced and is_finished(name, tasks[name], state):
+                                        print(f'Task {name}: already finished, skipping.')
+                                        completed.add(name)
+                                        continue
+                                print(f'Task {name}: started.')
+                                running[executor.submit(run_task, tasks[name]['run'])] = (name, time.time())
+                        if len(ready) > 0 and not failed and not running:
+                                continue
+
+                        if not running:
+                                break
+                        done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                                name, task_start = running.pop(future)
+                                try:
+                                        future.result()
+                                except Exception as e:
+                                        print(f'Task {name}: FAILED ({type(e).__name__}: {e})')
+                                        failed[name] = f'{type(e).__name__}: {e}'
+                                        continue
+                                print(f'Task {name}: complete.')
+                                timestamp(task_start)
+                                completed.add(name)
+                                state[name] = {'key': task_key(name, tasks[name]), 'finished': time.time()}
+                                write_pipeline_state(state_path, state)
+
+        # Tasks not started because an upstream task failed
+        if failed and pending:
+                print(f"Not run (upstream task failed): {', '.join(pending)}")
+        return failed
@@ -0,0 +1,197 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# PROFILING: Stage-level spans and run report
+#   Sections of the pipeline are wrapped in spans (context manager 'span', or decorator 'profiled'). Each span records
+#   its wall time, CPU time, memory (current and peak RSS of the process) and any row/pixel counts, as one line of a
+#   JSON-lines run report (profile_report_path). Spans are nested: each line holds the name of its parent span.
+#   The report can be converted into a Chrome trace (chrome://tracing, Perfetto), and any single span can be run under
+#   cProfile or pyinstrument (profile_spans).
+#   With profiling = False, spans do nothing.
+
+# ==================================================================================================================
+
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+
+import psutil
+
+from globals import *       # Imports the settings and filepaths defined in globals.py
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Open spans of the current thread (innermost last)
+_open_spans = threading.local()
+
+# Identifier of the run, shared by the worker processes and state processes started by script 04 (see set_run_id)
+RUN_ID_VARIABLE = 'ADP_RUN_ID'
+
+
+# Set the run identifier in the environment, so that processes started from here write to the same run
+def set_run_id():
+    os.environ.setdefault(RUN_ID_VARIABLE, time.strftime('%Y%m%d_%H%M%S'))
+    return os.environ[RUN_ID_VARIABLE]
+
+
+# Current and peak resident memory (MB) of this process
+#   Peak RSS is the high-water mark of the process so far (resource on Linux/macOS, peak working set on Windows)
+def memory_mb():
+    rss = psutil.Process().memory_info()
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == 'darwin' else peak * 1024        # bytes on macOS, KB on Linux
+    except ImportError:
+        peak = getattr(rss, 'peak_wset', rss.rss)
+    return round(rss.rss / 1024**2, 1), round(peak / 1024**2, 1)
+
+
+# Add row/pixel counts to the innermost open span (ignored if no span is open or profiling is off)
+def span_counts(**counts):
+    stack = getattr(_open_spans, 'stack', [])
+    if stack:
+        stack[-1]['counts'].update({key: int(value) for key, value in counts.items()})
+
+
+# Write one span to the run report (one JSON object per line; lines from several processes are appended)
+def write_span(record, report_path=profile_report_path):
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+@contextmanager
+def span(name, **counts):
+        """
+        Record the wall time, CPU time, memory and counts of a section of code as one line of the run report
+        ...
+
+        Arguments
+        ---------
+        name            : name of section, e.g. 'ghsl_merge' or '03_join_rural'
+        **counts        : row/pixel counts known at the start (more can be added with span_counts)
+
+        Returns
+        -------
+        record          : dictionary of the span; record['counts'] can be updated within the section
+
+        """
+        stack = getattr(_open_spans, 'stack', None)
+        if stack is None:
+                stack = _open_spans.stack = []
+        record = {'span': name, 'parent': stack[-1]['span'] if stack else None, 'counts': dict(counts)}
+        if not profiling:
+                yield record
+                return
+
+        # Optional profiler for this span (profile_spans)
+        profiler = None
+        if name in profile_spans:
+                if profile_tool == 'pyinstrument':
+                        from pyinstrument import Profiler        # Optional dependency, only needed for this tool
+                        profiler = Profiler()
+                        profiler.start()
+                else:
+                        profiler = cProfile.Profile()
+                        profiler.enable()
+
+        rss_start, peak_start = memory_mb()
+        stack.append(record)
+        start = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        status = 'ok'
+        try:
+                yield record
+        except BaseException:
+                status = 'failed'
+                raise
+        finally:
+                wall = time.perf_counter() - wall_start
+                cpu = time.process_time() - cpu_start
+                stack.pop()
+                rss_end, peak_end = memory_mb()
+                if profiler is not None:
+                        record['profile'] = write_profile(profiler, name)
+                record.update({'run_id': os.environ.get(RUN_ID_VARIABLE), 'state_code': state_code, 'pid': os.getpid()
+                               , 'thread': threading.get_ident(), 'start': start, 'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4)
+                               , 'rss_start_mb': rss_start, 'rss_end_mb': rss_end, 'peak_rss_mb': peak_end, 'status': status})
+                write_span(record)
+
+
+# Decorator: run a function in a span (named after the function by default)
+def profiled(name=None):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Save the profile of a span (cProfile .prof for snakeviz/pstats, or pyinstrument .html) and return its filepath
+def write_profile(profiler, name):
+    os.makedirs(profile_folder, exist_ok=True)
+    stem = os.path.join(profile_folder, f'{name}_{state_code}_{os.getpid()}_{int(time.time())}')
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(stem + '.prof')
+        return stem + '.prof'
+    profiler.stop()
+    with open(stem + '.html', 'w') as f:
+        f.write(profiler.output_html())
+    return stem + '.html'
+
+
+# Read the spans of a run report (all runs, or only run_id)
+def read_report(report_path=profile_report_path, run_id=None):
+    if not os.path.isfile(report_path):
+        return []
+    with open(report_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [record for record in records if run_id is None or record.get('run_id') == run_id]
+
+
+def write_chrome_trace(report_path=profile_report_path, trace_path=profile_trace_path, run_id=None):
+        """
+        Convert the spans of a run report into a Chrome trace file (open in chrome://tracing or ui.perfetto.dev)
+        ...
+
+        Arguments
+        ---------
+        report_path     : filepath of JSON-lines run report
+        trace_path      : filepath of Chrome trace (.json)
+        run_id          : run to convert (None = every run in the report)
+
+        Returns
+        -------
+        trace_path      : filepath of Chrome trace
+
+        """
+        events = []
+        processes = {}
+        for record in read_report(report_path, run_id):
+                args = dict(record['counts'], cpu_s=record['cpu_s'], rss_end_mb=record['rss_end_mb']
+                            , peak_rss_mb=record['peak_rss_mb'], state_code=record['state_code'], status=record['status'])
+                events.append({'name': record['span'], 'ph': 'X', 'cat': record['state_code']
+                               , 'ts': record['start'] * 1e6, 'dur': record['wall_s'] * 1e6
+                               , 'pid': record['pid'], 'tid': record['thread'], 'args': args})
+                processes[record['pid']] = f"state {record['state_code']} (pid {record['pid']})"
+
+        # Label each process with its state
+        for pid, label in processes.items():
+                events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': label}})
+
+        os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+        with open(trace_path, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return trace_path
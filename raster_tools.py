@@ -0,0 +1,447 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# RASTER TOOLS: Raster input/output and conversion functions
+#   This script contains the functions used to read, convert and write the raster layers (WorldPop, GHSL, DynamicWorld)
+#   used in scripts 02, 03 and 05.
+
+# ==================================================================================================================
+
+import os
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+import rasterio
+import rasterio.shutil
+import shapely
+from affine import Affine
+from rasterio.features import shapes, geometry_mask, geometry_window
+from rasterio.windows import Window
+from rasterio.warp import reproject, transform_bounds, Resampling
+from shapely.geometry import shape, box
+from shapely.affinity import affine_transform
+
+import geopandas as gpd
+
+from workers import spawn_pool, run_pool_job
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# GeoDataFrame of points at the centre of the given cells (rows, cols), with the cell values in 'raster_value'
+def cell_points(rows, cols, cell_values, transform, crs):
+    # Cell centre coordinates from the affine transform (same as rasterio.transform.xy with offset='center')
+    x_coords = transform.c + (cols + 0.5) * transform.a + (rows + 0.5) * transform.b
+    y_coords = transform.f + (cols + 0.5) * transform.d + (rows + 0.5) * transform.e
+    return gpd.GeoDataFrame({'raster_value': cell_values}, geometry=shapely.points(x_coords, y_coords), crs=crs)
+
+
+# Write a GeoDataFrame of points to feather with native GeoArrow geometry (coordinate arrays, no WKB encoding)
+def write_points_feather(gdf_points, path):
+    table = pa.table(gdf_points.to_arrow(index=False, geometry_encoding='geoarrow'))
+    feather.write_feather(table, path)
+
+
+# Read a GeoArrow-encoded feather file (written by write_points_feather) into a GeoDataFrame
+def read_points_feather(path):
+    return gpd.GeoDataFrame.from_arrow(feather.read_table(path))
+
+
+# ==================================================================================================================
+# GRID STORE
+#   The clipped WorldPop grid is stored as a float32 .npy array (nodata, NaN and negative cells set to 0), with a .json
+#   sidecar holding its shape, affine transform and CRS. The array is opened with np.memmap, so script 03 and its
+#   worker processes share the same pages of the OS page cache, instead of each loading its own copy of the points.
+
+# Filepath of the .json sidecar of a grid store
+def grid_store_meta_path(store_path):
+    return os.path.splitext(store_path)[0] + '.json'
+
+
+def write_grid_store(raster_path, store_path, block_rows=1024):
+        """
+        Write band 1 of a raster to a memory-mappable grid store (.npy values + .json transform and CRS)
+        ...
+
+        Arguments
+        ---------
+        raster_path     : filepath of raster (e.g. WorldPop clipped to the state)
+        store_path      : filepath of grid store values (.npy)
+        block_rows      : number of rows read and written at a time
+
+        Returns
+        -------
+        store_path      : filepath of grid store values (.npy)
+
+        """
+        with rasterio.open(raster_path) as src:
+                values = np.lib.format.open_memmap(store_path, mode='w+', dtype=np.float32, shape=(src.height, src.width))
+                for row_start in range(0, src.height, block_rows):
+                        n_rows = min(block_rows, src.height - row_start)
+                        block = src.read(1, window=Window(0, row_start, src.width, n_rows), masked=True).filled(0).astype(np.float32)
+                        block[~np.isfinite(block) | (block < 0)] = 0
+                        values[row_start:row_start + n_rows] = block
+                values.flush()
+                meta = {'shape': [src.height, src.width], 'transform': list(src.transform)[:6], 'crs': src.crs.to_wkt()}
+        del values
+
+        with open(grid_store_meta_path(store_path), 'w') as f:
+                json.dump(meta, f)
+        return store_path
+
+
+# Open a grid store read-only and memory-mapped: (values, transform, crs)
+def open_grid_store(store_path):
+    with open(grid_store_meta_path(store_path)) as f:
+        meta = json.load(f)
+    values = np.load(store_path, mmap_mode='r')
+    return values, Affine(*meta['transform']), rasterio.crs.CRS.from_wkt(meta['crs'])
+
+
+# Flat (row-major) indices of the populated cells of a grid store
+def grid_cells(values):
+    return np.flatnonzero(values > 0)
+
+
+# GeoDataFrame of points at the centre of the given cells of a grid store (default: all populated cells)
+def grid_points(values, transform, crs, cells=None):
+    if cells is None:
+        cells = grid_cells(values)
+    rows, cols = np.divmod(cells, values.shape[1])
+    return cell_points(rows, cols, values.reshape(-1)[cells], transform, crs)
+
+
+# ==================================================================================================================
+# WINDOWED READS
+#   The national rasters (WorldPop, GHSL) are read only within the bounding window of the state, in blocks of rows,
+#   and outputs are written cropped to that window. I/O and output size scale with the state's area.
+
+# Window of a raster covering a bounding box (minx, miny, maxx, maxy), e.g. districts_shp.total_bounds
+def state_window(src, bounds):
+    return geometry_window(src, [box(*bounds)])
+
+
+def clip_raster_windowed(raster_path, out_path, bounds, mask_shapes, fill=None, all_touched=False, block_rows=1024):
+        """
+        Write the state window of a raster, keeping only the pixels inside every set of mask shapes
+        ...
+
+        Arguments
+        ---------
+        raster_path     : filepath of input raster (may cover all of India)
+        out_path        : filepath of output raster, cropped to the state window
+        bounds          : bounding box of the state (minx, miny, maxx, maxy), e.g. districts_shp.total_bounds
+        mask_shapes     : list of geometry lists; a pixel is kept if it falls inside (a geometry of) each list
+        fill            : value of pixels outside the mask shapes (None = nodata value of the input raster, or 0)
+        all_touched     : True = keep all pixels touched by the mask shapes (as rasterio.mask.mask)
+        block_rows      : number of rows read and written at a time
+
+        Returns
+        -------
+        out_path        : filepath of output raster
+
+        """
+        with rasterio.open(raster_path) as src:
+                window = state_window(src, bounds)
+                out_transform = src.window_transform(window)
+                out_meta = src.meta.copy()
+                out_meta.update({'height': window.height, 'width': window.width, 'transform': out_transform})
+                if fill is None:
+                        fill = src.nodata if src.nodata is not None else 0
+
+                with rasterio.open(out_path, 'w', **out_meta) as dst:
+                        for row_off in range(0, window.height, block_rows):
+                                block = Window(0, row_off, window.width, min(block_rows, window.height - row_off))
+                                src_block = Window(window.col_off, window.row_off + row_off, block.width, block.height)
+                                data = src.read(window=src_block)
+
+                                # Masks are burned with one row of overlap above and below the block, so that geometry
+                                #   edges lying on a block boundary are burned as they are for the whole window
+                                halo_top = 1 if row_off > 0 else 0
+                                halo_rows = block.height + halo_top + (1 if row_off + block.height < window.height else 0)
+                                halo_transform = dst.window_transform(Window(0, row_off - halo_top, block.width, halo_rows))
+
+                                keep = np.ones((halo_rows, block.width), dtype=bool)
+                                for geoms in mask_shapes:
+                                        geoms = list(geoms)
+                                        if len(geoms) == 0:
+                                                keep[:] = False
+                                                continue
+                                        keep &= geometry_mask(geoms, out_shape=keep.shape, transform=halo_transform
+                                                              , all_touched=all_touched, invert=True)
+                                keep = keep[halo_top:halo_top + block.height]
+                                data[:, ~keep] = fill
+                                dst.write(data, window=block)
+        return out_path
+
+
+def clip_raster_tiled(raster_path, out_path, bounds, mask_shapes, fill=None, nodata=None, block_size=512, compress='deflate'):
+        """
+        Write the state window of a raster as a tiled, compressed GeoTIFF, keeping only the pixels inside every set of
+        mask shapes, one output tile at a time
+        ...
+
+        Each tile of the output is read from the input, masked by all sets of mask shapes at once (pixel centres, as
+        clip_raster_windowed) and written, so memory use is one tile and there is no intermediate raster. Only the
+        mask geometries intersecting a tile are burned for it.
+
+        Arguments
+        ---------
+        raster_path     : filepath of input raster (may cover all of India)
+        out_path        : filepath of output raster, cropped to the state window
+        bounds          : bounding box of the state (minx, miny, maxx, maxy), e.g. districts_shp.total_bounds
+        mask_shapes     : list of geometry lists; a pixel is kept if it falls inside (a geometry of) each list
+        fill            : value of pixels outside the mask shapes (None = nodata value of the output raster, or 0)
+        nodata          : nodata value of the output raster if the input raster declares none (None = no nodata value)
+        block_size      : width and height of the output tiles (multiple of 16)
+        compress        : compression of the output tiles, e.g. 'deflate', 'zstd', 'lzw'
+
+        Returns
+        -------
+        out_path        : filepath of output raster
+
+        """
+        # Index the parts of each set of mask shapes, to select the parts intersecting a tile
+        mask_parts = []
+        for geoms in mask_shapes:
+                parts = shapely.get_parts(np.asarray([geom if isinstance(geom, shapely.Geometry) else shape(geom) for geom in geoms], dtype=object))
+                parts = parts[~shapely.is_empty(parts)]
+                mask_parts.append((parts, shapely.STRtree(parts)))
+
+        with rasterio.open(raster_path) as src:
+                window = state_window(src, bounds)
+                out_meta = src.meta.copy()
+                out_meta.update({'height': window.height, 'width': window.width, 'transform': src.window_transform(window)})
+                out_meta.update(tiled_profile(src.dtypes[0], compress, block_size))
+                if src.nodata is None and nodata is not None:
+                        out_meta['nodata'] = nodata
+                if fill is None:
+                        fill = out_meta['nodata'] if out_meta['nodata'] is not None else 0
+
+                with rasterio.open(out_path, 'w', **out_meta) as dst:
+                        for _, block in dst.block_windows(1):
+                                data = src.read(window=Window(window.col_off + block.col_off, window.row_off + block.row_off
+                                                              , block.width, block.height))
+
+                                # Masks are burned with one pixel of overlap around the tile, so that geometry edges
+                                #   lying on a tile boundary are burned as they are for the whole window
+                                row_start, col_start = max(block.row_off - 1, 0), max(block.col_off - 1, 0)
+                                row_stop = min(block.row_off + block.height + 1, window.height)
+                                col_stop = min(block.col_off + block.width + 1, window.width)
+                                halo = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+                                halo_transform = dst.window_transform(halo)
+                                tile_box = box(*dst.window_bounds(halo))
+
+                                keep = np.ones((halo.height, halo.width), dtype=bool)
+                                for parts, tree in mask_parts:
+                                        tile_parts = parts[tree.query(tile_box, predicate='intersects')]
+                                        if len(tile_parts) == 0:
+                                                keep[:] = False
+                                                break
+                                        keep &= geometry_mask(tile_parts, out_shape=keep.shape, transform=halo_transform, invert=True)
+                                top, left = block.row_off - row_start, block.col_off - col_start
+                                keep = keep[top:top + block.height, left:left + block.width]
+                                data[:, ~keep] = fill
+                                dst.write(data, window=block)
+        return out_path
+
+
+# ==================================================================================================================
+# CLOUD-OPTIMISED GEOTIFF
+#   Output rasters (per-state and combined ADP) are written as tiled, compressed GeoTIFFs, then copied to the COG layout
+#   (GDAL COG driver): tiles and internal overviews ordered so that a viewer reads only the tiles and zoom level it needs.
+
+# Creation options of a tiled, compressed GeoTIFF (predictor 3 for floating point values, 2 for integers)
+def tiled_profile(dtype, compress='deflate', block_size=512):
+    predictor = 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2
+    return {'driver': 'GTiff', 'tiled': True, 'blockxsize': block_size, 'blockysize': block_size
+            , 'compress': compress, 'predictor': predictor, 'BIGTIFF': 'IF_SAFER'}
+
+
+# Filepath of the tiled GeoTIFF written before the copy to a COG
+def tiled_path(out_path):
+    return os.path.splitext(out_path)[0] + '_tiled.tif'
+
+
+def write_cog(raster_path, cog_path, compress='deflate', block_size=512, resampling='average', remove_source=True):
+        """
+        Copy a raster to a Cloud-Optimised GeoTIFF with internal overviews
+        ...
+
+        Overviews are built by averaging the pixels that are not nodata, i.e. the mean population per cell at each zoom
+        level (population density). Masked cells are only left out of the average if the input raster declares a nodata
+        value (see the nodata argument of clip_raster_tiled); otherwise their fill value is averaged in.
+
+        Arguments
+        ---------
+        raster_path     : filepath of input raster (e.g. a tiled GeoTIFF written by clip_raster_tiled, see tiled_path)
+        cog_path        : filepath of output COG
+        compress        : compression of the tiles and overviews, e.g. 'deflate', 'zstd'
+        block_size      : width and height of the tiles
+        resampling      : resampling method of the overviews
+        remove_source   : True = delete the input raster once copied
+
+        Returns
+        -------
+        cog_path        : filepath of output COG
+
+        """
+        with rasterio.open(raster_path) as src:
+                rasterio.shutil.copy(src, cog_path, driver='COG', COMPRESS=compress.upper(), PREDICTOR='YES'
+                                     , BLOCKSIZE=block_size, OVERVIEW_RESAMPLING=resampling.upper()
+                                     , NUM_THREADS='ALL_CPUS', BIGTIFF='IF_SAFER')
+        if remove_source:
+                os.remove(raster_path)
+        return cog_path
+
+
+# ==================================================================================================================
+# VIRTUAL MOSAIC AND WARP TO STATE GRID
+#   The GHSL tiles that intersect the state are combined into a virtual mosaic (GDAL VRT; no pixels are copied), and
+#   warped straight onto the state's WorldPop grid. The national mosaic is never written or held in memory.
+
+# List the raster tiles whose extent intersects a bounding box (in bounds_crs)
+def tiles_intersecting(tile_paths, bounds, bounds_crs):
+    intersecting = []
+    for tile_path in tile_paths:
+        with rasterio.open(tile_path) as src:
+            left, bottom, right, top = transform_bounds(bounds_crs, src.crs, *bounds, densify_pts=21)
+            if left < src.bounds.right and right > src.bounds.left and bottom < src.bounds.top and top > src.bounds.bottom:
+                intersecting.append(tile_path)
+    return intersecting
+
+
+# Build a virtual mosaic (GDAL VRT) of a list of raster tiles
+#   GDAL's Python bindings are only imported here, so they are not needed by the other raster tools
+def build_vrt(tile_paths, vrt_path):
+    from osgeo import gdal
+    vrt = gdal.BuildVRT(vrt_path, tile_paths)
+    vrt = None          # closing the dataset writes the .vrt file
+    return vrt_path
+
+
+def warp_to_grid(raster_path, grid_path, out_path, mask_shapes=None, fill=0, all_touched=True, resampling=Resampling.nearest):
+        """
+        Warp a raster (or virtual mosaic) onto the grid of another raster, e.g. the state's clipped WorldPop raster
+        ...
+
+        Arguments
+        ---------
+        raster_path     : filepath of input raster or .vrt (any CRS)
+        grid_path       : filepath of raster defining the output CRS, transform and shape
+        out_path        : filepath of output raster
+        mask_shapes     : geometries (in the grid CRS); pixels outside them are set to fill (None = no mask)
+        fill            : value of pixels outside the mask shapes, and of pixels not covered by the input
+        all_touched     : True = keep all pixels touched by the mask shapes (as rasterio.mask.mask)
+        resampling      : resampling method (nearest for classified rasters)
+
+        Returns
+        -------
+        out_path        : filepath of output raster
+
+        """
+        with rasterio.open(grid_path) as grid:
+                grid_crs, grid_transform, grid_shape = grid.crs, grid.transform, grid.shape
+
+        with rasterio.open(raster_path) as src:
+                out_meta = src.meta.copy()
+                warped = np.full(grid_shape, fill, dtype=src.dtypes[0])
+                reproject(source=rasterio.band(src, 1)
+                          , destination=warped
+                          , src_transform=src.transform
+                          , src_crs=src.crs
+                          , src_nodata=src.nodata
+                          , dst_transform=grid_transform
+                          , dst_crs=grid_crs
+                          , dst_nodata=fill
+                          , resampling=resampling)
+
+        if mask_shapes is not None:
+                outside = geometry_mask(list(mask_shapes), out_shape=grid_shape, transform=grid_transform, all_touched=all_touched)
+                warped[outside] = fill
+
+        out_meta.update({'driver': 'GTiff', 'count': 1, 'crs': grid_crs, 'transform': grid_transform
+                         , 'height': grid_shape[0], 'width': grid_shape[1]})
+        with rasterio.open(out_path, 'w', **out_meta) as dst:
+                dst.write(warped, 1)
+        return out_path
+
+
+# ==================================================================================================================
+# TILED VECTORISATION
+#   The raster is polygonised in tiles (windows), each tile is dissolved in a worker process, and the tiles are then
+#   merged with a hierarchical union. Polygons are built in pixel coordinates (exact integers) so that edges shared
+#   across tile boundaries match exactly, and the raster's transform is applied once to the final geometry.
+
+# Polygonise the target classes in one window of the raster and dissolve them (in pixel coordinates)
+def _vectorise_tile(raster_path, window, target_classes):
+    with rasterio.open(raster_path) as src:
+        tile_data = src.read(1, window=window)
+    tile_mask = np.isin(tile_data, target_classes)
+    if not tile_mask.any():
+        return None
+    pixel_transform = Affine.translation(window.col_off, window.row_off)
+    polygons = [shape(geom) for geom, val in shapes(tile_data, mask=tile_mask, transform=pixel_transform)]
+    return shapely.union_all(polygons)
+
+
+# Union a group of geometries (one step of the hierarchical union)
+def _union_group(geoms):
+    return shapely.union_all(geoms)
+
+
+# Vectorise the tiles and union them hierarchically on a pool of spawned workers (a pool job, see workers.run_pool_job)
+def vectorise_tile_pool(raster_path, windows, target_classes, workers, fan_in):
+    with spawn_pool(workers) as executor:
+        parts = list(executor.map(_vectorise_tile, [raster_path] * len(windows), windows, [target_classes] * len(windows)))
+        parts = [part for part in parts if part is not None and not part.is_empty]
+        while len(parts) > fan_in:
+            groups = [parts[i:i + fan_in] for i in range(0, len(parts), fan_in)]
+            parts = list(executor.map(_union_group, groups))
+    return parts
+
+
+def vectorise_raster_tiled(raster_path, target_classes, tile_size=2048, workers=1, fan_in=8):
+        """
+        Vectorise the target classes of a raster into a single dissolved feature, tile by tile
+        ...
+
+        Arguments
+        ---------
+        raster_path     : filepath of classified raster (band 1 is used)
+        target_classes  : list of raster values to be vectorised
+        tile_size       : width and height (in pixels) of each tile
+        workers         : number of worker processes (1 = run in sequence)
+        fan_in          : number of geometries unioned together at each step of the hierarchical union
+
+        Returns
+        -------
+        dissolved_gdf   : GeoDataFrame with 1 row, containing the dissolved polygon of the target classes
+
+        """
+        with rasterio.open(raster_path) as src:
+                height, width = src.height, src.width
+                transform = src.transform
+                raster_crs = src.crs
+
+        windows = [Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+                   for row_off in range(0, height, tile_size)
+                   for col_off in range(0, width, tile_size)]
+
+        # Tiles are run on a pool of spawned workers (a pool job, see workers.run_pool_job), or in sequence with workers = 1
+        if workers > 1:
+                parts = run_pool_job(vectorise_tile_pool, raster_path, windows, target_classes, workers, fan_in)
+        else:
+                parts = [_vectorise_tile(raster_path, window, target_classes) for window in windows]
+                parts = [part for part in parts if part is not None and not part.is_empty]
+                while len(parts) > fan_in:
+                        parts = [_union_group(parts[i:i + fan_in]) for i in range(0, len(parts), fan_in)]
+
+        dissolved = _union_group(parts) if len(parts) > 0 else shapely.MultiPolygon()
+
+        # Convert from pixel to geographic coordinates
+        dissolved = affine_transform(dissolved, [transform.a, transform.b, transform.d, transform.e, transform.c, transform.f])
+        return gpd.GeoDataFrame({'geometry': [dissolved]}, crs=raster_crs)
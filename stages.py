@@ -0,0 +1,612 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# STAGES: Processing stages of scripts 01, 02 and 05
+#   Each stage reads its inputs from, and writes its outputs to, the file paths defined in globals.py, so stages can be
+#   run in sequence (scripts 01, 02 and 05) or scheduled separately by the pipeline runner (script 04).
+
+# ==================================================================================================================
+
+import os
+import glob
+import time
+import pandas as pd
+
+os.environ['USE_PYGEOS'] = '0'    # Disable pygeos (retired; geopandas integrates shapely)
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.merge import merge
+from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.features import shapes
+from shapely.geometry import shape
+import fiona
+
+from globals import *       # Imports the filepaths defined in globals.py
+from raster_tools import write_grid_store, open_grid_store, vectorise_raster_tiled, clip_raster_windowed, clip_raster_tiled
+from raster_tools import tiled_profile, tiled_path, write_cog
+from mosaic import update_mosaic, write_mosaic_vrt
+from raster_tools import tiles_intersecting, build_vrt, warp_to_grid
+from cache import is_cached, record_artifact
+from profiling import profiled, span_counts
+from zonal import class_area_by_district
+from geodesy import area_km2
+from census import census_to_parquet, read_census, A1_LAYOUT, B04_LAYOUT, B06_LAYOUT
+
+
+# ==================================================================================================================
+# SCRIPT 01: PREPARE FILES
+
+# 1. Create required subfolders
+def create_folders():
+    for path in data_subfolders:
+        subfolderpath = os.path.join(datafolder, path)
+        if not os.path.exists(subfolderpath):
+            print(f"Creating folder {subfolderpath}")
+            os.makedirs(subfolderpath)
+
+    for path in output_subfolders:
+        subfolderpath = os.path.join(repository,'Output', path)
+        if not os.path.exists(subfolderpath):
+            print(f"Creating folder {subfolderpath}")
+            os.makedirs(subfolderpath)
+
+    for path in output_scale_subfolders:
+        subfolderpath = os.path.join(outputfolder, path)
+        if not os.path.exists(subfolderpath):
+            print(f"Creating folder {subfolderpath}")
+            os.makedirs(subfolderpath)
+
+    for path in intermediate_subfolders:
+        subfolderpath = os.path.join(outputfolder, 'intermediates', path)
+        if not os.path.exists(subfolderpath):
+            print(f"Creating folder {subfolderpath}")
+            os.makedirs(subfolderpath)
+
+    for path in final_subfolders:
+        subfolderpath = os.path.join(outputfolder, 'final', path)
+        if not os.path.exists(subfolderpath):
+            print(f"Creating folder {subfolderpath}")
+            os.makedirs(subfolderpath)
+
+
+# 2. Parse the census workbooks into Parquet tables (refreshed only when a workbook changes)
+#   Census A-1 (national) is parsed once and shared by all states
+def parse_census_population():
+    census_to_parquet(census_population, census_pop_cache, A1_LAYOUT, cache_census_pop)
+
+
+def parse_census_workers():
+    census_to_parquet(agworkers_main, census_main_cache, B04_LAYOUT, cache_census_main)
+    census_to_parquet(agworkers_marginal, census_marginal_cache, B06_LAYOUT, cache_census_marginal)
+
+
+# Create dataframes of state and district location codes from the census A-1 table
+def census_location_codes(census_pop):
+    loc_codes = census_pop[['State Code', 'District Code', 'Sub District Code', 'Region', 'Name']]
+    state_codes = loc_codes[(loc_codes['Sub District Code']== '00000') & 
+                            (loc_codes['District Code']=='000') &
+                            (loc_codes['State Code']!='00')
+                            ]
+    state_codes = state_codes.drop_duplicates(subset='State Code')
+    district_codes = loc_codes[(loc_codes['Sub District Code']== '00000') & 
+                            (loc_codes['District Code']!='000') &
+                              (loc_codes['State Code']!='00')
+                              ]
+    district_codes = district_codes.drop_duplicates(subset='District Code')
+    return state_codes, district_codes
+
+
+# 2-3. Filter the census tables of the state to a Rural/Urban category (tru_cat), and calculate ADP1 - ADP5 by district
+def census_adp(census_ag_main, census_ag_marginal, census_pop, tru_cat):
+    # Filter Age, Rural/Urban status, and Gender
+    ag_main_cln = census_ag_main[(census_ag_main['Age group'] == 'Total') & (census_ag_main['Total Rural Urban'] == tru_cat)]
+    ag_main_cln = ag_main_cln[['State code', 'District code', 'Area name',
+           'Total Rural Urban', 'Age group', 'Main workers P'
+        #    , 'Main workers M', 'Main workers F'
+        , 'Cultivators P'
+        # , 'Cultivators M', 'Cultivators F'
+        ,  'Agricultural labourers P'
+        # , 'Agricultural labourers M', 'Agricultural labourers F'
+        , 'Primary sector other P'
+        #   , 'Primary sector other M', 'Primary sector other F'
+           ]]
+    ag_marginal_cln = census_ag_marginal[(census_ag_marginal['Age group'] == 'Total') & (census_ag_marginal['Total Rural Urban'] == tru_cat)]
+    ag_marginal_cln = ag_marginal_cln[['District code', 'marginal_6m_p'
+                                    # , 'marginal_6m_m', 'marginal_6m_f' 
+                                      , 'marginal_3m_p'
+                                    # , 'marginal_3m_m', 'marginal_3m_f'
+                                      , 'Cultivators P'
+                                    # , 'Cultivators M', 'Cultivators F'
+                                      , 'Agricultural labourers P'
+                                    # , 'Agricultural labourers M', 'Agricultural labourers F'
+                                      , 'Primary sector other P'
+                                    # , 'Primary sector other M', 'Primary sector other F'
+                                    ]]
+
+    # Filter Total Population df
+    census_pop_cln = census_pop[(census_pop['Total Rural Urban'] == tru_cat) & 
+                                (census_pop['State Code'] == state_code) &
+                                (census_pop['Sub District Code'] == '00000')
+                                ]
+    census_pop_cln = census_pop_cln[['District Code', 'Population', 'Area sq km', 'Population per sq km']]
+    census_pop_cln.rename(columns={'District Code':'District code'}, inplace=True)
+    census_pop_cln = census_pop_cln.astype({'Population':'int64'},
+                                           {'Population per sq km':'float64'})
+
+    # Join marginal file to main
+    ag_workers = ag_main_cln.merge(ag_marginal_cln, how='left', on='District code', suffixes=('_main','_marg'))
+
+
+    # Join census population file to main
+    ag_workers = ag_workers.merge(census_pop_cln, how='left', on='District code')
+
+
+
+    # ==================================================================================================================
+    # 3. CALCULATE ADP
+
+    # Method 1: Main workers only (strict crops)
+    ag_workers["ADP1"] = ag_workers["Cultivators P_main"] + ag_workers["Agricultural labourers P_main"]
+
+    # Method 2: Main workers only (all primary sector)
+    ag_workers["ADP2"] = ag_workers["Cultivators P_main"] + ag_workers["Agricultural labourers P_main"] + ag_workers["Primary sector other P_main"]
+
+    # Method 3: Main + marginal workers (strict crops)
+    ag_workers["ADP3"] = ag_workers["Cultivators P_main"] + ag_workers["Agricultural labourers P_main"] \
+        + ag_workers["Cultivators P_marg"] + ag_workers["Agricultural labourers P_marg"]
+
+    # Method 4: Main + marginal workers (all primary sector)
+    ag_workers["ADP4"] = ag_workers["Cultivators P_main"] + ag_workers["Agricultural labourers P_main"] + ag_workers["Primary sector other P_main"] \
+        + ag_workers["Cultivators P_marg"] + ag_workers["Agricultural labourers P_marg"] + ag_workers["Primary sector other P_marg"]
+
+    # Method 5: Workers proportional to population ratio (based off Method 3)
+    ag_workers["Total workers"] = ag_workers["Main workers P"] + ag_workers["marginal_6m_p"] + ag_workers["marginal_3m_p"]
+    ag_workers["ADP5"] = ag_workers["ADP3"] * (ag_workers["Population"]/ag_workers["Total workers"])
+    return ag_workers
+
+
+# 2-3. Load and clean census tables, export state district boundaries, and calculate census ADP
+@profiled()
+def prepare_census():
+    # Read in the census data (from the Parquet cache, filtered to the state)
+    parse_census_workers()
+    parse_census_population()
+    census_ag_main =        read_census(census_main_cache, 'State code', state_code)
+    census_ag_marginal =    read_census(census_marginal_cache, 'State code', state_code)
+    census_pop =            read_census(census_pop_cache, 'State Code', state_code)
+
+
+    # Create dataframe of location codes
+    state_codes, district_codes = census_location_codes(census_pop)
+
+
+    # Define state name, given the state code provided in globals.py
+    state_name = state_codes.loc[state_codes['State Code'] == state_code, 'Name'].item()
+    state_snake = snake_case(state_name)
+
+
+    # Read in shapefile
+    states = gpd.read_file(boundaries_state)
+    districts = gpd.read_file(boundaries_district)
+
+    # Create shapefile of specified State
+    # state_shp = states[states["NAME_1"] == state_name]
+    districts_shp = districts[districts['pc11_s_id'] == state_code]          # 2023-07-12 Have changed input file to SHRUG source. Includes census coding, unlike GADM. 
+
+    # Export shapefiles
+    # if not os.path.isfile(state_filepath):
+    #   state_shp.to_file(state_filepath, mode="w")
+    if not is_cached(districts_filepath, **cache_districts):
+      districts_shp.to_file(districts_filepath, mode="w")
+      record_artifact(districts_filepath, **cache_districts)
+
+
+
+    # Filter to the Rural/Urban category and calculate ADP1 - ADP5
+    ag_workers = census_adp(census_ag_main, census_ag_marginal, census_pop, tru_cat)
+
+    # Export cleaned census data
+    ag_workers.to_csv(agworkers_filepath, mode="w", index=False)
+
+
+
+# ==================================================================================================================
+# SCRIPT 02: GHSL, DYNAMICWORLD AND WORLDPOP PROCESSING
+
+# 2.1 Merge GHSL inputs into single raster covering all of India
+@profiled()
+def merge_ghsl():
+    time_21s = time.time()
+
+    if not is_cached(ghsl_merged, **cache_ghsl_merged):
+        src_files_to_merge = []            # initialise empty list
+        for file in ghsl_to_merge:
+            src = rasterio.open(file)
+            src_files_to_merge.append(src)
+
+        merged, out_trans = merge(src_files_to_merge)
+
+        out_meta = src.meta.copy()
+        out_meta.update({"driver": "GTiff",
+                        "height": merged.shape[1],
+                        "width": merged.shape[2],
+                        "transform": out_trans})
+
+        with rasterio.open(ghsl_merged          # output filepath
+                        , "w"                   # = overwrite existing files
+                        , **out_meta            # set the file metadata 
+                        ) as dest:
+            dest.write(merged)
+        record_artifact(ghsl_merged, **cache_ghsl_merged)
+    print('GHSL inputs merged into a single raster file.\n')
+    timestamp(time_21s)
+
+
+# 2.2 Convert the CRS of merged GHSL file
+@profiled()
+def reproject_ghsl():
+    time_22s = time.time()
+
+    if not is_cached(ghsl_merged_wgs84, **cache_ghsl_wgs84):
+        dst_crs = 'EPSG:4326'
+        with rasterio.open(ghsl_merged) as src:
+            transform, width, height = calculate_default_transform(
+                src.crs, dst_crs, src.width, src.height, *src.bounds)
+            kwargs = src.meta.copy()
+            kwargs.update({
+                'crs': dst_crs,
+                'transform': transform,
+                'width': width,
+                'height': height
+            })
+
+            with rasterio.open(ghsl_merged_wgs84, 'w', **kwargs) as dst:
+                for i in range(1, src.count + 1):
+                    reproject(
+                        source=rasterio.band(src, i),
+                        destination=rasterio.band(dst, i),
+                        src_transform=src.transform,
+                        src_crs=src.crs,
+                        dst_transform=transform,
+                        dst_crs=dst_crs,
+                        resampling=Resampling.nearest)
+        record_artifact(ghsl_merged_wgs84, **cache_ghsl_wgs84)
+
+    print('GHSL raster converted to CRS EPSG:4326.\n')
+    timestamp(time_22s)
+
+
+# 2.3 Clip GHSL to specified state boundary (or, with ghsl_ingest = 'vrt', warp the intersecting tiles onto the state's WorldPop grid)
+@profiled()
+def clip_ghsl():
+    time_23s = time.time()
+    # Read in vector boundaries
+    districts_shp = gpd.read_file(districts_filepath)
+
+    if ghsl_ingest == 'vrt':
+        if not is_cached(ghsl_clipped, **cache_ghsl_warped):
+            # Virtual mosaic of the GHSL tiles intersecting the state, warped onto the state's WorldPop grid (see clip_worldpop)
+            ghsl_tiles = tiles_intersecting(ghsl_to_merge, districts_shp.total_bounds, districts_shp.crs)
+            print(f'{len(ghsl_tiles)} of {len(ghsl_to_merge)} GHSL tiles intersect the state.')
+            build_vrt(ghsl_tiles, ghsl_vrt)
+            warp_to_grid(ghsl_vrt, pop_tif_clipped, ghsl_clipped
+                         , mask_shapes=districts_shp.geometry
+                         , fill=0                   # sets the value for pixels outside the vector boundaries
+                         , all_touched=True         # decides whether to consider all pixels that touch the vector features
+                         )
+            record_artifact(ghsl_clipped, **cache_ghsl_warped)
+
+    elif not is_cached(ghsl_clipped, **cache_ghsl_clipped):
+        # Read only the state window of the GHSL raster (block by block), setting pixels outside the districts to 0
+        clip_raster_windowed(ghsl_merged_wgs84, ghsl_clipped
+                             , bounds=districts_shp.total_bounds
+                             , mask_shapes=[districts_shp.geometry]
+                             , fill=0                   # sets the value for pixels outside the vector boundaries
+                             , all_touched=True         # decides whether to consider all pixels that touch the vector features
+                             )
+        record_artifact(ghsl_clipped, **cache_ghsl_clipped)
+
+    print('GHSL raster clipped to state boundaries and exported as .tif.\n')
+    timestamp(time_23s)
+
+
+# 2.5 Vectorise the GHSL raster layer (rural classes) and dissolve into a single feature
+@profiled()
+def vectorise_ghsl():
+    cached = is_cached(ghsl_poly_dissolved, **cache_ghsl_poly)
+    if vectorise_method == 'tiled' and not cached:
+        time_24s = time.time()
+
+        # Vectorise and dissolve tile by tile (in parallel if vectorise_workers > 1), then merge tiles with a hierarchical union
+        dissolved_gdf_ghsl = vectorise_raster_tiled(ghsl_clipped, [11, 12, 13, 21], tile_size=vectorise_tile_size, workers=vectorise_workers)
+        print('GHSL raster vectorised and dissolved into single feature (tiled).\n')
+
+        dissolved_gdf_ghsl.to_feather(ghsl_poly_dissolved)
+        record_artifact(ghsl_poly_dissolved, **cache_ghsl_poly)
+        print(f'GHSL vector file exported to {sfmt}.\n')
+        timestamp(time_24s)
+
+    elif not cached:
+        time_24s = time.time()
+
+        # Read in GHSL raster
+        with rasterio.open(ghsl_clipped) as src:
+            raster_data = src.read(1).astype(np.float32)    # use 'astype' to ensure values are in a format that can be used by shapely
+            transform = src.transform                       # Get the transformation matrix to convert pixel coordinates to geographic coordinates
+            raster_crs = src.crs
+
+        # Filter out the target class values during shape generation
+        target_classes = [11, 12, 13, 21]
+        vector_features = (shape(geom).buffer(0) for geom, val in shapes(raster_data, transform=transform) if val in target_classes)
+
+        # Create a GeoDataFrame directly from the shapes iterator
+        gdf_ghsl = gpd.GeoDataFrame({'geometry': vector_features}, crs=raster_crs)
+
+        gdf_ghsl['geometry'] = gdf_ghsl['geometry'].apply(lambda geom: shape(geom).buffer(0))   # Fix the geometries in GeoDataFrame (resolves self-intersections, overlapping polygons, etc.)
+
+        print('GHSL raster vectorised.\n')
+        timestamp(time_24s)
+
+        # Dissolve geometries into a single feature
+        time_25s = time.time()
+
+        gdf_ghsl['dissolve_id'] = 1                                          # Create a new column with a constant value (ensures all dissolved into a single feature)
+        dissolved_gdf_ghsl = gdf_ghsl.dissolve(by='dissolve_id', as_index=False)
+        dissolved_gdf_ghsl.drop(columns='dissolve_id', inplace=True)         # Remove the 'dissolve_id' column (optional)
+        print('GHSL vector file dissolved into single feature.\n')
+
+        dissolved_gdf_ghsl.to_feather(ghsl_poly_dissolved)
+        record_artifact(ghsl_poly_dissolved, **cache_ghsl_poly)
+        print(f'GHSL vector file exported to {sfmt}.\n')
+        timestamp(time_25s)
+
+
+# 3.1 Vectorise the DynamicWorld raster layer (cropland) and dissolve into a single feature
+@profiled()
+def vectorise_cropland():
+    cached = is_cached(cropland_poly_dissolved, **cache_cropland_poly)
+    if vectorise_method == 'tiled' and not cached:
+        # Vectorise and dissolve tile by tile (in parallel if vectorise_workers > 1), then merge tiles with a hierarchical union
+        dissolved_gdf_cropland = vectorise_raster_tiled(cropland, [1], tile_size=vectorise_tile_size, workers=vectorise_workers)
+        print('DynamicWorld raster vectorised and dissolved into single feature (tiled).\n')
+
+        dissolved_gdf_cropland.to_feather(cropland_poly_dissolved)
+        record_artifact(cropland_poly_dissolved, **cache_cropland_poly)
+        print(f'DynamicWorld vector file exported to {sfmt}.\n')
+
+    elif not cached:
+        # Read in GHSL raster
+        with rasterio.open(cropland) as src:
+            raster_data = src.read(1)                # Selects the 1st band in input file
+            # Get the transformation matrix to convert pixel coordinates to geographic coordinates
+            transform = src.transform
+            raster_crs = src.crs
+
+        # Filter out the target class values during shape generation
+        target_classes = [1]
+        vector_features = (shape(geom).buffer(0) for geom, val in shapes(raster_data, transform=transform) if val in target_classes)
+
+        # Create a GeoDataFrame directly from the shapes iterator
+        gdf_cropland = gpd.GeoDataFrame({'geometry': vector_features}, crs=raster_crs)
+
+        gdf_cropland['geometry'] = gdf_cropland['geometry'].apply(lambda geom: shape(geom).buffer(0))   # Fix the geometries in GeoDataFrame (resolves self-intersections, overlapping polygons, etc.)
+
+        print('DynamicWorld raster vectorised.\n')
+
+        # Dissolve geometries into a single feature
+        gdf_cropland['dissolve_id'] = 1                                          # Create a new column with a constant value (ensures all dissolved into a single feature)
+        dissolved_gdf_cropland = gdf_cropland.dissolve(by='dissolve_id', as_index=False)
+        dissolved_gdf_cropland.drop(columns='dissolve_id', inplace=True)         # Remove the 'dissolve_id' column (optional)
+        print('DynamicWorld vector file dissolved into single feature.\n')
+
+        dissolved_gdf_cropland.to_feather(cropland_poly_dissolved)
+        record_artifact(cropland_poly_dissolved, **cache_cropland_poly)
+        print(f'DynamicWorld vector file exported to {sfmt}.\n')
+
+
+# 4.1 Clip the boundaries of WorldPop to state
+@profiled()
+def clip_worldpop():
+    time_41s = time.time()
+    # Read in vector boundaries
+    districts_shp = gpd.read_file(districts_filepath)
+
+    if not is_cached(pop_tif_clipped, **cache_pop_clipped):
+        # Read only the state window of the national WorldPop raster (block by block)
+        clip_raster_windowed(pop_tif, pop_tif_clipped
+                             , bounds=districts_shp.total_bounds
+                             , mask_shapes=[districts_shp.geometry]
+                             , fill=0                   # sets the value for pixels outside the vector boundaries
+                             , all_touched=True         # decides whether to consider all pixels that touch the vector features
+                             )
+        record_artifact(pop_tif_clipped, **cache_pop_clipped)
+
+    print('WorldPop raster clipped to state boundaries and exported as .tif.\n')
+    timestamp(time_41s)
+
+
+# 4.2 Store the clipped WorldPop raster as a memory-mapped grid (the WorldPop source of script 03 and its workers)
+@profiled()
+def worldpop_grid():
+    if not is_cached(pop_grid_path, **cache_pop_grid):
+        time_42s = time.time()
+
+        write_grid_store(pop_tif_clipped, pop_grid_path)
+        record_artifact(pop_grid_path, **cache_pop_grid)
+        pop_grid, transform, crs = open_grid_store(pop_grid_path)
+        span_counts(pixels=pop_grid.size, populated_pixels=np.count_nonzero(pop_grid))
+        print('WorldPop grid stored as float32 .npy (memory-mapped by script 03).\n')
+        timestamp(time_42s)
+
+
+# EXTRA. Calculate cropland and rural area by district
+@profiled()
+def area_by_district():
+    # Read in vector boundaries
+    districts_shp = gpd.read_file(districts_filepath)
+
+    # Raster method: count cropland / GHSL rural pixels by district, weighted by cell area (km2)
+    if area_method == 'raster':
+        if not is_cached(cropland_area_path, **cache_cropland_area):
+            df_cropland_area = class_area_by_district(cropland, districts_shp, [1]).rename(columns={'class_area': 'cropland_area'})
+            df_cropland_area = df_cropland_area[df_cropland_area['cropland_area'] > 0]     # as the overlay, districts without cropland have no row
+            df_cropland_area['crop_area_pc'] = df_cropland_area['cropland_area'] / df_cropland_area['district_area'] * 100
+            df_cropland_area.to_csv(cropland_area_path, index=False)
+            record_artifact(cropland_area_path, **cache_cropland_area)
+
+        if not is_cached(rural_area_path, **cache_rural_area):
+            df_rural_area = class_area_by_district(ghsl_clipped, districts_shp, [11, 12, 13, 21]).rename(columns={'class_area': 'rural_area'})
+            df_rural_area = df_rural_area[df_rural_area['rural_area'] > 0]
+            df_rural_area['rural_area_pc'] = df_rural_area['rural_area'] / df_rural_area['district_area'] * 100
+            df_rural_area.to_csv(rural_area_path, index=False)
+            record_artifact(rural_area_path, **cache_rural_area)
+        return
+
+    # Calculate district area in km2 (used for both cropland and rural area percentages; see geodesy.area_km2)
+    districts_shp['district_area'] = area_km2(districts_shp.geometry.values)
+
+    if not is_cached(cropland_area_path, **cache_cropland_area):
+        cropland_poly = gpd.read_feather(cropland_poly_dissolved)
+
+        # NOTE: The layers are not transformed to a projected crs (e.g. EPSG:24378, Kalinapur 1975 / India Zone I), to save
+        #       processing time. Areas are calculated in km2 on an equal-area grid of the coordinates instead (geodesy.area_km2).
+
+        # Intersect cropland with district boundaries
+        cropland_by_district = gpd.overlay(districts_shp, cropland_poly, how="intersection")
+
+        # Calculate the area of cropland within each district
+        cropland_by_district['cropland_area'] = area_km2(cropland_by_district.geometry.values)
+        cropland_by_district['crop_area_pc'] = cropland_by_district['cropland_area'] / cropland_by_district['district_area'] * 100
+
+        # Export files
+        df_cropland_area = pd.DataFrame(cropland_by_district.drop(columns = ['geometry', 'd_name', 'pc11_s_id']))
+        df_cropland_area.to_csv(cropland_area_path, index=False)
+        record_artifact(cropland_area_path, **cache_cropland_area)
+
+
+    if not is_cached(rural_area_path, **cache_rural_area):
+        rural_poly =    gpd.read_feather(ghsl_poly_dissolved)
+        rural_by_district = districts_shp.overlay(rural_poly, how="intersection")
+        rural_by_district['rural_area'] = area_km2(rural_by_district.geometry.values)
+        rural_by_district['rural_area_pc'] = rural_by_district['rural_area'] / rural_by_district['district_area'] * 100
+        df_rural_area = pd.DataFrame(rural_by_district.drop(columns = ['geometry', 'd_name', 'pc11_s_id']))
+        df_rural_area.to_csv(rural_area_path, index=False)
+        record_artifact(rural_area_path, **cache_rural_area)
+
+
+# ==================================================================================================================
+# SCRIPT 05: OUTPUTS
+
+# 1. Raster map of ADP distribution (WorldPop masked to rural areas within the buffer zone)
+@profiled()
+def adp_raster():
+    time_adpoutput = time.time()
+
+    # NOTE: The WorldPop raster is masked on both the buffer multipolygon and the rural area polygon.
+    #   This is to ensure the final map only shows rural areas within the buffer zone (which are the only areas where population is counted).
+
+    # Import the buffer area polygon 
+    with fiona.open(buffermap_path, "r") as shapefile:
+        buffer_shapes = [feature["geometry"] for feature in shapefile]
+
+    # Import the rural area polygon (first as feather)
+    rural = gpd.read_feather(ghsl_poly_dissolved).geometry
+
+    # Mask the state window of the WorldPop raster on both polygons in one pass, tile by tile (tiled, compressed GeoTIFF)
+    #   Masked cells are nodata, so they are left out of the COG overviews and of the India mosaic
+    districts_shp = gpd.read_file(districts_filepath)
+    if raster_output == 'cog':
+        clip_raster_tiled(pop_tif, tiled_path(pop_tif_final), bounds=districts_shp.total_bounds, mask_shapes=[buffer_shapes, rural]
+                          , nodata=raster_nodata, compress=raster_compress)
+        write_cog(tiled_path(pop_tif_final), pop_tif_final, compress=raster_compress)
+    else:
+        clip_raster_tiled(pop_tif, pop_tif_final, bounds=districts_shp.total_bounds, mask_shapes=[buffer_shapes, rural]
+                          , nodata=raster_nodata, compress=raster_compress)
+
+    print('ADP raster generated.\n')
+    timestamp(time_adpoutput)
+
+
+# List the per-state result files to combine: the given states, or every completed state (excluding combined files)
+def state_result_files(folder, prefix, extension, state_list=None):
+    if state_list is not None:
+        files = [os.path.join(folder, f'{prefix}_{code}_{tru_cat}_{ADPcn}{extension}') for code in state_list]
+        return [file for file in files if os.path.isfile(file)]
+    files = glob.glob(os.path.join(folder, f'{prefix}_*_{tru_cat}_{ADPcn}{extension}'))
+    return [file for file in files if f'{prefix}_COMBINED_' not in os.path.basename(file)]
+
+
+# Merge the list of input ADP rasters together
+@profiled()
+def merge_adp_rasters(input_rasters, combined_output_path):
+    # Create list of input tifs to merge (mosaic) together
+    src_files_to_merge = []
+    for raster_path in input_rasters:
+        src = rasterio.open(raster_path)
+        src_files_to_merge.append(src)
+    print('ADP rasters appended in list.\n')
+    # Merge rasters, written chunk by chunk to a tiled, compressed GeoTIFF (the mosaic is not held in memory)
+    merged_path = tiled_path(combined_output_path) if raster_output == 'cog' else combined_output_path
+    merge(src_files_to_merge, resampling = Resampling.nearest, dst_path = merged_path
+          , dst_kwds = tiled_profile(src_files_to_merge[0].dtypes[0], raster_compress))
+    for src in src_files_to_merge:
+        src.close()
+    print('ADP rasters merged.\n')
+    # Copy to a Cloud-Optimised GeoTIFF (internal overviews)
+    if raster_output == 'cog':
+        write_cog(merged_path, combined_output_path, compress=raster_compress)
+
+
+# Combine the state ADP rasters into the India raster (see mosaic_mode)
+@profiled()
+def combine_adp_rasters(input_rasters):
+    if mosaic_mode == 'vrt':
+        write_mosaic_vrt(input_rasters, pop_tif_combined_vrt)
+        return
+    if mosaic_mode == 'full':
+        merge_adp_rasters(input_rasters, pop_tif_combined)
+        return
+
+    # Incremental: recompose only the windows of states added, changed or removed since the last combine
+    mosaic_path = pop_tif_mosaic if raster_output == 'cog' else pop_tif_combined
+    updated = update_mosaic(input_rasters, mosaic_path, mosaic_manifest_path, compress=raster_compress)
+    print(f'{len(updated)} state ADP rasters updated in the combined mosaic.\n')
+    if raster_output == 'cog' and (len(updated) > 0 or not os.path.isfile(pop_tif_combined)):
+        write_cog(mosaic_path, pop_tif_combined, compress=raster_compress, remove_source=False)
+
+
+# 2. Merge results files for all states
+@profiled()
+def combine_states(state_list=None):
+    # 2.1 Buffer files
+    bufferdf_to_merge = state_result_files(os.path.join(outputfolder, 'final', 'tables'), 'bufferdf', '.csv', state_list)
+
+    # Use loop to read the files into an empty list
+    buffer_allstates_list = []
+    for file in bufferdf_to_merge:
+        statefile = pd.read_csv(file, dtype = {'pc11_s_id':str, 'pc11_d_id':str})
+        buffer_allstates_list.append(statefile)
+
+    # Concatenate all DataFrames in the list and export combined buffer df to csv
+    buffer_combined = pd.concat(buffer_allstates_list)
+    buffer_combined.to_csv(buffercombined_path, index=False)
+
+    # 2.2 Buffer map (POLYGONS WITH ATTRIBUTES)
+    buffermap_to_merge = state_result_files(os.path.join(outputfolder, 'final', 'spatial_files'), 'bufferdf', '.shp', state_list)
+
+    buffer_allmaps_list = []
+    for file in buffermap_to_merge:
+        statefile = gpd.read_file(file)
+        buffer_allmaps_list.append(statefile)
+
+    # Concatenate all GeoDataFrames in the list and export combined buffer map to .shp
+    buffer_combined = pd.concat(buffer_allmaps_list)
+    buffer_combined.to_file(buffercombined_map)
+
+    # 2.4 Buffer map (RASTER)
+    time_mergerasters = time.time()
+    adpmap_to_merge = state_result_files(os.path.join(outputfolder, 'final', 'spatial_files'), 'adpfinal', '.tif', state_list)
+    combine_adp_rasters(adpmap_to_merge)
+    print(f'Combined ADP raster of India generated ({len(adpmap_to_merge)} states).\n')
+    timestamp(time_mergerasters)
@@ -0,0 +1,170 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# SWEEP: Buffer calibration for every ADP definition and Rural/Urban category in one pass (script 03, sweep_mode)
+#   The district WorldPop sums, cropland/rural areas and rural points (or buffer curves) do not depend on the ADP
+#   definition (ADPcn) or the census category (tru_cat). They are computed once by script 03 and shared here by the
+#   buffer calibration of each (ADP definition, tru_cat) combination. Results are returned as one long-format table.
+
+# ==================================================================================================================
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from globals import *       # Imports the settings and functions defined in globals.py
+from census import read_census
+from stages import census_adp
+from buffer_tools import run_district_buffer
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Columns of masterdf that do not depend on the ADP definition or census category
+DISTRICT_COLUMNS = ['pc11_s_id', 'pc11_d_id', 'd_name', 'worldpop', 'worldpop_rural', 'worldpop_crop', 'crop_area_pc', 'rural_area_pc']
+
+# Columns of the long-format results table
+SWEEP_COLUMNS = ['adp_definition', 'tru_cat', 'pc11_d_id', 'need_buffer', 'buffer_r', 'raster_value', 'ADPc_pctotal'
+                 , 'buffered_pctotal', 'd_bufferedpc', 'revised_buffer', 'iterations', 'converged']
+
+
+def category_masterdf(district_df, ag_workers):
+        """
+        Build the master results table of one census category from the shared district WorldPop sums and areas
+        ...
+
+        Arguments
+        ---------
+        district_df     : definition-independent columns of masterdf (DISTRICT_COLUMNS), one row per district
+        ag_workers      : census ADP by district for the category (see stages.census_adp)
+
+        Returns
+        -------
+        category_df     : masterdf with ADPc1 - ADPc5 as % of population, their differences to ADPa (d_pc1 - d_pc5),
+                          a need_buffer_<ADPcN> column per definition, and an 'eligible' flag
+
+        """
+        census_columns = ['District code', 'Population', 'ADP1', 'ADP2', 'ADP3', 'ADP4', 'ADP5']
+        category_df = district_df.merge(ag_workers[census_columns], how='left', left_on='pc11_d_id', right_on='District code')
+
+        # Calculate ADPa, and ADPc1 - ADPc5, as a % of total population, and their differences
+        category_df['ADPa_pctotal'] = category_df['worldpop_crop']/category_df['Population']*100
+        for adp in adp_definitions:
+                pctotal, diff = adp_columns(adp)
+                category_df[pctotal] = category_df[f'ADP{adp[-1]}']/category_df['Population']*100
+                category_df[diff] = category_df[pctotal] - category_df['ADPa_pctotal']
+
+        # Districts where ADP5 > worldpop_rural, or with no rural population, are ineligible (as in script 03)
+        d_rural_adp = (category_df['worldpop_rural'] - category_df['ADP5']).fillna(-999)
+        category_df['eligible'] = (d_rural_adp >= 0) & category_df['d_pc5'].notna()
+
+        need_buffers = categorise_buffers(category_df)
+        return pd.concat([category_df, need_buffers], axis=1)
+
+
+# Classify the buffers already calibrated in a category (rows of pc11_d_id, need_buffer, buffer_r, raster_value and
+#   buffered_pctotal) against every ADP definition in one call (see globals.classify_buffer_candidates)
+def classify_candidates(candidates, category_df, definitions):
+    if len(candidates) == 0:
+        return None
+    definition_columns = [adp_columns(adp)[0] for adp in definitions] + [f'need_buffer_{adp}' for adp in definitions]
+    candidate_df = pd.DataFrame(candidates).merge(category_df[['pc11_d_id'] + definition_columns], how='left', on='pc11_d_id')
+    return pd.concat([candidate_df, classify_buffer_candidates(candidate_df, definitions)], axis=1)
+
+
+def run_sweep(districts_shp, district_df, crops_shp, rural_points, crop_partitions=None, point_partitions=None, buffer_curves=None
+              , tru_cats=sweep_tru_cats, definitions=adp_definitions, exclude_districts=('518', '244'), reuse_candidates=True):
+        """
+        Calibrate the buffer of every district for each (ADP definition, tru_cat) combination, using shared inputs
+        ...
+
+        Arguments
+        ---------
+        districts_shp       : polygon of district boundaries
+        district_df         : definition-independent columns of masterdf (DISTRICT_COLUMNS)
+        crops_shp           : polygon of cropland in state (used if crop_partitions is None)
+        rural_points        : rural WorldPop points in state (used if point_partitions is None)
+        crop_partitions     : dictionary of district code -> cropland of district (see buffer_tools.partition_by_district)
+        point_partitions    : dictionary of district code -> rural points of district
+        buffer_curves       : dictionary of district code -> buffer curve (raster buffer method; see zonal.buffer_population_curves)
+        tru_cats            : census categories to sweep ('Total', 'Rural', 'Urban')
+        definitions         : ADP definitions to sweep ('ADPc1' - 'ADPc5')
+        exclude_districts   : district codes left out of the buffer process (as in script 03)
+        reuse_candidates    : True = a buffer calibrated for an earlier definition of the same district, category and need_buffer
+                              is reused if it is within the 5% threshold for the definition (the buffered population does
+                              not depend on the definition); its iterations are recorded as 0
+
+        Returns
+        -------
+        sweep_df            : long-format table with one row per (adp_definition, tru_cat, pc11_d_id) (SWEEP_COLUMNS)
+
+        """
+        time_sweep = time.time()
+        census_ag_main =        read_census(census_main_cache, 'State code', state_code)
+        census_ag_marginal =    read_census(census_marginal_cache, 'State code', state_code)
+        census_pop =            read_census(census_pop_cache, 'State Code', state_code)
+
+        sweep_rows = []
+        for category in tru_cats:
+                category_df = category_masterdf(district_df[DISTRICT_COLUMNS], census_adp(census_ag_main, census_ag_marginal, census_pop, category))
+                candidates = []         # Buffers calibrated in this category, for all definitions so far
+
+                for adp in definitions:
+                        masterdf = category_df.copy()
+                        masterdf['need_buffer'] = masterdf[f'need_buffer_{adp}'].where(masterdf['eligible'], 'ineligible')
+                        pctotal = adp_columns(adp)[0]
+                        classified = classify_candidates(candidates, category_df, definitions) if reuse_candidates else None
+
+                        for district_code, need_buffer in zip(masterdf['pc11_d_id'], masterdf['need_buffer']):
+                                if district_code in exclude_districts:
+                                        continue
+                                if need_buffer == 'ineligible':
+                                        sweep_rows.append({'adp_definition': adp, 'tru_cat': category, 'pc11_d_id': district_code
+                                                           , 'need_buffer': need_buffer})
+                                        continue
+
+                                # Reuse a buffer of an earlier definition that is already within the threshold for this definition
+                                if classified is not None and need_buffer in ['enlarge', 'subtract']:
+                                        reusable = classified[(classified['pc11_d_id'] == district_code) & (classified['need_buffer'] == need_buffer)
+                                                              & (classified[f'revised_buffer_{adp}'] == 'unchanged')]
+                                        if len(reusable) > 0:
+                                                result = reusable.iloc[0]
+                                                sweep_rows.append({'adp_definition': adp, 'tru_cat': category, 'pc11_d_id': district_code
+                                                                   , 'need_buffer': need_buffer
+                                                                   , 'buffer_r': result['buffer_r']
+                                                                   , 'raster_value': result['raster_value']
+                                                                   , 'ADPc_pctotal': result[pctotal]
+                                                                   , 'buffered_pctotal': result['buffered_pctotal']
+                                                                   , 'd_bufferedpc': result[f'd_bufferedpc_{adp}']
+                                                                   , 'revised_buffer': 'unchanged'
+                                                                   , 'iterations': 0
+                                                                   , 'converged': True})
+                                                continue
+
+                                crops = crop_partitions[district_code] if crop_partitions is not None else crops_shp
+                                points = point_partitions[district_code] if point_partitions is not None else rural_points
+                                curve = buffer_curves[district_code] if buffer_curves is not None else None
+                                sum_buffer_gdf, buffer_poly = run_district_buffer(districts_shp, crops, points, masterdf, district_code
+                                                                                  , need_buffer, curve, adp_definition=adp)
+
+                                result = sum_buffer_gdf.iloc[0]
+                                sweep_rows.append({'adp_definition': adp, 'tru_cat': category, 'pc11_d_id': district_code
+                                                   , 'need_buffer': need_buffer
+                                                   , 'buffer_r': result['buffer_r']
+                                                   , 'raster_value': result['raster_value']
+                                                   , 'ADPc_pctotal': result[pctotal]
+                                                   , 'buffered_pctotal': result['buffered_pctotal']
+                                                   , 'd_bufferedpc': result['d_bufferedpc']
+                                                   , 'revised_buffer': result['revised_buffer']
+                                                   , 'iterations': result['iterations']
+                                                   , 'converged': result['converged']})
+                                candidates.append({'pc11_d_id': district_code, 'need_buffer': need_buffer, 'buffer_r': result['buffer_r']
+                                                   , 'raster_value': result['raster_value'], 'buffered_pctotal': result['buffered_pctotal']})
+
+                print(f'Sweep complete for tru_cat = {category}.\n')
+
+        sweep_df = pd.DataFrame(sweep_rows, columns=SWEEP_COLUMNS)
+        timestamp(time_sweep)
+        return sweep_df
@@ -0,0 +1,13 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# TESTS: Checks of the buffer solver and incremental mosaic on the synthetic inputs of benchmark.py
+#   Run from the repository folder with: python -m pytest tests
+
+# ==================================================================================================================
+
+import os
+import sys
+
+# The modules of the scripts are in the repository folder (no package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
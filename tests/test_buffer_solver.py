@@ -0,0 +1,50 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# TEST BUFFER SOLVER: buffer_tools.solve_buffer_radius on a monotone buffered-population curve
+#   The curve is the cumulative population of a synthetic field (benchmark.smooth_field) by distance from the cropland,
+#   so d_bufferedpc decreases as the signed radius increases, as for a district buffer.
+
+# ==================================================================================================================
+
+import numpy as np
+import pytest
+
+from benchmark import smooth_field
+from buffer_tools import solve_buffer_radius
+
+
+# Evaluate function of a district: d_bufferedpc (ADPc - buffered ADPa, % of population) at a signed radius (m)
+def curve_evaluate(adp_pctotal, pixel_m=100):
+    field = smooth_field(np.random.default_rng(0), (64, 64), 8).ravel() + 0.01
+    population = np.cumsum(field) / field.sum() * 100      # Buffered % of population, increasing with radius
+    crop_pixels = len(population) // 2                      # Radius 0 = cropland covers half of the district
+
+    def evaluate(radius):
+        position = np.clip(crop_pixels + radius / pixel_m, 0, len(population) - 1)
+        buffered_pctotal = np.interp(position, np.arange(len(population)), population)
+        return adp_pctotal - buffered_pctotal, {'buffer_r': radius, 'buffered_pctotal': buffered_pctotal}
+    return evaluate
+
+
+@pytest.mark.parametrize('need_buffer, adp_pctotal', [('enlarge', 90), ('subtract', 8)])
+def test_solver_brackets_and_converges(need_buffer, adp_pctotal):
+    evaluate = curve_evaluate(adp_pctotal)
+    radius, result, evaluations, residual, converged = solve_buffer_radius(evaluate, need_buffer, initial_radius=50
+                                                                           , tolerance=0.5, max_evaluations=30)
+    assert converged
+    assert abs(residual) <= 0.5
+    assert np.sign(radius) == (1 if need_buffer == 'enlarge' else -1)
+    assert result['buffer_r'] == radius
+    assert abs(evaluate(radius)[0] - residual) < 1e-9
+    assert evaluations <= 30
+
+
+def test_solver_stops_at_max_evaluations():
+    # Unreachable target: the search stops at the evaluation limit with the largest (closest) buffer found
+    evaluate = curve_evaluate(150)
+    radius, result, evaluations, residual, converged = solve_buffer_radius(evaluate, 'enlarge', max_evaluations=6)
+    assert not converged
+    assert evaluations == 6
+    assert residual > 0
+    assert residual == pytest.approx(evaluate(radius)[0])
@@ -0,0 +1,59 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# TEST MOSAIC: mosaic.update_mosaic against a full rasterio.merge of the state rasters
+#   The state ADP rasters are synthetic fields (benchmark.smooth_field) on overlapping parts of one grid.
+
+# ==================================================================================================================
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.merge import merge
+from rasterio.transform import from_origin
+
+from benchmark import smooth_field, write_fixture_raster
+from mosaic import update_mosaic
+
+NODATA = -9999.0
+RES = 0.01
+
+
+# Write a synthetic state ADP raster with its top-left pixel at (col, row) of the India grid
+def write_state(path, rng, col, row, nodata, shape=(40, 50)):
+    data = (smooth_field(rng, shape, 8) * 100).astype('float32')
+    if nodata is not None:
+        data[:3, :3] = nodata       # Nodata pixels show the rasters below
+    write_fixture_raster(path, data, from_origin(70 + col * RES, 30 - row * RES, RES, RES), nodata=nodata)
+
+
+# Full merge of the state rasters (first raster wins)
+def full_merge(paths, nodata):
+    sources = [rasterio.open(path) for path in paths]
+    try:
+        data, transform = merge(sources, nodata=nodata)
+    finally:
+        for src in sources:
+            src.close()
+    return data[0], transform
+
+
+@pytest.mark.parametrize('nodata', [NODATA, None])
+def test_incremental_mosaic_equals_full_merge(tmp_path, nodata):
+    rng = np.random.default_rng(0)
+    paths = [str(tmp_path / f'state_{i}.tif') for i in range(3)]
+    for path, (col, row) in zip(paths, [(0, 0), (30, 10), (10, 35)]):
+        write_state(path, rng, col, row, nodata)
+    mosaic_path, manifest_path = str(tmp_path / 'mosaic.tif'), str(tmp_path / 'mosaic.json')
+
+    assert sorted(update_mosaic(paths, mosaic_path, manifest_path, block_rows=16)) == sorted(paths)
+    assert update_mosaic(paths, mosaic_path, manifest_path, block_rows=16) == []
+
+    # One state raster changes: only it is recomposed, and the mosaic still equals a full merge
+    write_state(paths[1], rng, 30, 10, nodata)
+    assert update_mosaic(paths, mosaic_path, manifest_path, block_rows=16) == [paths[1]]
+
+    expected, transform = full_merge(paths, nodata)
+    with rasterio.open(mosaic_path) as dst:
+        assert dst.transform.almost_equals(transform)
+        np.testing.assert_array_equal(dst.read(1), expected)
@@ -0,0 +1,157 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# VECTOR TOOLS: Point-in-polygon membership for large dissolved polygons and buffers
+#   The GHSL rural and DynamicWorld cropland layers are dissolved into a single multipolygon with a very large number
+#   of vertices. A spatial join against it tests every point against the whole geometry. Instead, the geometry is
+#   broken into its parts, large parts are subdivided (quadtree) into small pieces, and the points are tested against
+#   the pieces they fall near using an STRtree, giving a boolean membership mask.
+#   The buffer iteration (script 03) also keeps the points within the previous buffer of a district, and only re-tests
+#   the points near the change in radius (buffer_membership).
+
+# ==================================================================================================================
+
+import numpy as np
+import shapely
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Split a polygon into quadrants until each piece has at most max_vertices vertices
+def _subdivide(polygon, max_vertices, pieces):
+    if shapely.get_num_coordinates(polygon) <= max_vertices:
+        pieces.append(polygon)
+        return
+    minx, miny, maxx, maxy = polygon.bounds
+    midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+    for quadrant in [(minx, miny, midx, midy), (midx, miny, maxx, midy), (minx, midy, midx, maxy), (midx, midy, maxx, maxy)]:
+        for part in shapely.get_parts(shapely.clip_by_rect(polygon, *quadrant)):
+            if isinstance(part, shapely.Polygon) and not part.is_empty:
+                _subdivide(part, max_vertices, pieces)
+
+
+def polygon_pieces(polygons, max_vertices=256):
+        """
+        Break a (dissolved) polygon layer into small pieces for indexing
+        ...
+
+        Arguments
+        ---------
+        polygons        : array or GeoSeries of (multi)polygons
+        max_vertices    : maximum number of vertices of a piece (parts with more vertices are subdivided into quadrants)
+
+        Returns
+        -------
+        pieces          : array of polygon pieces
+        parent          : array of the position of each piece's parent part in parts
+        parts           : array of the polygon parts (single polygons) of the input layer
+
+        """
+        parts = shapely.get_parts(np.asarray(polygons))
+        parts = parts[~shapely.is_empty(parts)]
+        pieces, parent = [], []
+        for i, part in enumerate(parts):
+                part_pieces = []
+                _subdivide(part, max_vertices, part_pieces)
+                pieces.extend(part_pieces)
+                parent.extend([i] * len(part_pieces))
+        return np.array(pieces, dtype=object), np.array(parent, dtype=np.int64), parts
+
+
+def points_within(points, polygons, max_vertices=256):
+        """
+        Find which points fall within a (dissolved) polygon layer, as a boolean mask
+        ...
+
+        Same result as points.sjoin(polygons, predicate='within'), without building a joined GeoDataFrame.
+
+        Arguments
+        ---------
+        points          : GeoSeries or array of points (e.g. gdf_pop.geometry)
+        polygons        : GeoSeries or array of (multi)polygons in the same CRS (e.g. gdf_ghsl.geometry)
+        max_vertices    : maximum number of vertices of each indexed polygon piece
+
+        Returns
+        -------
+        within          : boolean array, True where the point is within the polygon layer
+
+        """
+        points = np.asarray(points)
+        within = np.zeros(len(points), dtype=bool)
+        pieces, parent, parts = polygon_pieces(polygons, max_vertices)
+        if len(pieces) == 0 or len(points) == 0:
+                return within
+
+        # Bulk query: the points contained by each (prepared) piece, using an STRtree of the points
+        shapely.prepare(pieces)
+        tree = shapely.STRtree(points)
+        piece_idx, point_idx = tree.query(pieces, predicate='contains')
+        within[point_idx] = True
+
+        # Points on the boundary of a piece are either on the polygon boundary (not within), or on a line along which
+        #   a part was subdivided; test these against their parent part
+        piece_idx, point_idx = tree.query(pieces, predicate='touches')
+        outside = ~within[point_idx]
+        piece_idx, point_idx = piece_idx[outside], point_idx[outside]
+        if len(point_idx) > 0:
+                shapely.prepare(parts)
+                within[point_idx[shapely.contains(parts[parent[piece_idx]], points[point_idx])]] = True
+        return within
+
+
+def buffer_membership(points_gdf, value_column='raster_value'):
+        """
+        Incremental test of which points fall within a sequence of buffers of the same cropland (buffer iteration)
+        ...
+
+        Buffers of the same geometry at different radii are (nearly) nested, so between two iterations only points in
+        the ring between the previous and the new buffer can change. Each update only tests the points of the spatial
+        index that intersect the symmetric difference of the two buffers, against the new (prepared) buffer. The
+        points already classified, and their summed value, are kept between updates.
+
+        Arguments
+        ---------
+        points_gdf      : GeoDataFrame of points (e.g. rural WorldPop points); its spatial index is built once and reused
+        value_column    : column of points_gdf summed over the points within the buffer
+
+        Returns
+        -------
+        update          : function taking a buffer (shapely geometry) and returning (within, total), where within is a
+                          boolean array of the points within the buffer and total is the sum of their value_column
+
+        """
+        tree = points_gdf.sindex
+        points = np.asarray(points_gdf.geometry.values)
+        values = points_gdf[value_column].to_numpy(dtype=np.float64)
+        within = np.zeros(len(points), dtype=bool)
+        total = 0.0
+        previous = None
+
+        def update(buffer_geometry):
+                nonlocal total, previous
+                shapely.prepare(buffer_geometry)
+
+                # First buffer: bulk query of the points within the buffer
+                if previous is None:
+                        within[tree.query(buffer_geometry, predicate='contains')] = True
+                        total = values[within].sum()
+                        previous = buffer_geometry
+                        return within, total
+
+                # Points whose membership can have changed: those intersecting the ring between the previous and the
+                #   new buffer (split into small pieces, so each piece only queries the points near it)
+                try:
+                        ring = shapely.symmetric_difference(previous, buffer_geometry)
+                except shapely.errors.GEOSException:
+                        ring = shapely.union(previous, buffer_geometry)         # Overlay failed: re-test all points in either buffer
+                candidates = np.unique(tree.query(polygon_pieces(ring)[0], predicate='intersects')[1])
+
+                now_within = shapely.contains(buffer_geometry, points[candidates])
+                was_within = within[candidates]
+                total = total + values[candidates[now_within & ~was_within]].sum() - values[candidates[was_within & ~now_within]].sum()
+                within[candidates] = now_within
+                previous = buffer_geometry
+                return within, total
+
+        return update
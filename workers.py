@@ -0,0 +1,74 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# WORKERS: Process pools for the stage functions (parallel buffer iteration, tiled vectorisation)
+#   Worker processes are started with 'spawn', which is available on every platform (Windows has no 'fork'). A spawned
+#   worker imports the main module of the process that started it, so a pool started by a script without a __main__
+#   guard (e.g. script 03) would re-run the script in every worker. A pool is therefore run as a pool job in its own
+#   pool host process (python -m workers): the host's main module is this module, so its workers only import this
+#   module and the modules of the worker functions (buffer_tools, raster_tools), as the pipeline's task workers do.
+
+# ==================================================================================================================
+
+import os
+import sys
+import pickle
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Open a pool of spawned worker processes (in a pool job; the worker functions must be module-level functions of an
+#   importable module, and initializer is run once in each worker)
+def spawn_pool(workers, initializer=None, initargs=()):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+                               , initializer=initializer, initargs=initargs)
+
+
+def run_pool_job(job, *args):
+        """
+        Run a pool job in a pool host process (python -m workers) and return its result
+        ...
+
+        Arguments
+        ---------
+        job             : module-level function of an importable module, which opens a pool with spawn_pool
+                          (e.g. buffer_tools.run_buffer_pool)
+        *args           : arguments of job (must be picklable)
+
+        Returns
+        -------
+        result          : result returned by job
+
+        """
+        # The modules of the repository are importable by the pool host, wherever the main script is run from
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__))] + [path for path in [env.get('PYTHONPATH')] if path])
+
+        with tempfile.TemporaryDirectory() as job_folder:
+                job_path = os.path.join(job_folder, 'job.pkl')
+                result_path = os.path.join(job_folder, 'result.pkl')
+                with open(job_path, 'wb') as f:
+                        pickle.dump((job, args), f)
+
+                completed = subprocess.run([sys.executable, '-m', 'workers', job_path, result_path], env=env)
+                if completed.returncode != 0:
+                        raise RuntimeError(f'Pool job {job.__module__}.{job.__name__} failed (see the traceback above).')
+                with open(result_path, 'rb') as f:
+                        return pickle.load(f)
+
+
+# ==================================================================================================================
+# POOL HOST
+
+if __name__ == '__main__':
+        job_path, result_path = sys.argv[1:3]
+        with open(job_path, 'rb') as f:
+                job, args = pickle.load(f)
+        result = job(*args)
+        with open(result_path, 'wb') as f:
+                pickle.dump(result, f)
@@ -0,0 +1,285 @@
+# ==================================================================================================================
+
+# DISSERTATION
+# ZONAL: Raster-native aggregation by district
+#   This script contains the functions used to aggregate the WorldPop grid to district level without
+#   converting pixels into point geometries. District ids and land cover masks are burned onto the
+#   WorldPop grid, and population sums are taken with np.bincount.
+
+# ==================================================================================================================
+
+import math
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.features import rasterize
+from rasterio.warp import reproject, Resampling
+from rasterio.windows import Window
+from scipy.ndimage import distance_transform_edt, find_objects
+
+from raster_tools import open_grid_store, state_window
+from geodesy import metres_per_degree, equal_area_xy
+
+
+# ==================================================================================================================
+# FUNCTIONS
+
+# Read a population raster as float64, setting nodata and negative cells to zero
+#   A grid store (.npy, see raster_tools.write_grid_store) is returned memory-mapped (float32, already cleaned)
+def read_population(pop_path):
+    if pop_path.endswith('.npy'):
+        pop, transform, crs = open_grid_store(pop_path)
+        return pop, transform
+    with rasterio.open(pop_path) as src:
+        pop = src.read(1, masked=True).filled(0).astype(np.float64)
+        transform = src.transform
+    pop[~np.isfinite(pop) | (pop < 0)] = 0
+    return pop, transform
+
+
+# Burn each district's position (1..n) onto the raster grid; 0 = outside all districts
+#   Pixels are assigned when their centre falls inside the polygon, matching sjoin(predicate='within') on pixel centre points
+def rasterise_districts(districts_shp, out_shape, transform):
+    district_shapes = ((geom, i + 1) for i, geom in enumerate(districts_shp.geometry))
+    return rasterize(district_shapes, out_shape=out_shape, transform=transform, fill=0, dtype='int32')
+
+
+# Burn a (dissolved) polygon layer onto the raster grid as a boolean mask
+def rasterise_mask(gdf, out_shape, transform):
+    mask_shapes = [(geom, 1) for geom in gdf.geometry if geom is not None and not geom.is_empty]
+    if len(mask_shapes) == 0:
+        return np.zeros(out_shape, dtype=bool)
+    return rasterize(mask_shapes, out_shape=out_shape, transform=transform, fill=0, dtype='uint8').astype(bool)
+
+
+def zonal_population_sums(pop_path, districts_shp, rural_gdf, crops_gdf):
+        """
+        Sum WorldPop population by district for all, rural and cropland pixels in a single pass
+        ...
+
+        Arguments
+        ---------
+        pop_path        : filepath of WorldPop raster clipped to the state, or of its grid store (.npy)
+        districts_shp   : polygon of district boundaries (must include 'pc11_d_id')
+        rural_gdf       : polygon of GHSL rural areas (dissolved)
+        crops_gdf       : polygon of DynamicWorld cropland (dissolved)
+
+        Returns
+        -------
+        zonal_df        : DataFrame with one row per district: 'pc11_d_id', 'worldpop', 'worldpop_rural', 'worldpop_crop'
+                          Districts with no pixels in a category return NaN (as the sjoin + dissolve method does)
+
+        """
+        pop, transform = read_population(pop_path)
+
+        district_idx = rasterise_districts(districts_shp, pop.shape, transform)
+        rural = rasterise_mask(rural_gdf, pop.shape, transform)
+        crop = rasterise_mask(crops_gdf, pop.shape, transform)
+
+        # Combine district, rural and cropland into one key per pixel: district * 4 + rural + 2 * crop
+        #   Column 0 = neither, 1 = rural only, 2 = cropland only, 3 = rural and cropland
+        n_districts = len(districts_shp)
+        key = district_idx.astype(np.int64) * 4 + rural + crop * 2
+        key = key.ravel()
+        sums = np.bincount(key, weights=pop.ravel(), minlength=(n_districts + 1) * 4).reshape(-1, 4)[1:]
+        counts = np.bincount(key, minlength=(n_districts + 1) * 4).reshape(-1, 4)[1:]
+
+        worldpop = sums.sum(axis=1)
+        worldpop_rural = sums[:, 1] + sums[:, 3]
+        worldpop_crop = sums[:, 2] + sums[:, 3]
+
+        zonal_df = pd.DataFrame({'pc11_d_id': districts_shp['pc11_d_id'].values,
+                                 'worldpop': np.where(counts.sum(axis=1) > 0, worldpop, np.nan),
+                                 'worldpop_rural': np.where(counts[:, 1] + counts[:, 3] > 0, worldpop_rural, np.nan),
+                                 'worldpop_crop': np.where(counts[:, 2] + counts[:, 3] > 0, worldpop_crop, np.nan)})
+        zonal_df[['worldpop', 'worldpop_rural', 'worldpop_crop']] = zonal_df[['worldpop', 'worldpop_rural', 'worldpop_crop']].round()
+        return zonal_df
+
+
+# Area (km2) of the cells of each row of a grid in EPSG:4326
+#   The cell width and the height of each row are measured on the cylindrical equal-area grid of the WGS84 ellipsoid
+#   (geodesy.equal_area_xy), so that their product is the area of the cell on the ellipsoid
+def row_cell_areas_km2(transform, n_rows):
+    x, y = equal_area_xy(np.array([0, transform.a]), transform.f + transform.e * np.arange(n_rows + 1))
+    return abs(x[1] - x[0]) * np.abs(np.diff(y))
+
+
+def class_area_by_district(raster_path, districts_shp, target_classes, block_rows=1024):
+        """
+        Calculate the area (km2) of each district, and of the target classes of a raster within each district, from pixel counts
+        ...
+
+        District ids are burned onto the raster grid (pixel centres, as rasterise_districts) within the state window,
+        block by block. Pixels are counted by district and row, and weighted by the area of the cells of their row, so
+        no polygon intersection is needed.
+
+        Arguments
+        ---------
+        raster_path     : filepath of classified raster in EPSG:4326 (e.g. DynamicWorld cropland, GHSL clipped to state)
+        districts_shp   : polygon of district boundaries (must include 'pc11_d_id')
+        target_classes  : list of raster values counted (e.g. [1] for cropland, [11, 12, 13, 21] for GHSL rural)
+        block_rows      : number of rows read at a time
+
+        Returns
+        -------
+        area_df         : DataFrame with one row per district: 'pc11_d_id', 'district_area', 'class_area' (km2)
+
+        """
+        n_districts = len(districts_shp)
+        district_shapes = [(geom, i + 1) for i, geom in enumerate(districts_shp.geometry)]
+        district_area = np.zeros(n_districts + 1)
+        class_area = np.zeros(n_districts + 1)
+
+        with rasterio.open(raster_path) as src:
+                window = state_window(src, districts_shp.total_bounds)
+                window_transform = src.window_transform(window)
+                row_areas = row_cell_areas_km2(window_transform, int(window.height))
+
+                for row_start in range(0, int(window.height), block_rows):
+                        n_rows = min(block_rows, int(window.height) - row_start)
+                        block_window = Window(window.col_off, window.row_off + row_start, window.width, n_rows)
+                        block = src.read(1, window=block_window)
+                        district_idx = rasterize(district_shapes, out_shape=block.shape, transform=src.window_transform(block_window)
+                                                 , fill=0, dtype='int32')
+
+                        # Pixel counts by (district, row), weighted by the cell area of the row
+                        block_areas = row_areas[row_start:row_start + n_rows]
+                        key = district_idx * n_rows + np.arange(n_rows)[:, None]
+                        counts = np.bincount(key.ravel(), minlength=(n_districts + 1) * n_rows).reshape(-1, n_rows)
+                        district_area += counts @ block_areas
+                        in_class = np.isin(block, target_classes)
+                        counts = np.bincount(key[in_class], minlength=(n_districts + 1) * n_rows).reshape(-1, n_rows)
+                        class_area += counts @ block_areas
+
+        return pd.DataFrame({'pc11_d_id': districts_shp['pc11_d_id'].values
+                             , 'district_area': district_area[1:], 'class_area': class_area[1:]})
+
+
+# Resample a classified raster onto the target grid (nearest neighbour) and return a mask of the target class values
+def read_mask_on_grid(raster_path, target_classes, out_shape, transform, crs):
+    classes = np.zeros(out_shape, dtype=np.uint8)
+    with rasterio.open(raster_path) as src:
+        reproject(source=rasterio.band(src, 1)
+                  , destination=classes
+                  , src_transform=src.transform
+                  , src_crs=src.crs
+                  , dst_transform=transform
+                  , dst_crs=crs
+                  , resampling=Resampling.nearest)
+    return np.isin(classes, target_classes)
+
+
+# Size (m) of a grid cell in the y and x directions, at the mid-latitude of the grid (WGS84 ellipsoid)
+def cell_size_m(transform, n_rows):
+    m_per_deg_lat, m_per_deg_lon = metres_per_degree(transform.f + transform.e * n_rows / 2)
+    return abs(transform.e) * m_per_deg_lat, abs(transform.a) * m_per_deg_lon
+
+
+# Signed distance (m) from every cell centre to the edge of a mask: positive outside the mask, negative inside
+def mask_signed_distance(mask, dy, dx):
+    half_cell = (dx + dy) / 4           # distance from a cell centre to the cell edge
+    if not mask.any():
+        return np.full(mask.shape, np.inf)
+    outside = distance_transform_edt(~mask, sampling=(dy, dx)) - half_cell      # distance to nearest mask edge
+    if mask.all():
+        inside = np.full(mask.shape, np.inf)
+    else:
+        inside = distance_transform_edt(mask, sampling=(dy, dx)) - half_cell    # distance to nearest non-mask edge
+    return np.where(mask, -inside, outside)
+
+
+def signed_distance_to_cropland(crop_mask, transform, district_idx=None):
+        """
+        Calculate the signed distance (m) from every cell centre to the edge of the cropland area
+        ...
+
+        With district_idx, the distance is measured to the cropland of the cell's own district only (cropland clipped
+        to the district, as in the vector buffer method), so cropland across a district border is neither buffered
+        into a district nor counted when cropland is subtracted. Each district is processed on its bounding box.
+
+        Arguments
+        ---------
+        crop_mask       : boolean array of cropland cells (on the WorldPop grid)
+        transform       : affine transform of the grid (EPSG:4326)
+        district_idx    : district position (1..n) of each cell (see rasterise_districts); None = state-wide cropland
+
+        Returns
+        -------
+        distance        : array of distances (m); positive outside cropland, negative inside cropland
+                          A cell falls inside a buffer of radius r (negative = subtracted) when distance <= r
+                          With district_idx, cells outside all districts have an infinite distance
+
+        """
+        dy, dx = cell_size_m(transform, crop_mask.shape[0])
+        if district_idx is None:
+                return mask_signed_distance(crop_mask, dy, dx)
+
+        distance = np.full(crop_mask.shape, np.inf)
+        for i, window in enumerate(find_objects(district_idx)):
+                if window is None:
+                        continue
+                in_district = district_idx[window] == i + 1
+                # Pad by one cell: the cells beyond the bounding box are outside the district (not cropland)
+                district_crop = np.pad(crop_mask[window] & in_district, 1, constant_values=False)
+                district_distance = mask_signed_distance(district_crop, dy, dx)[1:-1, 1:-1]
+                distance[window] = np.where(in_district, district_distance, distance[window])
+        return distance
+
+
+def buffer_population_curves(distance, pop, rural_mask, district_idx, district_ids):
+        """
+        Build the cumulative (rural) population against buffer radius for each district, in a single sort
+        ...
+
+        Arguments
+        ---------
+        distance        : signed distance (m) from each cell to the cropland edge (see signed_distance_to_cropland)
+        pop             : WorldPop population array
+        rural_mask      : boolean array of GHSL rural cells
+        district_idx    : district position (1..n) of each cell (see rasterise_districts); 0 = outside all districts
+        district_ids    : list of district codes, in the order used for district_idx
+
+        Returns
+        -------
+        buffer_curves   : dictionary of district code -> (sorted distances, cumulative population)
+                          The rural population within radius r is the cumulative population at the last distance <= r
+
+        """
+        valid = rural_mask & (district_idx > 0) & (pop > 0)
+        d_idx = district_idx[valid]
+        d_dist = distance[valid]
+        d_pop = pop[valid].astype(np.float64)
+
+        # Sort cells by district, then by distance
+        order = np.lexsort((d_dist, d_idx))
+        d_idx, d_dist, d_pop = d_idx[order], d_dist[order], d_pop[order]
+        bounds = np.searchsorted(d_idx, np.arange(1, len(district_ids) + 2))
+
+        buffer_curves = {}
+        for i, district_code in enumerate(district_ids):
+                start, end = bounds[i], bounds[i + 1]
+                buffer_curves[district_code] = (d_dist[start:end], np.cumsum(d_pop[start:end]))
+        return buffer_curves
+
+
+# Rural population within a buffer of (signed) radius r, from a district's buffer curve
+def buffered_population(curve, radius):
+    distances, cumulative_pop = curve
+    n_cells = np.searchsorted(distances, radius, side='right')
+    return float(cumulative_pop[n_cells - 1]) if n_cells > 0 else 0.0
+
+
+# Binary search of a district's buffer curve for the (whole metre) radius whose population is closest to the target
+def radius_for_target(curve, target_pop):
+    distances, cumulative_pop = curve
+    if len(cumulative_pop) == 0:
+        return 0, 0.0
+    idx = np.searchsorted(cumulative_pop, target_pop)
+    candidates = [c for c in (idx - 1, idx) if 0 <= c < len(cumulative_pop)]
+    best = min(candidates, key=lambda c: abs(cumulative_pop[c] - target_pop))
+    if target_pop < cumulative_pop[0] / 2:
+        radius = math.floor(distances[0]) - 1            # buffer excludes every rural cell
+    else:
+        radius = math.ceil(distances[best])
+    return radius, buffered_population(curve, radius)